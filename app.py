@@ -4,11 +4,22 @@ Script to define the moitoring and reporting API serving the trained model.
 Author: Paulo Souza
 Date: Mar 2023
 """
-from flask import Flask, request
+from flask import Flask, Response, abort, request
 from diagnostics import *
 from scoring import score_model
+from dataloader import dataset_fingerprint, ingested_data_path
+from modelartifact import load_model, model_cache, model_version
+from payloads import encode_frame, encode_ndjson, frame_dtype, parse_records
+from batching import MicroBatcher
+from instrumentation import metrics_log_path, set_enabled
+from resultcache import ResultCache, file_stamp, result_key
+from sqlitestore import is_store
+from typing import Any, Callable, Optional, Tuple
+import itertools
 import json
 import os
+import numpy as np
+import pandas as pd
 
 
 app = Flask(__name__)
@@ -18,36 +29,238 @@ with open('config.json','r') as f:
     config = json.load(f)
 dataset_csv_path = os.path.join(config['output_folder_path'])
 prod_deployment_path = os.path.join(config['prod_deployment_path'])
+model_path = os.path.join(config['output_model_path'])
+test_data_path = os.path.join(config['test_data_path'])
+
+# the pipeline stages called by the endpoints would log a record per request
+# and keep invalidating the cached diagnostics, which report the timings of
+# the pipeline runs
+set_enabled(config.get('instrument_requests', False))
+
+result_cache = ResultCache()
+
+def cached_result(inputs: Callable[[], Tuple]) -> Tuple[str, Response]:
+    '''
+    Looks up the cached result of the current request, keyed by the inputs
+    it is computed from and the request parameters. The key is the result's
+    ETag, so a client sending it back in If-None-Match gets a 304 while the
+    entry lives.
+
+    Returns
+        etag: str
+            The key of the result.
+        response: Response
+            The cached response, or None when the result must be computed.
+    '''
+    etag = result_key(
+        request.path, sorted(request.args.items(multi=True)), inputs()
+    )
+    entry = result_cache.get(etag)
+    if entry is None:
+        return etag, None
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(entry[0], mimetype=entry[1])
+    response.set_etag(etag)
+    return etag, response
+
+def cache_result(etag: str, result: Any) -> Response:
+    '''
+    Stores a computed result under its key and returns it with its ETag.
+    '''
+    response = app.make_response(result)
+    result_cache.put(etag, response.get_data(), response.mimetype)
+    response.set_etag(etag)
+    return response
+
+def scoring_inputs() -> Tuple:
+    '''
+    Identifies the inputs of /scoring: the trained model and the test data.
+    '''
+    return (
+        model_version(load_model(model_path)),
+        dataset_fingerprint(test_data_path)
+    )
+
+def stats_inputs() -> Tuple:
+    '''
+    Identifies the inputs of /summarystats: the ingested data.
+    '''
+    return (dataset_fingerprint(ingested_data_path),)
+
+def diagnostics_inputs() -> Tuple:
+    '''
+    Identifies the inputs of /diagnostics: the ingested data, the metrics
+    log and the cached dependency check.
+    '''
+    return (
+        dataset_fingerprint(ingested_data_path),
+        file_stamp(metrics_log_path),
+        file_stamp('dependency_check.csv')
+    )
+
+def predict_records(records: pd.DataFrame) -> np.ndarray:
+    '''
+    Predicts records with the deployed model.
+    '''
+    return load_model(prod_deployment_path).predict(records)
+
+def validate_records(records: pd.DataFrame) -> pd.DataFrame:
+    '''
+    Checks records against the deployed model before they are batched with
+    other requests, where missing columns would be padded with NaN.
+
+    Returns
+        records: pd.DataFrame
+            The columns the model reads, in its order.
+    Raises
+        KeyError: when some of the model's columns are missing.
+        ValueError: when some feature isn't numeric or has missing values.
+    '''
+    model = load_model(prod_deployment_path)
+    if model.feature_names_in_ is None:
+        # models fitted on bare arrays take the columns as they come
+        return records
+    features = [str(el) for el in model.feature_names_in_]
+    columns = list(getattr(model, 'routing_columns', ())) + features
+    missing = [el for el in columns if el not in records.columns]
+    if missing:
+        raise KeyError(missing)
+    invalid = [
+        el for el in features
+        if not pd.api.types.is_numeric_dtype(records[el])
+    ]
+    if invalid:
+        raise ValueError(f'non-numeric features {invalid}')
+    if not np.isfinite(records[features].to_numpy(dtype='float64')).all():
+        raise ValueError('missing or infinite feature values')
+    return records[columns]
+
+batcher = MicroBatcher(predict_records, validate=validate_records)
+
+def check_data_path(data_path: Optional[str]) -> None:
+    '''
+    Answers 400 when no data_path was given and 404 when it is neither a
+    folder nor a SQLite store.
+    '''
+    if not data_path:
+        abort(400, 'Missing data_path')
+    if not (os.path.isdir(data_path) or is_store(data_path)):
+        abort(404, f'No dataset at {data_path}')
+
+def stream_predictions(data_path: str) -> Response:
+    '''
+    Streams the predictions over a test data folder chunk by chunk, as
+    NDJSON lines or, with format=binary, length-prefixed binary frames whose
+    dtype is given in the X-Prediction-Dtype header. Repeated rows are
+    dropped, as without stream=1, which keeps the fingerprint of every row
+    in memory; dedup=0 keeps them, so memory use no longer grows with the
+    dataset. The model is loaded and the first chunk predicted before the
+    response starts, so a dataset the model can't read gets an error status
+    rather than a truncated stream.
+    '''
+    stream_format = request.args.get('format', 'ndjson')
+    if stream_format not in ('ndjson', 'binary'):
+        abort(400, f'Unsupported stream format: {stream_format}')
+    model = load_model(prod_deployment_path)
+    chunks = iter_model_predictions(
+        data_path=data_path, deduplicate=request.args.get('dedup') != '0'
+    )
+    try:
+        first = next(chunks, None)
+    except KeyError as error:
+        abort(400, f'Missing columns: {error}')
+    except (ValueError, TypeError) as error:
+        abort(400, f'Invalid records: {error}')
+    if first is not None:
+        chunks = itertools.chain([first], chunks)
+    if stream_format == 'binary':
+        dtype = frame_dtype(model.classes_)
+        return Response(
+            (encode_frame(el, dtype) for el in chunks),
+            mimetype='application/octet-stream',
+            headers={'X-Prediction-Dtype': dtype.str}
+        )
+    return Response(
+        (encode_ndjson(el) for el in chunks),
+        mimetype='application/x-ndjson'
+    )
 
 @app.route("/prediction", methods=['GET', 'POST','OPTIONS'])
 def predict():
     '''
-    Returns predictions from the deployed model over the given test data.
+    Returns predictions from the deployed model over the records sent in the
+    request body, as JSON rows, CSV or .npz columns, or else over the test
+    data found in the data_path folder. Concurrent requests with records are
+    predicted together by the micro-batcher. With stream=1, the predictions
+    over the data_path folder are streamed as they are computed, see
+    stream_predictions.
 
     Returns
         preds: List
             A list containing the model predictions for the given test data.
     '''
+    if request.content_length:
+        try:
+            records = parse_records(request.get_data(), request.mimetype)
+        except ValueError as error:
+            abort(400, str(error))
+        try:
+            preds = batcher.submit(records)
+        except KeyError as error:
+            abort(400, f'Missing columns: {error}')
+        except (ValueError, TypeError) as error:
+            abort(400, f'Invalid records: {error}')
+        return preds.tolist()
+
     data_path = request.args.get('data_path')
+    check_data_path(data_path)
+    if request.args.get('stream') == '1':
+        return stream_predictions(data_path)
     print(os.getcwd())
-    preds = model_predictions(data_path=data_path)
+    try:
+        preds = model_predictions(data_path=data_path)
+    except ValueError as error:
+        abort(400, str(error))
     return preds
 
+@app.route("/modelinfo", methods=['GET','OPTIONS'])
+def model_info():
+    '''
+    Returns the version of the deployed model held in memory, checking
+    first whether a new one was published.
+
+    Returns
+        info: Dict
+            The model version, a hash of its parameters, the file it was
+            loaded from, when it was loaded, how long loading took and how
+            many times it was loaded by this process.
+    '''
+    load_model(prod_deployment_path)
+    return model_cache.info(prod_deployment_path)
+
 @app.route("/scoring", methods=['GET','OPTIONS'])
 def scoring():
     '''
     Returns the scoring performance obtained by the depoloyed model.
 
+    The result is cached until the model or the test data change.
+
     Returns
         f1: float
             F1-score obtained by the trained model over the test data.
     '''
-    return str(score_model())
+    etag, response = cached_result(scoring_inputs)
+    if response is not None:
+        return response
+    return cache_result(etag, str(score_model()))
 
 @app.route("/summarystats", methods=['GET','OPTIONS'])
 def stats():
     '''
-    Checks means, medians, and std for each numeric column.
+    Checks means, medians, and std for each numeric column. The result is
+    cached until the ingested data change.
 
     Returns
         statistic_list: List[List]
@@ -55,31 +268,42 @@ def stats():
             present in the given dataset. The metrics are displayed in the
             following order: [[mean, median, std],...]
     '''
-    return dataframe_summary()
+    etag, response = cached_result(stats_inputs)
+    if response is not None:
+        return response
+    return cache_result(etag, dataframe_summary())
 
 @app.route("/diagnostics", methods=['GET','OPTIONS'])
 async def diagnostics():
     '''
-    Checks timing and percent NA values.
+    Checks timing and percent NA values. The result is cached until the
+    ingested data, the metrics log or the dependency check change.
 
     Returns
         data_integrity: List
             The percentages of missing observations in each numeric column of
             the given dataset.
-        timings: List
-            A list with the timings of each process step, in seconds.
+        timings: List[Dict]
+            The latest metrics record of each pipeline step, with its wall
+            and CPU times, peak RSS and number of rows processed.
     '''
+    etag, response = cached_result(diagnostics_inputs)
+    if response is not None:
+        return response
     data_integrity = check_data_integrity()
     timings = execution_time()
     dependencies = await async_outdated_packages_list()
 
-    return [
+    # computing appends to the metrics log, so the result is keyed by the
+    # inputs as they are once it is computed
+    etag, _ = cached_result(diagnostics_inputs)
+    return cache_result(etag, [
         data_integrity,
         '-----------------------',
         timings,
         '-----------------------',
         dependencies
-    ]
+    ])
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=8000, debug=True, threaded=True)
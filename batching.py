@@ -0,0 +1,162 @@
+"""
+Request micro-batching for online predictions. Requests submitted within
+"batch_window_ms" of the first one waiting are coalesced into a single
+vectorized model call, up to "batch_max_rows" rows, and every caller gets
+its own slice of the result back. The window is only waited for while
+requests keep arriving concurrently, so a lone client isn't delayed.
+Requests are validated before they are queued, and only requests with the
+same columns are predicted together, so a malformed request can't be padded
+into a valid-looking one.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import json
+import time
+import queue
+import threading
+import numpy as np
+import pandas as pd
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+with open('config.json','r') as f:
+    config = json.load(f)
+
+batch_window_ms = config.get('batch_window_ms', 2)
+batch_max_rows = config.get('batch_max_rows', 65536)
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent prediction requests into batches predicted by a
+    background thread.
+    """
+
+    def __init__(
+        self,
+        predict: Callable[[pd.DataFrame], np.ndarray],
+        window_ms: float = batch_window_ms,
+        max_rows: int = batch_max_rows,
+        validate: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None
+    ):
+        """
+        Args:
+            predict: Callable
+                Predicts a frame of records, returning one value per row.
+            window_ms: float
+                How long the first request of a batch waits for others, in
+                milliseconds. With 0 every request is predicted on its own,
+                in the caller's thread.
+            max_rows: int
+                Number of rows after which a batch is predicted without
+                waiting for the window to end.
+            validate: Callable
+                Checks the records of a request in the caller's thread,
+                raising on malformed ones, and returns the records to be
+                predicted.
+        """
+        self.predict = predict
+        self.validate = validate
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self._queue = queue.Queue()
+        self._concurrent = False
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        records: pd.DataFrame,
+        timeout: Optional[float] = None
+    ) -> np.ndarray:
+        """
+        Predicts the given records along with the other requests of their
+        batch.
+
+        Args:
+            records: pd.DataFrame
+                The records to be predicted.
+            timeout: float
+                Seconds to wait for the prediction.
+        Returns:
+            preds: np.ndarray
+                The predictions of the given records.
+        Raises:
+            Exception:
+                What validate or predict raise for the given records.
+        """
+        if self.validate is not None:
+            records = self.validate(records)
+        if self.window <= 0:
+            return self.predict(records)
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='MicroBatcher', daemon=True
+                )
+                self._thread.start()
+        future = Future()
+        self._queue.put((records, future))
+        return future.result(timeout)
+
+    def _collect(self) -> list:
+        """
+        Waits for a request, then gathers the ones already queued and, when
+        the previous batch had more than one request, the ones arriving
+        within the window after it.
+        """
+        batch = [self._queue.get()]
+        rows = len(batch[0][0])
+        deadline = time.monotonic() + self.window
+        while rows < self.max_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                if self._concurrent and remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+            rows += len(batch[-1][0])
+        self._concurrent = len(batch) > 1
+        return batch
+
+    def _run(self) -> None:
+        """
+        Predicts batches for as long as the process runs.
+        """
+        while True:
+            groups = {}
+            for records, future in self._collect():
+                # concatenating frames with other columns would pad the
+                # missing ones with NaN
+                groups.setdefault(tuple(records.columns), []).append(
+                    (records, future)
+                )
+            for batch in groups.values():
+                self._predict_batch(batch)
+
+    def _predict_batch(self, batch: list) -> None:
+        """
+        Predicts requests with the same columns in a single model call, and
+        each on its own when that call fails.
+        """
+        frames = [records for records, _ in batch]
+        try:
+            preds = self.predict(
+                pd.concat(frames, ignore_index=True)
+                if len(frames) > 1 else frames[0]
+            )
+        except Exception:
+            # a malformed request must not fail the others of its batch
+            for records, future in batch:
+                try:
+                    future.set_result(self.predict(records))
+                except Exception as error:
+                    future.set_exception(error)
+            return
+        offsets = np.cumsum([0] + [len(el) for el in frames])
+        for (_, future), start, stop in zip(batch, offsets[:-1], offsets[1:]):
+            future.set_result(preds[start:stop])
@@ -0,0 +1,110 @@
+"""
+Synthetic dataset generator following the project's schema:
+corporation, lastmonth_activity, lastyear_activity, number_of_employees,
+exited.
+
+Rows are written in chunks, so datasets far larger than memory can be
+generated. A share of the rows, set by `duplicate_ratio`, are exact copies of
+rows generated earlier, possibly in other files, to exercise deduplication.
+
+Run from the project root:
+    python -m benchmarks.datagen sourcedata_big --rows 10000000 --files 100
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+LETTERS = np.array(list('abcdefghijklmnopqrstuvwxyz'))
+
+
+def random_rows(rng: np.random.Generator, rows: int) -> pd.DataFrame:
+    """
+    Generates `rows` random records. `exited` follows a logistic model of the
+    activity columns, so trained models have some signal to pick up.
+    """
+    corporation = LETTERS[rng.integers(0, 26, (rows, 4))]
+    lastmonth = rng.gamma(1.5, 60, rows).astype('int64')
+    lastyear = rng.gamma(1.5, 600, rows).astype('int64')
+    employees = rng.lognormal(4, 1.5, rows).astype('int64') + 1
+    logit = 1.5 - 0.02 * lastmonth - 0.001 * lastyear + 0.0001 * employees
+    exited = (rng.random(rows) < 1 / (1 + np.exp(-logit))).astype('int64')
+    return pd.DataFrame({
+        'corporation': [''.join(el) for el in corporation],
+        'lastmonth_activity': lastmonth,
+        'lastyear_activity': lastyear,
+        'number_of_employees': employees,
+        'exited': exited
+    })
+
+
+def generate(
+    folder: str,
+    rows: int,
+    files: int = 1,
+    duplicate_ratio: float = 0.0,
+    seed: int = 42,
+    chunksize: int = 1000000,
+    prefix: str = 'dataset'
+) -> None:
+    """
+    Writes `rows` records split evenly across `files` csv files.
+
+    Args:
+        folder: str
+            Folder the datasets are written to. Created when missing.
+        rows: int
+            Total number of rows, duplicates included.
+        files: int
+            Number of csv files.
+        duplicate_ratio: float
+            Share of the rows that repeat a previously generated row.
+        seed: int
+            Seed of the random generator.
+        chunksize: int
+            Number of rows generated and written at a time.
+        prefix: str
+            Prefix of the generated file names.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    pool = None
+    for i in range(files):
+        file_rows = rows // files + (1 if i < rows % files else 0)
+        path = os.path.join(folder, f'{prefix}{i:05d}.csv')
+        with open(path, 'w', newline='') as f:
+            header = True
+            while file_rows > 0:
+                n = min(chunksize, file_rows)
+                chunk = random_rows(rng, n)
+                if duplicate_ratio > 0:
+                    source = chunk.copy() if pool is None else pool
+                    dups = rng.random(n) < duplicate_ratio
+                    picks = rng.integers(0, source.shape[0], int(dups.sum()))
+                    for col in chunk.columns:
+                        chunk.loc[dups, col] = source[col].to_numpy()[picks]
+                pool = chunk.iloc[:100000].reset_index(drop=True)
+                chunk.to_csv(f, header=header, index=False)
+                header = False
+                file_rows -= n
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('folder')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    generate(
+        args.folder, args.rows, args.files, args.duplicate_ratio, args.seed
+    )
+
+
+if __name__ == '__main__':
+    main()
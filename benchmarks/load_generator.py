@@ -0,0 +1,132 @@
+"""
+Load generator for the /prediction endpoint. Concurrent clients post records
+in the request body for a fixed duration, and the requests per second and
+latency percentiles are reported.
+
+Start the threaded server first, then run from the project root:
+    python app.py
+    python -m benchmarks.load_generator --clients 1 8 32 --format json
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import json
+import time
+import argparse
+import threading
+import urllib.request
+import numpy as np
+from typing import Dict, List
+from benchmarks.datagen import random_rows
+from payloads import encode_npz
+
+CONTENT_TYPES = {
+    'json': 'application/json',
+    'csv': 'text/csv',
+    'npz': 'application/x-npz'
+}
+
+
+def make_body(rows: int, body_format: str, seed: int = 42) -> bytes:
+    """
+    Builds a request body with `rows` random records.
+    """
+    records = random_rows(np.random.default_rng(seed), rows)
+    records = records.drop('exited', axis=1)
+    if body_format == 'json':
+        return records.to_json(orient='records').encode()
+    if body_format == 'csv':
+        return records.to_csv(index=False).encode()
+    return encode_npz(records)
+
+
+def run_clients(
+    url: str,
+    body: bytes,
+    content_type: str,
+    clients: int,
+    duration: float
+) -> Dict:
+    """
+    Posts `body` from `clients` threads for `duration` seconds.
+
+    Returns:
+        results: Dict
+            Requests per second, latency percentiles in milliseconds and
+            number of failed requests.
+    """
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    stop = time.perf_counter() + duration
+
+    def client() -> None:
+        own, failed = [], 0
+        while time.perf_counter() < stop:
+            req = urllib.request.Request(
+                url, data=body, headers={'Content-Type': content_type}
+            )
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req) as response:
+                    response.read()
+                own.append(time.perf_counter() - start)
+            except OSError:
+                failed += 1
+        with lock:
+            latencies.extend(own)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    millis = np.array(latencies) * 1000
+    return {
+        'clients': clients,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'rps': len(latencies) / elapsed,
+        'p50_ms': float(np.percentile(millis, 50)) if len(millis) else None,
+        'p95_ms': float(np.percentile(millis, 95)) if len(millis) else None,
+        'p99_ms': float(np.percentile(millis, 99)) if len(millis) else None
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000/prediction')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--rows', type=int, default=10)
+    parser.add_argument(
+        '--format', choices=list(CONTENT_TYPES), default='json'
+    )
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    body = make_body(args.rows, args.format)
+    print('clients  requests  errors       rps   p50_ms   p95_ms   p99_ms')
+    results = []
+    for clients in args.clients:
+        result = run_clients(
+            args.url, body, CONTENT_TYPES[args.format], clients, args.duration
+        )
+        results.append(result)
+        print(
+            f"{clients:7d}  {result['requests']:8d}  {result['errors']:6d}  "
+            f"{result['rps']:8.1f}  {result['p50_ms'] or 0:7.2f}  "
+            f"{result['p95_ms'] or 0:7.2f}  {result['p99_ms'] or 0:7.2f}"
+        )
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
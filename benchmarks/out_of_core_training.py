@@ -0,0 +1,67 @@
+"""
+Compares the F1-score of the in-memory and out-of-core training modes on
+synthetic datasets.
+
+Run from the project root:
+    python -m benchmarks.out_of_core_training --rows 100000 1000000
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+from benchmarks.suite import REPO_ROOT, prepare_workspace
+
+INGEST = 'import ingestion; ingestion.full_ingestion()'
+TRAIN_AND_SCORE = """
+import sys, training, scoring
+training.train_model(mode=sys.argv[1])
+print(scoring.score_model())
+"""
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--rows', type=float, nargs='+', default=[1e4, 1e5, 1e6]
+    )
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05)
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    print('rows          memory_f1  out_of_core_f1  f1_diff')
+    for rows in [int(el) for el in args.rows]:
+        workdir = tempfile.mkdtemp(prefix='bench_')
+        try:
+            prepare_workspace(
+                workdir, rows, args.files, args.duplicate_ratio
+            )
+            subprocess.run(
+                [sys.executable, '-c', INGEST],
+                cwd=workdir, env=env, check=True
+            )
+            f1 = {}
+            for mode in ('memory', 'out_of_core'):
+                output = subprocess.run(
+                    [sys.executable, '-c', TRAIN_AND_SCORE, mode],
+                    cwd=workdir, env=env, check=True,
+                    capture_output=True, text=True
+                ).stdout
+                f1[mode] = float(output.strip().splitlines()[-1])
+            print(
+                f"{rows:<12d}  {f1['memory']:9.4f}  "
+                f"{f1['out_of_core']:14.4f}  "
+                f"{f1['out_of_core'] - f1['memory']:+7.4f}"
+            )
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""
+Benchmarks serial versus process-pool parsing of a folder of csv files.
+
+Run from the project root:
+    python -m benchmarks.parallel_parsing --files 64 --rows 200000
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import argparse
+import tempfile
+import timeit
+from dataloader import read_csv_files
+from benchmarks.datagen import generate
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--files', type=int, default=64)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        generate(folder, args.files * args.rows, args.files)
+        baseline = None
+        reference = None
+        print('workers  best_time_s  speedup')
+        for workers in args.workers:
+            timings = []
+            for _ in range(args.repeat):
+                start = timeit.default_timer()
+                final = read_csv_files(folder, workers)
+                final = final.drop_duplicates()
+                timings.append(timeit.default_timer() - start)
+            if reference is None:
+                reference = final
+            elif not reference.equals(final):
+                raise AssertionError(f'{workers} workers changed the result')
+            best = min(timings)
+            baseline = baseline or best
+            print(f'{workers:7d}  {best:11.3f}  {baseline / best:6.2f}x')
+
+
+if __name__ == '__main__':
+    main()
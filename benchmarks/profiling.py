@@ -0,0 +1,99 @@
+"""
+Compares the single-pass data profile with the per-column pandas loops it
+replaced in dataframe_summary and check_data_integrity, and checks that
+their statistics agree.
+
+Run from the project root:
+    python -m benchmarks.profiling --rows 100000 10000000
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from benchmarks.datagen import random_rows
+from profiling import profile_frame
+from schema import apply_schema, subset_schema
+
+
+def numeric_frame(rows: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Generates `rows` random records without the corporation column, with the
+    declared dtypes.
+    """
+    rng = np.random.default_rng(seed)
+    frames = []
+    for start in range(0, rows, 1000000):
+        frame = random_rows(rng, min(1000000, rows - start))
+        frames.append(frame.drop('corporation', axis=1))
+    final = pd.concat(frames, ignore_index=True)
+    return apply_schema(final, subset_schema(final.columns), 'benchmark')
+
+
+def column_loops(final: pd.DataFrame) -> tuple:
+    """
+    The statistics as they were computed before, one call per column and
+    metric.
+    """
+    statistic_list = []
+    for col in final.columns.tolist():
+        statistic_list.append(
+            [final[col].mean(), final[col].median(), final[col].std()]
+        )
+    data_integrity = []
+    for col in final.columns.tolist():
+        data_integrity.append(
+            round(final[col].isna().sum() / final.shape[0], 2)
+        )
+    return statistic_list, data_integrity
+
+
+def single_pass(final: pd.DataFrame) -> tuple:
+    """
+    The same statistics taken from one profile.
+    """
+    profile = profile_frame(final)
+    return (
+        profile[['mean', 'median', 'std']].to_numpy().tolist(),
+        profile['missing_ratio'].round(2).tolist()
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--rows', type=float, nargs='+', default=[1e5, 1e6, 1e7]
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    print('rows       loops_s   profile_s  speedup  max_rel_diff')
+    for rows in [int(el) for el in args.rows]:
+        final = numeric_frame(rows)
+        timings = {}
+        for name, function in (
+            ('loops', column_loops), ('profile', single_pass)
+        ):
+            best = float('inf')
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                result = function(final)
+                best = min(best, time.perf_counter() - start)
+            timings[name] = (best, result)
+        expected = np.array(timings['loops'][1][0], dtype='float64')
+        got = np.array(timings['profile'][1][0], dtype='float64')
+        diff = np.max(np.abs(got - expected) / np.maximum(np.abs(expected), 1))
+        assert timings['loops'][1][1] == timings['profile'][1][1]
+        print(
+            f"{rows:<9d}  {timings['loops'][0]:8.3f}  "
+            f"{timings['profile'][0]:9.3f}  "
+            f"{timings['loops'][0] / timings['profile'][0]:7.2f}  "
+            f'{diff:12.2e}'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Measures the prediction throughput, in rows per second, of the NumPy scoring
+engine against sklearn's predict, and checks that their labels agree.
+
+Run from the project root:
+    python -m benchmarks.scoring_engine --rows 1000 100000 1000000
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import time
+import argparse
+import numpy as np
+from typing import Callable
+from sklearn.linear_model import LogisticRegression
+from benchmarks.datagen import random_rows
+from modelartifact import LinearPredictor
+from training import model_params
+
+
+def throughput(predict: Callable, rows: int, seconds: float = 1.0) -> float:
+    """
+    Calls `predict` repeatedly for about `seconds` and returns the rows
+    predicted per second.
+    """
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        predict()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed >= seconds:
+            return calls * rows / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--rows', type=float, nargs='+', default=[1e2, 1e4, 1e6]
+    )
+    parser.add_argument('--chunksize', type=int, default=16384)
+    parser.add_argument('--seconds', type=float, default=1.0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(42)
+    train = random_rows(rng, 100000).drop('corporation', axis=1)
+    lr = LogisticRegression(**model_params())
+    lr.fit(train.drop('exited', axis=1), train['exited'])
+    engines = {
+        dtype: LinearPredictor.from_estimator(
+            lr, chunksize=args.chunksize, dtype=dtype
+        )
+        for dtype in ('float64', 'float32')
+    }
+
+    print('rows       sklearn_df   engine_df    engine_f64   engine_f32  '
+          'f64_diff  f32_diff')
+    for rows in [int(el) for el in args.rows]:
+        frame = random_rows(rng, rows).drop(['corporation', 'exited'], axis=1)
+        x = np.ascontiguousarray(frame.to_numpy(dtype='float64'))
+        expected = lr.predict(frame)
+        diff = {
+            dtype: int((engine.predict(x) != expected).sum())
+            for dtype, engine in engines.items()
+        }
+        x32 = x.astype('float32')
+        rates = [
+            throughput(lambda: lr.predict(frame), rows, args.seconds),
+            throughput(
+                lambda: engines['float64'].predict(frame), rows, args.seconds
+            ),
+            throughput(
+                lambda: engines['float64'].predict(x), rows, args.seconds
+            ),
+            throughput(
+                lambda: engines['float32'].predict(x32), rows, args.seconds
+            )
+        ]
+        print(
+            f'{rows:<9d}  ' + '  '.join(f'{el:11.3g}' for el in rates) +
+            f"  {diff['float64']:8d}  {diff['float32']:8d}"
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Benchmark suite of the pipeline stages at production-like data sizes.
+
+For each requested size, a throwaway workspace with its own config.json is
+filled with synthetic data and every stage runs in a fresh process, so wall
+time, peak RSS and throughput are measured without interference between
+stages. Results are written as JSON, named after the current commit, so runs
+of different commits can be compared with --compare.
+
+Run from the project root:
+    python -m benchmarks.suite --rows 1000 100000 10000000 --files 10
+    python -m benchmarks.suite --compare benchmarks/results/<old>.json \
+        benchmarks/results/<new>.json
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from datetime import datetime
+from timeit import default_timer
+from typing import Dict, List
+from benchmarks.datagen import generate
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STAGES = {
+    'ingestion': ('ingestion', 'full_ingestion'),
+    'training': ('training', 'train_model'),
+    'scoring': ('scoring', 'score_model'),
+    'summary': ('diagnostics', 'dataframe_summary'),
+}
+
+
+def _run_stage(workdir: str, stage: str, queue: multiprocessing.Queue) -> None:
+    """
+    Runs one stage inside `workdir`, timing only the stage function and not
+    the imports.
+    """
+    os.chdir(workdir)
+    sys.path.insert(0, REPO_ROOT)
+    module, function = STAGES[stage]
+    function = getattr(__import__(module), function)
+
+    baseline_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = default_timer()
+    function()
+    wall = default_timer() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put({
+        'wall_seconds': wall,
+        'baseline_rss_bytes': baseline_rss * 1024,
+        'peak_rss_bytes': peak_rss * 1024,
+    })
+
+
+def prepare_workspace(
+    workdir: str,
+    rows: int,
+    files: int,
+    duplicate_ratio: float
+) -> int:
+    """
+    Fills `workdir` with a config.json and synthetic source and test data.
+    Returns the number of test rows.
+    """
+    with open(os.path.join(REPO_ROOT, 'config.json'), 'r') as f:
+        config = json.load(f)
+    config.update({
+        'input_folder_path': 'sourcedata',
+        'output_folder_path': 'ingesteddata',
+        'test_data_path': 'testdata',
+        'output_model_path': 'models',
+        'prod_deployment_path': 'production_deployment',
+    })
+    with open(os.path.join(workdir, 'config.json'), 'w') as f:
+        json.dump(config, f)
+
+    test_rows = max(1000, rows // 10)
+    generate(os.path.join(workdir, 'sourcedata'), rows, files, duplicate_ratio)
+    generate(os.path.join(workdir, 'testdata'), test_rows, 1, seed=7)
+    return test_rows
+
+
+def run_suite(
+    sizes: List[int],
+    files: int,
+    duplicate_ratio: float,
+    stages: List[str]
+) -> List[Dict]:
+    """
+    Runs the requested stages for every dataset size.
+
+    Args:
+        sizes: List[int]
+            Numbers of source rows to benchmark.
+        files: int
+            Number of files the source rows are split into.
+        duplicate_ratio: float
+            Share of duplicated source rows.
+        stages: List[str]
+            Stages to run, in order. Later stages use the outputs of earlier
+            ones.
+    Returns:
+        results: List[Dict]
+            One record per size and stage.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for rows in sizes:
+        workdir = tempfile.mkdtemp(prefix='bench_')
+        try:
+            test_rows = prepare_workspace(
+                workdir, rows, files, duplicate_ratio
+            )
+            for stage in stages:
+                queue = context.Queue()
+                process = context.Process(
+                    target=_run_stage, args=(workdir, stage, queue)
+                )
+                process.start()
+                process.join()
+                if process.exitcode != 0:
+                    raise RuntimeError(f'{stage} failed with {rows} rows')
+                record = queue.get()
+                stage_rows = test_rows if stage == 'scoring' else rows
+                record.update({
+                    'stage': stage,
+                    'rows': stage_rows,
+                    'files': files,
+                    'duplicate_ratio': duplicate_ratio,
+                    'rows_per_second': stage_rows / record['wall_seconds'],
+                })
+                results.append(record)
+                print(
+                    f"{stage:<10} {stage_rows:>12d} rows "
+                    f"{record['wall_seconds']:10.3f} s "
+                    f"{record['peak_rss_bytes'] / 1024 ** 2:10.1f} MiB "
+                    f"{record['rows_per_second']:14.0f} rows/s"
+                )
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def compare(old_path: str, new_path: str) -> None:
+    """
+    Prints the wall time and peak RSS ratios between two result files.
+    """
+    with open(old_path, 'r') as f:
+        old = json.load(f)
+    with open(new_path, 'r') as f:
+        new = json.load(f)
+    old_results = {(el['stage'], el['rows']): el for el in old['results']}
+    print(f"{old['commit'][:10]} -> {new['commit'][:10]}")
+    for el in new['results']:
+        before = old_results.get((el['stage'], el['rows']))
+        if before is None:
+            continue
+        print(
+            f"{el['stage']:<10} {el['rows']:>12d} rows "
+            f"time x{el['wall_seconds'] / before['wall_seconds']:.2f} "
+            f"rss x{el['peak_rss_bytes'] / before['peak_rss_bytes']:.2f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--rows', type=float, nargs='+', default=[1e3, 1e4, 1e5, 1e6]
+    )
+    parser.add_argument('--files', type=int, default=10)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.05)
+    parser.add_argument(
+        '--stages', nargs='+', default=list(STAGES), choices=list(STAGES)
+    )
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    commit = subprocess.run(
+        ['git', 'rev-parse', 'HEAD'],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    ).stdout.strip() or 'unknown'
+    results = run_suite(
+        [int(el) for el in args.rows],
+        args.files,
+        args.duplicate_ratio,
+        args.stages
+    )
+
+    output = args.output or os.path.join(
+        REPO_ROOT, 'benchmarks', 'results', f'{commit[:10]}.json'
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump({
+            'commit': commit,
+            'timestamp': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpus': os.cpu_count(),
+            'results': results,
+        }, f, indent=2)
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,278 @@
+"""
+Typed, columnar copy of the ingested dataset. Each column is stored as a NumPy
+.npy file inside a `<dataset>_columns` folder next to the csv file, so readers
+can memory-map only the columns they need instead of parsing the whole csv.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+import pandas as pd
+from numpy.lib.format import open_memmap
+from typing import Dict, Iterator, List, Optional
+from schema import apply_schema, parser_dtypes, subset_schema
+
+def columns_folder(csv_path: str) -> str:
+    """
+    Returns the folder holding the columnar copy of a csv file.
+    """
+    return os.path.splitext(csv_path)[0] + '_columns'
+
+
+def _read_meta(folder: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(folder, 'meta.json'), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_fresh(meta: Dict, csv_path: str) -> bool:
+    stat = os.stat(csv_path)
+    return (
+        meta['source']['size'] == stat.st_size
+        and meta['source']['mtime'] == stat.st_mtime_ns
+    )
+
+
+def _widen(current: Optional[str], values: pd.Series) -> str:
+    """
+    Returns the narrowest dtype able to hold both `current` and `values`.
+    Numeric dtypes are promoted following NumPy's rules, and anything else is
+    stored as a fixed-width unicode string.
+    """
+    numeric = (
+        isinstance(values.dtype, np.dtype) and values.dtype.kind in 'biuf'
+    )
+    if not numeric or (current is not None and current.startswith('<U')):
+        lengths = values.dropna().astype(str).str.len()
+        width = max(int(lengths.max()) if len(lengths) else 0, 1)
+        if current is not None and current.startswith('<U'):
+            width = max(width, int(current[2:]))
+        return f'<U{width}'
+
+    if current is None:
+        return values.dtype.name
+    return np.promote_types(current, values.dtype).name
+
+
+def read_csv_from(
+    csv_path: str,
+    start: int,
+    columns: List[str],
+    chunksize: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Reads the rows of a csv file starting at byte offset `start`, applying
+    the declared dtype schema.
+    """
+    if start >= os.path.getsize(csv_path):
+        return
+    with open(csv_path, 'r') as f:
+        if start:
+            f.seek(start)
+            kwargs = {'header': None, 'names': columns}
+        else:
+            kwargs = {}
+        reader = pd.read_csv(
+            f, dtype=parser_dtypes, chunksize=chunksize, **kwargs
+        )
+        for chunk in reader:
+            yield apply_schema(chunk, source=csv_path)
+
+
+def csv_to_columns(
+    csv_path: str,
+    start: int = 0,
+    chunksize: int = 100000
+) -> None:
+    """
+    Writes, or updates, the columnar copy of a csv file, with the dtypes of
+    the declared schema. The csv is read in chunks twice, once to resolve the
+    dtypes and number of rows and once to fill the memory-mapped column
+    files, so memory use is bounded by the chunk size. When `start` is the
+    byte size the csv had at the last conversion, only the rows appended
+    after it are parsed and the existing columns are copied over.
+
+    Args:
+        csv_path: str
+            Path of the csv file to be converted.
+        start: int
+            Byte offset of the first row not yet converted.
+        chunksize: int
+            Number of rows read from the csv at a time.
+    """
+    folder = columns_folder(csv_path)
+    columns = pd.read_csv(csv_path, nrows=0).columns.tolist()
+    meta = _read_meta(folder) if start else None
+    if (
+        meta is None
+        or meta['source']['size'] != start
+        or meta['columns'] != columns
+    ):
+        meta, start = None, 0
+
+    old_rows = meta['rows'] if meta else 0
+    dtypes = dict(meta['dtypes']) if meta else {c: None for c in columns}
+    new_rows = 0
+    for chunk in read_csv_from(csv_path, start, columns, chunksize):
+        new_rows += chunk.shape[0]
+        for col in columns:
+            dtypes[col] = _widen(dtypes[col], chunk[col])
+    dtypes = {c: dtype or 'float64' for c, dtype in dtypes.items()}
+
+    tmp_folder = folder + '.tmp'
+    shutil.rmtree(tmp_folder, ignore_errors=True)
+    os.mkdir(tmp_folder)
+    arrays = {}
+    for col in columns:
+        arrays[col] = open_memmap(
+            os.path.join(tmp_folder, col + '.npy'),
+            mode='w+',
+            dtype=dtypes[col],
+            shape=(old_rows + new_rows,)
+        )
+        if dtypes[col].startswith('<U'):
+            arrays[col + '.mask'] = open_memmap(
+                os.path.join(tmp_folder, col + '.mask.npy'),
+                mode='w+',
+                dtype='bool',
+                shape=(old_rows + new_rows,)
+            )
+    if old_rows:
+        for name, array in arrays.items():
+            old_path = os.path.join(folder, name + '.npy')
+            if os.path.exists(old_path):
+                array[:old_rows] = np.load(old_path, mmap_mode='r')
+
+    offset = old_rows
+    for chunk in read_csv_from(csv_path, start, columns, chunksize):
+        end = offset + chunk.shape[0]
+        for col in columns:
+            if dtypes[col].startswith('<U'):
+                missing = chunk[col].isna().to_numpy()
+                arrays[col + '.mask'][offset:end] = missing
+                arrays[col][offset:end] = (
+                    chunk[col].astype(str).where(~missing, '').to_numpy()
+                )
+            else:
+                arrays[col][offset:end] = chunk[col].to_numpy()
+        offset = end
+    for array in arrays.values():
+        array.flush()
+    del arrays
+
+    stat = os.stat(csv_path)
+    with open(os.path.join(tmp_folder, 'meta.json'), 'w') as f:
+        json.dump({
+            'columns': columns,
+            'dtypes': dtypes,
+            'rows': old_rows + new_rows,
+            'source': {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        }, f, indent=2)
+
+    old_folder = folder + '.old'
+    shutil.rmtree(old_folder, ignore_errors=True)
+    if os.path.exists(folder):
+        os.rename(folder, old_folder)
+    os.rename(tmp_folder, folder)
+    shutil.rmtree(old_folder, ignore_errors=True)
+
+
+def dataset_columns(csv_path: str) -> List[str]:
+    """
+    Returns the column names of a dataset without parsing its rows.
+    """
+    meta = _read_meta(columns_folder(csv_path))
+    if meta is not None and _is_fresh(meta, csv_path):
+        return meta['columns']
+    return pd.read_csv(csv_path, nrows=0).columns.tolist()
+
+
+def column_rows(csv_path: str) -> Optional[int]:
+    """
+    Returns the number of rows of a csv file's columnar copy, or None when
+    the copy is missing or older than the csv file.
+    """
+    meta = _read_meta(columns_folder(csv_path))
+    if meta is None or not _is_fresh(meta, csv_path):
+        return None
+    return meta['rows']
+
+
+def read_columns(
+    csv_path: str,
+    columns: Optional[List[str]] = None,
+    start: int = 0,
+    stop: Optional[int] = None
+) -> Optional[pd.DataFrame]:
+    """
+    Memory-maps the requested columns of a csv file's columnar copy, only
+    touching the rows between `start` and `stop`. Numeric columns are not
+    copied: the frame is backed by the read-only memory maps, so it must be
+    copied before being modified in place. String columns are decoded into
+    Python objects, which copies them.
+
+    Args:
+        csv_path: str
+            Path of the csv file whose columnar copy should be read.
+        columns: List[str]
+            Columns to be read. Reads every column when None.
+        start: int
+            First row to be read.
+        stop: int
+            Row after the last one to be read. Reads to the end when None.
+    Returns:
+        data: pd.DataFrame
+            The requested columns, or None when the columnar copy is missing
+            or older than the csv file.
+    """
+    folder = columns_folder(csv_path)
+    meta = _read_meta(folder)
+    if meta is None or not _is_fresh(meta, csv_path):
+        return None
+
+    columns = meta['columns'] if columns is None else columns
+    data = {}
+    for col in columns:
+        values = np.load(
+            os.path.join(folder, col + '.npy'), mmap_mode='r'
+        )[start:stop]
+        if values.dtype.kind == 'U':
+            mask = np.load(
+                os.path.join(folder, col + '.mask.npy'), mmap_mode='r'
+            )[start:stop]
+            values = values.astype(object)
+            values[mask] = np.nan
+        data[col] = values
+    return pd.DataFrame(data, columns=columns, copy=False)
+
+
+def read_dataset(
+    csv_path: str,
+    columns: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """
+    Reads the requested columns of a dataset from its columnar copy, falling
+    back to parsing the csv file when the copy is missing or stale. Either
+    way the columns get the dtypes of the declared schema.
+
+    Args:
+        csv_path: str
+            Path of the csv file to be read.
+        columns: List[str]
+            Columns to be read. Reads every column when None.
+    Returns:
+        data: pd.DataFrame
+            The requested columns of the dataset.
+    """
+    data = read_columns(csv_path, columns)
+    if data is None:
+        data = pd.read_csv(csv_path, usecols=columns, dtype=parser_dtypes)
+        if columns is not None:
+            data = data[columns]
+    return apply_schema(data, subset_schema(data.columns), csv_path)
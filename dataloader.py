@@ -0,0 +1,614 @@
+"""
+Shared loader of the datasets used across the project, either folders of csv
+files or the SQLite store of ingested records. Loaded datasets are kept in an
+in-process LRU cache keyed by the names, sizes and mtimes of their files, so
+each dataset is parsed once per change and not once per call. The cache is
+bounded by "loader_cache_bytes" in config.json. Feature matrices and labels
+can also be materialized as memory-mapped .npy arrays, rebuilt whenever the
+dataset they were built from changes. The arrays of the datasets used least
+recently are removed beyond "feature_arrays_max" in config.json.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+from columnar import column_rows, dataset_columns, read_columns, read_csv_from
+from rowindex import RowIndex, row_hashes
+from schema import (
+    apply_schema, concat, parser_dtypes, read_csv, subset_schema
+)
+from sqlitestore import (
+    is_store, iter_records, last_batch, read_records, stored_columns
+)
+
+with open('config.json','r') as f:
+    config = json.load(f)
+
+parse_workers = config.get('parse_workers', 1)
+loader_cache_bytes = config.get('loader_cache_bytes', 512 * 1024 ** 2)
+loader_chunksize = config.get('ingestion_chunksize', 100000)
+if config.get('ingestion_backend', 'csv') == 'sqlite':
+    ingested_data_path = config['sqlite_path']
+else:
+    ingested_data_path = config['output_folder_path']
+arrays_path = os.path.join(config['output_folder_path'], 'featurearrays')
+arrays_max = config.get('feature_arrays_max', 8)
+
+_cache = OrderedDict()
+_cache_sizes = {}
+_cache_lock = threading.Lock()
+
+def list_csv_files(data_path: str) -> List[str]:
+    """
+    Lists the csv files of a folder, sorted by name so every loader merges
+    them in the same order.
+
+    Args:
+        data_path: str
+            A path indicating where to look for datasets.
+    Returns:
+        files: List[str]
+            The names of the csv files present in the folder.
+    """
+    return sorted(el for el in os.listdir(data_path) if el.endswith('.csv'))
+
+def read_csv_files(
+    data_path: str,
+    workers: int = parse_workers
+) -> pd.DataFrame:
+    """
+    Parses every csv file of a folder, applying the declared dtype schema,
+    and concatenates them in file-name order. With more than one worker the
+    files are parsed in parallel in a process pool; results are gathered in
+    submission order, so the output is identical to the serial one.
+
+    Args:
+        data_path: str
+            A path indicating where to look for datasets.
+        workers: int
+            Number of processes used to parse the files.
+    Returns:
+        final: pd.DataFrame
+            The concatenation of every dataset found in the folder.
+    """
+    paths = [os.path.join(data_path, el) for el in list_csv_files(data_path)]
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            frames = list(pool.map(read_csv, paths))
+    else:
+        frames = [read_csv(path) for path in paths]
+
+    return concat(frames)
+
+def dataset_fingerprint(data_path: str) -> Tuple:
+    """
+    Identifies the current content of a dataset by the name, size and mtime
+    of its files, without reading them.
+
+    Args:
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+    Returns:
+        fingerprint: Tuple
+            A hashable description of the dataset's files.
+    """
+    if is_store(data_path):
+        names = [os.path.basename(data_path)]
+        data_path = os.path.dirname(os.path.abspath(data_path))
+    else:
+        names = list_csv_files(data_path)
+    files = []
+    for el in names:
+        stat = os.stat(os.path.join(data_path, el))
+        files.append((el, stat.st_size, stat.st_mtime_ns))
+    return (os.path.abspath(data_path), tuple(files))
+
+def _parse(
+    data_path: str,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None,
+    with_corporation: bool = False
+) -> pd.DataFrame:
+    """
+    Loads a dataset, dropping duplicated rows and, unless asked to keep it,
+    the corporation column. Records of a SQLite store and datasets with a
+    fresh columnar copy were written by ingestion and are already
+    deduplicated, so they are read without the corporation column instead.
+    """
+    def keep(columns: List[str]) -> List[str]:
+        return [c for c in columns if with_corporation or c != 'corporation']
+
+    if is_store(data_path):
+        columns = keep(stored_columns(data_path))
+        return read_records(data_path, columns, batch, corporation)
+
+    files = list_csv_files(data_path)
+    if len(files) == 1:
+        csv_path = os.path.join(data_path, files[0])
+        final = read_columns(csv_path, keep(dataset_columns(csv_path)))
+        if final is not None:
+            return apply_schema(
+                final, subset_schema(final.columns), csv_path
+            )
+
+    final = read_csv_files(data_path)
+    final = final.drop_duplicates()
+    return final[keep(final.columns)]
+
+def load_data(
+    data_path: str,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None,
+    with_corporation: bool = False
+) -> pd.DataFrame:
+    """
+    Returns the deduplicated data of a dataset without the corporation
+    column, loading it only when its files changed since the last call.
+    The returned frame is shared with other callers and must not be modified
+    in place.
+
+    Args:
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+        batch: int
+            Ingestion batch to be read. Only applies to SQLite stores.
+        corporation: str
+            Corporation to be read. Only applies to SQLite stores.
+        with_corporation: bool
+            Whether to keep the corporation column.
+    Returns:
+        final: pd.DataFrame
+            The deduplicated data of the dataset.
+    """
+    key = dataset_fingerprint(data_path) + (
+        batch, corporation, with_corporation
+    )
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    final = _parse(data_path, batch, corporation, with_corporation)
+    size = int(final.memory_usage(deep=True).sum())
+    with _cache_lock:
+        stale = [
+            k for k in _cache
+            if k[0] == key[0] and k[2:] == key[2:] and k != key
+        ]
+        for old_key in stale:
+            del _cache[old_key]
+            del _cache_sizes[old_key]
+        if size <= loader_cache_bytes:
+            _cache[key] = final
+            _cache_sizes[key] = size
+        while sum(_cache_sizes.values()) > loader_cache_bytes:
+            old_key, _ = _cache.popitem(last=False)
+            del _cache_sizes[old_key]
+
+    return final
+
+def load_dataset(
+    data_path: str,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None
+) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Returns the feature matrix and labels of a dataset.
+
+    Args:
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+        batch: int
+            Ingestion batch to be read. Only applies to SQLite stores.
+        corporation: str
+            Corporation to be read. Only applies to SQLite stores.
+    Returns:
+        x: pd.DataFrame
+            The features of the deduplicated data.
+        y: pd.Series
+            The `exited` labels of the same rows.
+    """
+    final = load_data(data_path, batch, corporation)
+    return final.drop('exited', axis=1), final['exited']
+
+def arrays_folder(
+    data_path: str,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None
+) -> str:
+    """
+    Returns the folder holding the feature and label arrays of a dataset.
+    The arrays of every dataset are kept under the output folder, never in
+    the folder of the data itself, which may be read-only or belong to a
+    client.
+    """
+    dataset = hashlib.sha256(os.path.abspath(data_path).encode()).hexdigest()
+    root = os.path.join(arrays_path, dataset[:16])
+    if batch is None and corporation is None:
+        return os.path.join(root, 'all')
+    subset = hashlib.sha256(repr((batch, corporation)).encode()).hexdigest()
+    return os.path.join(root, subset[:16])
+
+def write_arrays(
+    data_path: str,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None
+) -> str:
+    """
+    Writes the feature matrix of a dataset as a C-contiguous float64 x.npy
+    and its labels as y.npy, with a meta.json recording the feature names
+    and the dataset fingerprint they were built from. Every file is written
+    to a temporary file of its own and renamed into place, the meta file
+    last, so readers never pair it with partially written arrays, and
+    concurrent writers don't clash.
+
+    Args:
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+        batch: int
+            Ingestion batch to be written. Only applies to SQLite stores.
+        corporation: str
+            Corporation to be written. Only applies to SQLite stores.
+    Returns:
+        folder: str
+            The folder the arrays were written to.
+    """
+    folder = arrays_folder(data_path, batch, corporation)
+    os.makedirs(folder, exist_ok=True)
+    fingerprint = dataset_fingerprint(data_path)
+    x, y, features = build_arrays(data_path, batch, corporation)
+    meta = {
+        'fingerprint': json.loads(json.dumps(fingerprint)),
+        'features': features,
+        'rows': int(x.shape[0])
+    }
+    tmp = f'.{os.getpid()}.{uuid.uuid4().hex}.tmp'
+    for name, values in (('x.npy', x), ('y.npy', y)):
+        with open(os.path.join(folder, name + tmp), 'wb') as f:
+            np.save(f, values)
+        os.replace(
+            os.path.join(folder, name + tmp), os.path.join(folder, name)
+        )
+    with open(os.path.join(folder, 'meta.json' + tmp), 'w') as f:
+        json.dump(meta, f)
+    os.replace(
+        os.path.join(folder, 'meta.json' + tmp),
+        os.path.join(folder, 'meta.json')
+    )
+    os.utime(os.path.dirname(folder))
+    prune_arrays(os.path.dirname(folder))
+    return folder
+
+def build_arrays(
+    data_path: str,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None
+) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Returns the feature matrix of a dataset as a C-contiguous float64 array,
+    its labels and the feature names, as held in memory rather than mapped.
+    """
+    x, y = load_dataset(data_path, batch, corporation)
+    return (
+        np.ascontiguousarray(x.to_numpy(dtype='float64')), y.to_numpy(),
+        x.columns.tolist()
+    )
+
+def prune_arrays(keep: str) -> None:
+    """
+    Removes the arrays of the datasets used least recently, by the mtime of
+    their folders, keeping the given folder and at most arrays_max in all.
+    Arrays already mapped by a reader stay readable until it unmaps them.
+    """
+    folders = [
+        os.path.join(arrays_path, el) for el in os.listdir(arrays_path)
+    ]
+    folders = [el for el in folders if os.path.isdir(el) and el != keep]
+    folders.sort(key=lambda el: os.stat(el).st_mtime, reverse=True)
+    for el in folders[max(arrays_max - 1, 0):]:
+        shutil.rmtree(el, ignore_errors=True)
+
+def load_arrays(
+    data_path: str,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None
+) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+    """
+    Memory-maps the feature matrix and labels of a dataset, as written by
+    write_arrays. They are written first when missing, and rewritten when
+    the dataset's fingerprint no longer matches the one they were built
+    from, so changes to the data invalidate them. When the output folder
+    can't be written to, the arrays are built in memory instead.
+
+    Args:
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+        batch: int
+            Ingestion batch to be read. Only applies to SQLite stores.
+        corporation: str
+            Corporation to be read. Only applies to SQLite stores.
+    Returns:
+        x: np.ndarray
+            The float64 features of the deduplicated data, read-only.
+        y: np.ndarray
+            The `exited` labels of the same rows, read-only.
+        features: List[str]
+            The names of the columns of x.
+    """
+    folder = arrays_folder(data_path, batch, corporation)
+    fingerprint = json.loads(json.dumps(dataset_fingerprint(data_path)))
+    meta = None
+    if os.path.exists(os.path.join(folder, 'meta.json')):
+        with open(os.path.join(folder, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    if meta is None or meta['fingerprint'] != fingerprint:
+        try:
+            write_arrays(data_path, batch, corporation)
+        except OSError:
+            # the output folder can't be written to, so the arrays are
+            # built in memory, read-only like the mapped ones
+            x, y, features = build_arrays(data_path, batch, corporation)
+            x.flags.writeable = False
+            y.flags.writeable = False
+            return x, y, features
+        with open(os.path.join(folder, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+    else:
+        try:
+            # marks the dataset as recently used for prune_arrays
+            os.utime(os.path.dirname(folder))
+        except OSError:
+            pass
+
+    x = np.load(os.path.join(folder, 'x.npy'), mmap_mode='r')
+    y = np.load(os.path.join(folder, 'y.npy'), mmap_mode='r')
+    return x, y, meta['features']
+
+def load_inputs(
+    data_path: str,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None,
+    columns: Tuple[str, ...] = (),
+    features: Optional[List[str]] = None
+) -> Tuple[Union[np.ndarray, pd.DataFrame], np.ndarray]:
+    """
+    Returns what a model predicts from: the memory-mapped feature arrays,
+    or, for models that also need non-feature columns such as corporation
+    to route rows, the features as a frame along with those columns. The
+    array columns are taken in the order of the model's features, since the
+    datasets may hold them in another order.
+
+    Args:
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+        batch: int
+            Ingestion batch to be read. Only applies to SQLite stores.
+        corporation: str
+            Corporation to be read. Only applies to SQLite stores.
+        columns: Tuple[str, ...]
+            The non-feature columns the model needs.
+        features: List[str]
+            The features of the model, in order. Arrays are returned as
+            stored when None.
+    Returns:
+        x: np.ndarray or pd.DataFrame
+            The features, plus the requested columns.
+        y: np.ndarray
+            The `exited` labels of the same rows.
+    Raises:
+        ValueError:
+            When the dataset lacks some of the model's features.
+    """
+    if 'corporation' not in columns:
+        x, y, names = load_arrays(data_path, batch, corporation)
+        if features is not None and list(features) != names:
+            check_features(names, features, data_path)
+            x = x[:, [names.index(el) for el in features]]
+        return x, y
+    final = load_data(data_path, batch, corporation, with_corporation=True)
+    if features is not None:
+        check_features(final.columns.tolist(), features, data_path)
+    return final.drop('exited', axis=1), final['exited'].to_numpy()
+
+def check_features(
+    names: List[str],
+    features: List[str],
+    data_path: str
+) -> None:
+    """
+    Raises a ValueError when some of a model's features are not among the
+    columns of a dataset.
+    """
+    missing = [el for el in features if el not in names]
+    if missing:
+        raise ValueError(
+            f'{data_path} lacks the features {missing} the model was '
+            'trained with'
+        )
+
+def iter_data(
+    data_path: str,
+    chunksize: int = loader_chunksize,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None,
+    with_corporation: bool = False,
+    deduplicate: bool = True
+) -> Iterator[pd.DataFrame]:
+    """
+    Yields the deduplicated data of a dataset without the corporation column
+    in chunks of about `chunksize` rows, for datasets larger than memory.
+    Columnar copies are sliced through mmap and SQLite stores are paged
+    through; plain csv folders are parsed in chunks and deduplicated through
+    their row fingerprints, the only state kept in memory. Without
+    deduplication, memory use doesn't grow with the dataset at all.
+
+    Args:
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+        chunksize: int
+            Number of rows per chunk.
+        batch: int
+            Ingestion batch to be read. Only applies to SQLite stores.
+        corporation: str
+            Corporation to be read. Only applies to SQLite stores.
+        with_corporation: bool
+            Whether to keep the corporation column.
+        deduplicate: bool
+            Whether to drop the rows of plain csv folders already yielded.
+            Ingested datasets are always deduplicated.
+    Returns:
+        chunks: Iterator[pd.DataFrame]
+            The chunks of the dataset.
+    """
+    def keep(columns: List[str]) -> List[str]:
+        return [c for c in columns if with_corporation or c != 'corporation']
+
+    if is_store(data_path):
+        columns = keep(stored_columns(data_path))
+        yield from iter_records(
+            data_path, columns, batch, corporation, chunksize
+        )
+        return
+
+    files = list_csv_files(data_path)
+    if len(files) == 1:
+        csv_path = os.path.join(data_path, files[0])
+        rows = column_rows(csv_path)
+        if rows is not None:
+            columns = keep(dataset_columns(csv_path))
+            for start in range(0, rows, chunksize):
+                chunk = read_columns(
+                    csv_path, columns, start, start + chunksize
+                )
+                if chunk is None:
+                    raise RuntimeError(f'{csv_path} changed while reading')
+                yield apply_schema(chunk, subset_schema(columns), csv_path)
+            return
+
+    seen = RowIndex()
+    columns = None
+    for el in files:
+        path = os.path.join(data_path, el)
+        reader = pd.read_csv(path, dtype=parser_dtypes, chunksize=chunksize)
+        for chunk in reader:
+            chunk = apply_schema(chunk, source=path)
+            columns = columns or chunk.columns.tolist()
+            chunk = chunk.reindex(columns=columns)
+            if deduplicate:
+                chunk = chunk[seen.filter_new(row_hashes(chunk))]
+            yield chunk[keep(columns)]
+
+def iter_dataset(
+    data_path: str,
+    chunksize: int = loader_chunksize,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None
+) -> Iterator[Tuple[pd.DataFrame, pd.Series]]:
+    """
+    Same as iter_data, yielding the feature matrix and labels of each chunk.
+    """
+    for chunk in iter_data(data_path, chunksize, batch, corporation):
+        yield chunk.drop('exited', axis=1), chunk['exited']
+
+def data_position(data_path: str) -> Optional[Dict]:
+    """
+    Describes how far an ingested dataset currently goes, so the rows added
+    after this point can be read later with iter_dataset_since: the latest
+    batch of a SQLite store, or the generation, rows and bytes of an ingested
+    csv folder, as recorded by ingestion in ingestedstate.json.
+
+    Args:
+        data_path: str
+            A folder of ingested csv data or the path of a SQLite store.
+    Returns:
+        position: Dict
+            The current position, or None for datasets not written by
+            ingestion.
+    """
+    if is_store(data_path):
+        return {'batch': last_batch(data_path)}
+    state_path = os.path.join(data_path, 'ingestedstate.json')
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'r') as f:
+        return json.load(f)
+
+def iter_dataset_since(
+    data_path: str,
+    position: Optional[Dict],
+    chunksize: int = loader_chunksize
+) -> Optional[Iterator[Tuple[pd.DataFrame, pd.Series]]]:
+    """
+    Yields, in chunks, the feature matrix and labels of the rows appended to
+    an ingested dataset after `position`.
+
+    Args:
+        data_path: str
+            A folder of ingested csv data or the path of a SQLite store.
+        position: Dict
+            A position previously returned by data_position.
+        chunksize: int
+            Number of rows per chunk.
+    Returns:
+        chunks: Iterator[Tuple[pd.DataFrame, pd.Series]]
+            The new rows, or None when they can't be told apart from the old
+            ones, e.g. because the dataset was rebuilt since `position`.
+    """
+    current = data_position(data_path)
+    if current is None or position is None:
+        return None
+    if is_store(data_path):
+        if 'batch' not in position:
+            return None
+        columns = [c for c in stored_columns(data_path) if c != 'corporation']
+        chunks = iter_records(
+            data_path, columns, chunksize=chunksize,
+            after_batch=position['batch']
+        )
+    elif (
+        position.get('generation') != current['generation']
+        or position['rows'] > current['rows']
+    ):
+        return None
+    else:
+        chunks = _iter_csv_since(
+            os.path.join(data_path, 'finaldata.csv'), position, chunksize
+        )
+    return (
+        (chunk.drop('exited', axis=1), chunk['exited']) for chunk in chunks
+    )
+
+def _iter_csv_since(
+    csv_path: str,
+    position: Dict,
+    chunksize: int
+) -> Iterator[pd.DataFrame]:
+    """
+    Yields the rows of an ingested csv dataset after `position`, slicing its
+    columnar copy when fresh and seeking past the old rows otherwise.
+    """
+    columns = dataset_columns(csv_path)
+    features = [c for c in columns if c != 'corporation']
+    rows = column_rows(csv_path)
+    if rows is not None:
+        for start in range(position['rows'], rows, chunksize):
+            chunk = read_columns(csv_path, features, start, start + chunksize)
+            if chunk is None:
+                raise RuntimeError(f'{csv_path} changed while reading')
+            yield apply_schema(chunk, subset_schema(features), csv_path)
+        return
+
+    start = position['bytes']
+    for chunk in read_csv_from(csv_path, start, columns, chunksize):
+        yield chunk[features]
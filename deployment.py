@@ -8,6 +8,7 @@ Date: Mar 2023
 import os
 import json
 from shutil import copy2
+from instrumentation import instrumented
 
 with open('config.json','r') as f:
     config = json.load(f)
@@ -19,25 +20,45 @@ prod_deployment_path = os.path.join(config['prod_deployment_path'])
 if prod_deployment_path not in current_folders:
     os.mkdir(prod_deployment_path)
 
-def store_model_into_pickle() -> None:
-    """
-    Copies the latest trained model pickle file, the latestscore.txt value and
-    the ingestfiles.txt file into the deployment directory.
+def publish(source: str, destination: str) -> None:
     """
+    Copies a file into place atomically: it is first copied next to its
+    destination and then renamed over it, so readers see either the
+    previous file or the new one whole, never a partial copy.
 
-    copy2(
-        os.path.join(model_path, 'trainedmodel.pkl'),
-        os.path.join(prod_deployment_path, 'trainedmodel.pkl')
-    )
-    copy2(
-        os.path.join(model_path, "latestscore.txt"),
-        os.path.join(prod_deployment_path, "latestscore.txt")
-    )
-    copy2(
-        os.path.join(dataset_csv_path, 'ingestedfiles.txt'),
-        os.path.join(prod_deployment_path, 'ingestedfiles.txt')
-    )
+    Args:
+        source: str
+            The path of the file to be copied.
+        destination: str
+            The path it is published at.
+    """
+    temporary = f'{destination}.{os.getpid()}.tmp'
+    copy2(source, temporary)
+    os.replace(temporary, destination)
 
+@instrumented()
+def store_model_into_pickle() -> None:
+    """
+    Publishes the latest trained model pickle file, the latestscore.txt
+    value, the ingestfiles.txt file and, when present, the compact model
+    artifact, the ingestion manifest and the training state into the
+    deployment directory. Every file is replaced atomically, and the model
+    files last, so a serving process reloading the model never reads a
+    partially copied one.
+    """
+    published = [
+        (dataset_csv_path, 'ingestedfiles.txt'),
+        (dataset_csv_path, 'ingestedmanifest.json'),
+        (model_path, 'trainingstate.json'),
+        (model_path, 'latestscore.txt'),
+        (model_path, 'trainedmodel.npy'),
+        (model_path, 'trainedmodel.pkl')
+    ]
+    required = ('ingestedfiles.txt', 'latestscore.txt', 'trainedmodel.pkl')
+    for folder, name in published:
+        source = os.path.join(folder, name)
+        if name in required or os.path.exists(source):
+            publish(source, os.path.join(prod_deployment_path, name))
 
 if __name__ == '__main__':
     store_model_into_pickle()
@@ -7,14 +7,19 @@ Date: Mar 2023
 """
 
 import pandas as pd
-import timeit
+import numpy as np
 import os
 import json
-from typing import List
+from typing import Dict, Iterator, List, Optional
 from textwrap import dedent
 import subprocess
-import pickle
 import asyncio
+from dataloader import (
+    ingested_data_path, iter_data, load_inputs, loader_chunksize
+)
+from modelartifact import load_model
+from profiling import profile_dataset
+from instrumentation import count_rows, instrumented, read_metrics
 
 with open('config.json','r') as f:
     config = json.load(f)
@@ -24,45 +29,85 @@ dataset_csv_path = os.path.join(config['output_folder_path'])
 test_data_path = os.path.join(config['test_data_path'])
 prod_deployment_path = os.path.join(config['prod_deployment_path'])
 
+@instrumented(rows=len)
 def model_predictions(
     data_path: str = test_data_path,
-    model_path: str = prod_deployment_path
+    model_path: str = prod_deployment_path,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None
 ) -> List:
     '''
     Reads the deployed model and a test dataset, calculates predictions.
 
     Args:
         data_path: str
-            A path indicating where to look for test datasets.
+            A path indicating where to look for test datasets, or the path
+            of a SQLite store of ingested records.
         model_path: str
             A path indicating where to look for trained models.
+        batch: int
+            Only predict the records of this batch of a SQLite store.
+        corporation: str
+            Only predict the records of this corporation of a SQLite store.
     Returns:
         preds: List
             A list containing the model predictions for the given test data.
     '''
-    with open(
-        os.path.join(model_path, 'trainedmodel.pkl'), 'rb'
-    ) as f:
-        lr = pickle.load(f)
-
-    test_data = [el for el in os.listdir(data_path) if '.csv' in el]
-    final = pd.DataFrame()
-    for data in test_data:
-        temp = pd.read_csv(os.path.join(test_data_path, data))
-        final = pd.concat([final, temp], axis=0)
-    final.drop_duplicates(inplace=True)
-    final.drop('corporation', axis=1, inplace=True)
-
-    x_test = final.drop('exited', axis=1)
-    y_test = final['exited']
+    lr = load_model(model_path)
+
+    x_test, _ = load_inputs(
+        data_path,
+        batch,
+        corporation,
+        getattr(lr, 'routing_columns', ()),
+        getattr(lr, 'feature_names_in_', None)
+    )
 
     preds = lr.predict(x_test)
     return preds.tolist()
 
+def iter_model_predictions(
+    data_path: str = test_data_path,
+    model_path: str = prod_deployment_path,
+    chunksize: int = loader_chunksize,
+    deduplicate: bool = True
+) -> Iterator[np.ndarray]:
+    '''
+    Reads a test dataset in chunks and yields the deployed model's
+    predictions of each, so memory use depends on the chunk size and not on
+    the dataset size.
+
+    Args:
+        data_path: str
+            A path indicating where to look for test datasets, or the path
+            of a SQLite store of ingested records.
+        model_path: str
+            A path indicating where to look for trained models.
+        chunksize: int
+            Number of rows read and predicted at a time.
+        deduplicate: bool
+            Whether to drop repeated rows, as model_predictions does, which
+            keeps the fingerprints of every row seen in memory.
+    Returns:
+        preds: Iterator[np.ndarray]
+            The predictions of each chunk.
+    '''
+    lr = load_model(model_path)
+    chunks = iter_data(
+        data_path,
+        chunksize,
+        with_corporation='corporation' in getattr(lr, 'routing_columns', ()),
+        deduplicate=deduplicate
+    )
+    for chunk in chunks:
+        yield lr.predict(chunk.drop(columns='exited', errors='ignore'))
+
+@instrumented()
 def dataframe_summary() -> List[List]:
     '''
     Calculates summary statistics from the given dataset. Writes the summary
-    statics report in the dataset's folder.
+    statics report in the dataset's folder. The statistics are taken from
+    the dataset's profile, shared with check_data_integrity.
 
     Returns
         statistic_list: List[List]
@@ -71,23 +116,12 @@ def dataframe_summary() -> List[List]:
             following order: [[mean, median, std],...]
     '''
 
-    summ_data = [el for el in os.listdir(dataset_csv_path) if '.csv' in el]
-    final = pd.DataFrame()
-    for data in summ_data:
-        temp = pd.read_csv(os.path.join(dataset_csv_path, data))
-        final = pd.concat([final, temp], axis=0)
-    final.drop_duplicates(inplace=True)
-    final.drop('corporation', axis=1, inplace=True)
+    profile = profile_dataset(ingested_data_path)
+    count_rows(profile.attrs['rows'])
 
+    summary = profile[['mean', 'median', 'std']]
     report = ''
-    statistic_list = []
-    for col in final.columns.tolist():
-        mean = final[col].mean()
-        median = final[col].median()
-        std = final[col].std()
-        metrics = [mean, median, std]
-        statistic_list.append(metrics)
-
+    for col, mean, median, std in summary.itertuples():
         report += dedent(
             f"""\
             Variable: {col}
@@ -102,12 +136,14 @@ def dataframe_summary() -> List[List]:
     with open(os.path.join(dataset_csv_path, 'summary_metrics.txt'), 'w') as f:
         f.write(report)
 
-    return statistic_list
+    return summary.to_numpy().tolist()
 
+@instrumented()
 def check_data_integrity() -> None:
     '''
     Checks for dataset data integrety by measuring the percentage of missing
-    datapoints in each numeric column.
+    datapoints in each numeric column. The percentages are taken from the
+    dataset's profile, shared with dataframe_summary.
 
     Returns
         data_integrity: List
@@ -115,20 +151,12 @@ def check_data_integrity() -> None:
             the given dataset.
     '''
 
-    summ_data = [el for el in os.listdir(dataset_csv_path) if '.csv' in el]
-    final = pd.DataFrame()
-    for data in summ_data:
-        temp = pd.read_csv(os.path.join(dataset_csv_path, data))
-        final = pd.concat([final, temp], axis=0)
-    final.drop_duplicates(inplace=True)
-    final.drop('corporation', axis=1, inplace=True)
+    profile = profile_dataset(ingested_data_path)
+    count_rows(profile.attrs['rows'])
 
+    data_integrity = profile['missing_ratio'].round(2).tolist()
     report = ''
-    data_integrity = []
-    for col in final.columns.tolist():
-        missing_perc = round(final[col].isna().sum() / final.shape[0], 2)
-        data_integrity.append(missing_perc)
-
+    for col, missing_perc in zip(profile.index, data_integrity):
         report += dedent(
             f"""\
             Variable: {col}
@@ -143,24 +171,17 @@ def check_data_integrity() -> None:
 
     return data_integrity
 
-def execution_time() -> List:
+def execution_time() -> List[Dict]:
     '''
-    Calculates the timings of ingestion.py and training.py.
+    Reads the latest timings of each instrumented pipeline step from the
+    metrics log, instead of running the steps again.
     
     Returns
-        timings: List
-            A list with the timings of each process step, in seconds.
+        timings: List[Dict]
+            The latest record of each step, with its wall and CPU times in
+            seconds, peak RSS in bytes and number of rows processed.
     '''
-
-    ingestion_start_time = timeit.default_timer()
-    os.system('python3 ingestion.py')
-    ingestion_process_time = timeit.default_timer() - ingestion_start_time
-
-    training_start_time = timeit.default_timer()
-    os.system('python3 training.py')
-    training_process_time = timeit.default_timer() - training_start_time
-
-    return [ingestion_process_time, training_process_time]
+    return read_metrics(latest=True)
 
 async def async_outdated_packages_list() -> None:
     '''
@@ -14,7 +14,11 @@ import json
 import os
 from typing import Union, List
 import pickle
+import argparse
+import traceback
 from textwrap import dedent
+from manifest import load_manifest, scan_folder
+from watcher import watch
 
 with open('config.json','r') as f:
     config = json.load(f)
@@ -29,11 +33,16 @@ if input_folder_path not in curr_folders:
 output_model_path = os.path.join(config['output_model_path'])
 if output_model_path not in curr_folders:
     os.mkdir(output_model_path)
+watch_debounce_seconds = config.get('watch_debounce_seconds', 5)
+watch_poll_seconds = config.get('watch_poll_seconds', 10)
 
 def check_new_data() -> Union[bool, List[str]]:
     '''
-    Reads ingestedfiles.txt and determines whether the source data folder has
-    files that aren't listed in ingestedfiles.txt.
+    Determines whether the source data folder has files that weren't ingested
+    by the deployed model. Files are compared by content against the deployed
+    ingestedmanifest.json, so renamed files aren't taken as new data. Falls
+    back to comparing file names with ingestedfiles.txt when there is no
+    deployed manifest.
     
     Returns
         new_data_flag:
@@ -41,6 +50,16 @@ def check_new_data() -> Union[bool, List[str]]:
         new_data_list:
             List containing the new data files found in the input directory.
     '''
+    deployed_manifest = os.path.join(
+        prod_deployment_path, 'ingestedmanifest.json'
+    )
+    if os.path.exists(deployed_manifest):
+        _, new_data_list = scan_folder(
+            input_folder_path,
+            load_manifest(deployed_manifest)
+        )
+        return len(new_data_list) > 0, new_data_list
+
     new_data_flag = False
     with open(os.path.join(prod_deployment_path, 'ingestedfiles.txt'), 'r') as f:
         ingested_files = f.read()
@@ -116,8 +135,46 @@ def pipeline() -> None:
     print('Pipeline process completed!')
 
 
+def watch_pipeline() -> None:
+    '''
+    Keeps running and starts the pipeline whenever new complete files land in
+    the input folder, instead of polling it from cron. The pipeline also runs
+    once at startup to pick up files that arrived while it wasn't watching.
+    A run that fails is reported and the watcher keeps going, so the next
+    batch of files triggers the pipeline again.
+    '''
+    def run() -> None:
+        try:
+            message = pipeline()
+        except Exception:
+            print('Pipeline run failed, still watching for new data.')
+            traceback.print_exc()
+            return
+        if message:
+            print(message)
+
+    run()
+    watch(
+        input_folder_path,
+        run,
+        debounce=watch_debounce_seconds,
+        poll_interval=watch_poll_seconds
+    )
+
+
 if __name__ == '__main__':
-    pipeline()
+    parser = argparse.ArgumentParser(description='Automated model pipeline.')
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Keep watching the input folder and run on new data.'
+    )
+    args = parser.parse_args()
+
+    if args.watch:
+        watch_pipeline()
+    else:
+        pipeline()
 
 
 
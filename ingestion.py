@@ -10,7 +10,25 @@ import pandas as pd
 import numpy as np
 import os
 import json
+import uuid
 from datetime import datetime
+from typing import List, Optional, Tuple
+from manifest import load_manifest, save_manifest, scan_folder
+from instrumentation import count_rows, instrumented
+from columnar import csv_to_columns
+from dataloader import (
+    iter_data, list_csv_files, read_csv_files, write_arrays
+)
+from schema import (
+    apply_schema, nullable_integers, parser_dtypes, warn_violations
+)
+from sqlitestore import ingest_files, last_batch
+from streamstats import (
+    StreamingStats, load_dataset_stats, save_dataset_stats, stream_stats
+)
+from rowindex import (
+    RowIndex, load_index, rebuild_index, row_hashes, save_index
+)
 
 with open('config.json','r') as f:
     config = json.load(f)
@@ -29,24 +47,332 @@ output_folder_path = config['output_folder_path']
 if output_folder_path not in current_folders:
     os.mkdir(output_folder_path)
 
-def merge_multiple_dataframes() -> None:
+ingestion_mode = config.get('ingestion_mode', 'full')
+ingestion_chunksize = config.get('ingestion_chunksize', 100000)
+ingestion_backend = config.get('ingestion_backend', 'csv')
+sqlite_path = config.get(
+    'sqlite_path', os.path.join(output_folder_path, 'ingested.db')
+)
+columnar_storage = config.get('columnar_storage', True)
+# materializing the arrays loads the whole dataset, which the bounded-memory
+# stream mode avoids
+feature_arrays = (
+    config.get('feature_arrays', True) and ingestion_mode != 'stream'
+)
+# per-column statistics of the ingested dataset, kept up to date with the
+# rows appended so the summary endpoints don't scan the dataset
+dataset_stats = config.get('dataset_stats', True)
+manifest_path = os.path.join(output_folder_path, 'ingestedmanifest.json')
+state_path = os.path.join(output_folder_path, 'ingestedstate.json')
+index_path = os.path.join(output_folder_path, 'rowindex.npy')
+
+@instrumented(rows=lambda written: written)
+def merge_multiple_dataframes() -> int:
     '''
-    Checks for datasets, compile them together, and write to an output file
+    Checks for datasets, compile them together, and write to an output file.
+    Datasets are merged in file-name order and parsed in parallel when
+    "parse_workers" is greater than one. The statistics of the merged
+    dataset are persisted along with it.
+
+    Returns:
+        written: int
+            Number of unique rows written to finaldata.csv.
     '''
-    input_data = [el for el in os.listdir(input_folder_path) if '.csv' in el]
+    if ingestion_mode == 'stream':
+        return stream_multiple_dataframes()
+
+    input_data = list_csv_files(input_folder_path)
     with open(os.path.join(output_folder_path, 'ingestedfiles.txt'), 'w') as f:
         f.write(', '.join(input_data))
 
-    final = pd.DataFrame()
-    for data in input_data:
-        temp = pd.read_csv(os.path.join(input_folder_path, data))
-        final = pd.concat([final, temp], axis=0)
+    final = read_csv_files(input_folder_path)
 
     final.drop_duplicates(inplace=True)
-    final.to_csv(
+    nullable_integers(final).to_csv(
         os.path.join(output_folder_path, 'finaldata.csv'),
         index=False
     )
+    save_index(
+        RowIndex(np.unique(row_hashes(final))),
+        index_path,
+        os.path.join(output_folder_path, 'finaldata.csv')
+    )
+    if dataset_stats:
+        stats = StreamingStats()
+        for start in range(0, final.shape[0], ingestion_chunksize):
+            stats.update(final.iloc[start:start + ingestion_chunksize])
+        save_dataset_stats(stats, output_folder_path)
+    return final.shape[0]
+
+def stream_multiple_dataframes(chunksize: int = ingestion_chunksize) -> int:
+    '''
+    Bounded-memory version of merge_multiple_dataframes. Reads every dataset
+    in chunks of `chunksize` rows, drops duplicated records by checking their
+    fingerprints against the ones already written, and appends the remaining
+    rows to the output file as it goes. Only the row fingerprints are kept
+    in memory, so peak memory depends on the chunk size and not on the size
+    of the source data. The fingerprints are persisted as the row index used
+    by incremental ingestion, and the statistics of the rows written as the
+    dataset's statistics.
+
+    All datasets are expected to share the columns of the first one; the
+    rows are written in the same order merge_multiple_dataframes yields.
+
+    Args:
+        chunksize: int
+            Number of rows read from the source files at a time.
+    Returns:
+        written: int
+            Number of unique rows written to finaldata.csv.
+    '''
+    input_data = list_csv_files(input_folder_path)
+    with open(os.path.join(output_folder_path, 'ingestedfiles.txt'), 'w') as f:
+        f.write(', '.join(input_data))
+
+    final_path = os.path.join(output_folder_path, 'finaldata.csv')
+    tmp_path = final_path + '.tmp'
+    seen = RowIndex()
+    stats = StreamingStats() if dataset_stats else None
+    columns = None
+    written = 0
+    with open(tmp_path, 'w', newline='') as out:
+        for data in input_data:
+            columns, rows = append_unique_rows(
+                os.path.join(input_folder_path, data),
+                out,
+                seen,
+                columns,
+                chunksize,
+                stats
+            )
+            written += rows
+
+    os.replace(tmp_path, final_path)
+    save_index(seen, index_path, final_path)
+    if stats is not None:
+        save_dataset_stats(stats, output_folder_path)
+    return written
+
+def append_unique_rows(
+    data_path: str,
+    out,
+    seen: RowIndex,
+    columns: Optional[List[str]] = None,
+    chunksize: int = ingestion_chunksize,
+    stats: Optional[StreamingStats] = None
+) -> Tuple[List[str], int]:
+    '''
+    Reads a dataset in chunks, applying the declared dtype schema, and writes
+    to `out` the rows whose fingerprint is not in the `seen` index, adding
+    them to it along the way. When `columns` is None, the dataset's header
+    defines the output columns and is written first. Integer columns with
+    missing values are written as integers, as merge_multiple_dataframes
+    does, and the schema violations of the dataset are reported once. The
+    rows written are added to `stats` when given.
+
+    Args:
+        data_path: str
+            Path of the csv file to be read.
+        out:
+            Text file object the unique rows are written to.
+        seen: RowIndex
+            Fingerprints of the rows already written.
+        columns: List[str]
+            Column order of the output file.
+        chunksize: int
+            Number of rows read from the dataset at a time.
+        stats: StreamingStats
+            Statistics of the rows already written.
+    Returns:
+        columns: List[str]
+            Column order of the output file.
+        written: int
+            Number of rows written to `out`.
+    '''
+    written = 0
+    violations = []
+    reader = pd.read_csv(data_path, dtype=parser_dtypes, chunksize=chunksize)
+    for chunk in reader:
+        chunk = apply_schema(chunk, source=data_path, violations=violations)
+        if columns is None:
+            columns = chunk.columns.tolist()
+            out.write(','.join(columns) + '\n')
+        chunk = nullable_integers(chunk.reindex(columns=columns))
+
+        keep = seen.filter_new(row_hashes(chunk))
+
+        chunk[keep].to_csv(out, header=False, index=False)
+        written += int(keep.sum())
+        if stats is not None:
+            stats.update(chunk[keep])
+
+    warn_violations(violations, data_path)
+    return columns, written
+
+@instrumented()
+def incremental_ingestion(chunksize: int = ingestion_chunksize) -> None:
+    '''
+    Ingests only the source files whose content is not yet recorded in the
+    ingestion manifest, appending their unique rows to finaldata.csv. Files
+    that were only renamed or touched are not read again, so a run without
+    new data only stats the source folder. New rows are checked against the
+    persisted row index, which is rebuilt from finaldata.csv when missing or
+    stale, so only the new rows are hashed. Falls back to a full ingestion
+    when there is no previous ingested dataset or manifest.
+
+    Rows of a source file that changed in place are appended, but the rows
+    of its previous version are kept; run merge_multiple_dataframes to
+    rebuild the dataset from scratch. The columnar copy of the dataset, when
+    enabled, is extended with the appended rows only, and so are the
+    persisted statistics of the dataset, which are only recomputed over the
+    whole dataset when missing or stale. The ingestion state keeps its
+    generation, so incremental retraining can pick up the rows appended
+    since the deployed model was trained.
+
+    Args:
+        chunksize: int
+            Number of rows read from the source files at a time.
+    '''
+    final_path = os.path.join(output_folder_path, 'finaldata.csv')
+    if not (os.path.exists(final_path) and os.path.exists(manifest_path)):
+        full_ingestion()
+        return
+
+    current, new_files = scan_folder(
+        input_folder_path,
+        load_manifest(manifest_path)
+    )
+    if new_files:
+        seen = load_index(index_path, final_path)
+        if seen is None:
+            seen = rebuild_index(index_path, final_path, chunksize)
+        columns = pd.read_csv(final_path, nrows=0).columns.tolist()
+        stats = None
+        if dataset_stats:
+            stats = load_dataset_stats(output_folder_path)
+
+        start = os.path.getsize(final_path)
+        written = 0
+        with open(final_path, 'a', newline='') as out:
+            for data in new_files:
+                _, rows = append_unique_rows(
+                    os.path.join(input_folder_path, data),
+                    out,
+                    seen,
+                    columns,
+                    chunksize,
+                    stats
+                )
+                written += rows
+        count_rows(written)
+        save_index(seen, index_path, final_path)
+        if columnar_storage:
+            csv_to_columns(final_path, start, chunksize)
+        if dataset_stats:
+            if stats is None:
+                stats = stream_stats(output_folder_path, chunksize)
+            save_dataset_stats(stats, output_folder_path)
+        if feature_arrays:
+            write_arrays(output_folder_path)
+        save_ingestion_state(len(seen))
+
+    with open(os.path.join(output_folder_path, 'ingestedfiles.txt'), 'w') as f:
+        f.write(', '.join(current))
+    save_manifest(current, manifest_path)
+
+def full_ingestion() -> None:
+    '''
+    Rebuilds the ingested dataset from every source file, writes its columnar
+    copy and feature arrays when enabled and records the source files in the
+    ingestion manifest.
+    Starts a new ingestion state generation, as the rows may be reordered.
+    '''
+    current, _ = scan_folder(input_folder_path, load_manifest(manifest_path))
+    rows = merge_multiple_dataframes()
+    count_rows(rows)
+    if columnar_storage:
+        csv_to_columns(
+            os.path.join(output_folder_path, 'finaldata.csv'),
+            chunksize=ingestion_chunksize
+        )
+    if feature_arrays:
+        write_arrays(output_folder_path)
+    save_ingestion_state(rows, new_generation=True)
+    save_manifest(current, manifest_path)
+
+def save_ingestion_state(rows: int, new_generation: bool = False) -> None:
+    '''
+    Records the number of rows and bytes of finaldata.csv along with its
+    generation, which only changes when the dataset is rebuilt. Rows from
+    the same generation are never reordered, so readers can tell which rows
+    were appended after a given state.
+
+    Args:
+        rows: int
+            Number of rows in finaldata.csv.
+        new_generation: bool
+            Whether the dataset was rebuilt from scratch.
+    '''
+    state = {}
+    if os.path.exists(state_path) and not new_generation:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+    state = {
+        'generation': state.get('generation', uuid.uuid4().hex),
+        'rows': int(rows),
+        'bytes': os.path.getsize(
+            os.path.join(output_folder_path, 'finaldata.csv')
+        )
+    }
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(state_path + '.tmp', state_path)
+
+@instrumented()
+def sqlite_ingestion(chunksize: int = ingestion_chunksize) -> None:
+    '''
+    Inserts the source files not yet recorded in the ingestion manifest into
+    the SQLite store, as a new batch. Duplicated records are skipped by the
+    store's row fingerprint primary key. The persisted statistics of the
+    store are updated with the records of the new batch.
+
+    Args:
+        chunksize: int
+            Number of rows read from the source files at a time.
+    '''
+    manifest = {}
+    if os.path.exists(sqlite_path):
+        manifest = load_manifest(manifest_path)
+    current, new_files = scan_folder(input_folder_path, manifest)
+    if new_files:
+        stats = None
+        if dataset_stats and os.path.exists(sqlite_path):
+            stats = load_dataset_stats(sqlite_path)
+        inserted = ingest_files(
+            sqlite_path,
+            [os.path.join(input_folder_path, el) for el in new_files],
+            chunksize
+        )
+        count_rows(inserted)
+        if dataset_stats:
+            if stats is None:
+                stats = stream_stats(sqlite_path, chunksize)
+            else:
+                batch = last_batch(sqlite_path)
+                for chunk in iter_data(sqlite_path, chunksize, batch):
+                    stats.update(chunk)
+            save_dataset_stats(stats, sqlite_path)
+        if feature_arrays:
+            write_arrays(sqlite_path)
+
+    with open(os.path.join(output_folder_path, 'ingestedfiles.txt'), 'w') as f:
+        f.write(', '.join(current))
+    save_manifest(current, manifest_path)
 
 if __name__ == '__main__':
-    merge_multiple_dataframes()
+    if ingestion_backend == 'sqlite':
+        sqlite_ingestion()
+    elif ingestion_mode == 'incremental':
+        incremental_ingestion()
+    else:
+        full_ingestion()
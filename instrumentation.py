@@ -0,0 +1,240 @@
+"""
+Lightweight instrumentation of the pipeline stages. Functions decorated with
+`instrumented`, or blocks run under `measure`, append a JSON record to the
+metrics log set by "metrics_log_path" in config.json with their wall time,
+CPU time, peak resident memory and the number of rows they processed. The
+log is rotated to a single backup once it reaches "metrics_log_bytes", and
+only its tail is read back. Long-running servers, which call some of the
+instrumented stages on every request, turn the instrumentation off with
+set_enabled.
+
+Peak RSS is the process' high-water mark while the stage ran. On Linux it is
+reset through /proc/self/clear_refs when the outermost stage starts, so
+nested and concurrent stages share the mark taken since then; elsewhere it
+is the high-water mark since the process started.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import json
+import time
+import resource
+import functools
+import threading
+from datetime import datetime, timezone
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+with open('config.json','r') as f:
+    config = json.load(f)
+
+metrics_log_path = config.get('metrics_log_path', 'models/metrics.jsonl')
+metrics_log_bytes = config.get('metrics_log_bytes', 1024 ** 2)
+metrics_tail_bytes = 64 * 1024
+
+_lock = threading.Lock()
+_local = threading.local()
+_active = 0
+_enabled = True
+
+
+def set_enabled(enabled: bool) -> None:
+    """
+    Turns the measuring of stages on or off for the whole process. When off,
+    instrumented functions and measured blocks run without being recorded.
+    """
+    global _enabled
+    _enabled = enabled
+
+
+def _reset_peak_rss() -> None:
+    """
+    Resets the process' peak RSS, where the kernel allows it.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def _peak_rss() -> int:
+    """
+    Reads the process' peak RSS, in bytes.
+    """
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+def _append(record: Dict, log_path: str) -> None:
+    """
+    Appends a record to the metrics log, moving the log to a `.1` backup,
+    which replaces the previous one, once it reaches "metrics_log_bytes".
+    """
+    folder = os.path.dirname(log_path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    line = json.dumps(record) + '\n'
+    with _lock:
+        with open(log_path, 'a') as f:
+            f.write(line)
+            size = f.tell()
+        if size >= metrics_log_bytes:
+            os.replace(log_path, log_path + '.1')
+
+
+@contextmanager
+def measure(
+    stage: str,
+    log_path: Optional[str] = None
+) -> Iterator[Dict]:
+    """
+    Measures the enclosed block and appends its record to the metrics log,
+    also when it raises.
+
+    Args:
+        stage: str
+            Name of the measured stage.
+        log_path: str
+            Metrics log to append to, "metrics_log_path" by default.
+    Yields:
+        record: Dict
+            The stage's record, where the block can set 'rows'.
+    """
+    global _active
+    if not _enabled:
+        yield {'stage': stage, 'rows': None}
+        return
+    with _lock:
+        if _active == 0:
+            _reset_peak_rss()
+        _active += 1
+    stack = _local.__dict__.setdefault('stack', [])
+    record = {
+        'stage': stage,
+        'started': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'pid': os.getpid(),
+        'rows': None
+    }
+    stack.append(record)
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    record['status'] = 'error'
+    try:
+        yield record
+        record['status'] = 'ok'
+    finally:
+        record['wall_seconds'] = time.perf_counter() - wall_start
+        record['cpu_seconds'] = time.process_time() - cpu_start
+        record['peak_rss_bytes'] = _peak_rss()
+        stack.pop()
+        with _lock:
+            _active -= 1
+        _append(record, log_path or metrics_log_path)
+
+
+def count_rows(rows: int) -> None:
+    """
+    Sets the number of rows processed by the innermost stage being measured
+    in the current thread. Does nothing outside of a measured stage.
+
+    Args:
+        rows: int
+            Number of rows processed.
+    """
+    stack = getattr(_local, 'stack', None)
+    if stack:
+        stack[-1]['rows'] = int(rows)
+
+
+def instrumented(
+    stage: Optional[str] = None,
+    rows: Optional[Callable[[Any], int]] = None
+) -> Callable:
+    """
+    Decorates a function so each call is measured as a stage.
+
+    Args:
+        stage: str
+            Name of the stage, the function's name by default.
+        rows: Callable
+            Gets the number of rows processed from the function's result.
+            Otherwise the function can report it with count_rows.
+    Returns:
+        decorator: Callable
+            The decorator.
+    """
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with measure(stage or func.__name__) as record:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    record['rows'] = int(rows(result))
+            return result
+        return wrapper
+    return decorator
+
+
+def _tail(path: str, tail_bytes: int) -> Tuple[List[bytes], int]:
+    """
+    Reads the whole lines within the last `tail_bytes` bytes of a file,
+    returning them with the number of bytes read.
+    """
+    with open(path, 'rb') as f:
+        start = max(f.seek(0, os.SEEK_END) - tail_bytes, 0)
+        # reading from the byte before the tail tells whether its first line
+        # is whole, the part up to the first newline is dropped otherwise
+        f.seek(max(start - 1, 0))
+        content = f.read()
+    lines = content.split(b'\n')
+    return (lines[1:] if start else lines), len(content)
+
+
+def read_metrics(
+    log_path: Optional[str] = None,
+    latest: bool = False,
+    tail_bytes: int = metrics_tail_bytes
+) -> List[Dict]:
+    """
+    Reads the most recent records of the metrics log, from its last
+    `tail_bytes` bytes and, when the log is shorter, the end of its backup.
+
+    Args:
+        log_path: str
+            Metrics log to read, "metrics_log_path" by default.
+        latest: bool
+            Whether to only return the most recent record of each stage.
+        tail_bytes: int
+            Number of bytes read from the end of the log.
+    Returns:
+        records: List[Dict]
+            The records, oldest first.
+    """
+    log_path = log_path or metrics_log_path
+    lines = []
+    # the backup is read too when the log was just rotated
+    for path in (log_path, log_path + '.1'):
+        if tail_bytes <= 0:
+            break
+        if not os.path.exists(path):
+            continue
+        part, read = _tail(path, tail_bytes)
+        lines = part + lines
+        tail_bytes -= read
+    records = [json.loads(el) for el in lines if el.strip()]
+    if latest:
+        records = list({el['stage']: el for el in records}.values())
+    return records
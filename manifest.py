@@ -0,0 +1,117 @@
+"""
+Helpers to keep track of the source files already ingested, identifying them
+by content instead of by name.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import json
+import hashlib
+from typing import Dict, List, Tuple
+
+
+def file_digest(path: str, blocksize: int = 1 << 20) -> str:
+    """
+    Calculates the sha256 digest of a file's content.
+
+    Args:
+        path: str
+            Path of the file to be hashed.
+        blocksize: int
+            Number of bytes read from the file at a time.
+    Returns:
+        digest: str
+            The hexadecimal sha256 digest of the file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(path: str) -> Dict[str, Dict]:
+    """
+    Reads a manifest file. A missing manifest is read as an empty one.
+
+    Args:
+        path: str
+            Path of the manifest file.
+    Returns:
+        manifest: Dict[str, Dict]
+            Mapping of file name to its path, size, mtime and sha256 digest.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as f:
+        return json.load(f)['files']
+
+
+def save_manifest(manifest: Dict[str, Dict], path: str) -> None:
+    """
+    Atomically writes a manifest file.
+
+    Args:
+        manifest: Dict[str, Dict]
+            Mapping of file name to its path, size, mtime and sha256 digest.
+        path: str
+            Path of the manifest file.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'files': manifest}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def scan_folder(
+    folder: str,
+    manifest: Dict[str, Dict]
+) -> Tuple[Dict[str, Dict], List[str]]:
+    """
+    Compares the csv files present in a folder against a manifest. Files whose
+    name, size and mtime match a manifest entry are taken as unchanged without
+    being read. The remaining ones are hashed, and only those whose content is
+    not in the manifest are reported as new, so renamed or touched files are
+    not read again.
+
+    Args:
+        folder: str
+            Folder to look for csv files.
+        manifest: Dict[str, Dict]
+            Manifest of the files already ingested.
+    Returns:
+        current: Dict[str, Dict]
+            Manifest describing the files currently present in the folder.
+        new_files: List[str]
+            Names of the files whose content is not in the given manifest.
+    """
+    known_digests = {entry['sha256'] for entry in manifest.values()}
+    current = {}
+    new_files = []
+    for name in sorted(
+        el for el in os.listdir(folder) if el.endswith('.csv')
+    ):
+        path = os.path.join(folder, name)
+        stat = os.stat(path)
+        entry = manifest.get(name)
+        if (
+            entry is not None
+            and entry['size'] == stat.st_size
+            and entry['mtime'] == stat.st_mtime_ns
+        ):
+            current[name] = entry
+            continue
+
+        digest = file_digest(path)
+        current[name] = {
+            'path': path,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'sha256': digest
+        }
+        if digest not in known_digests:
+            new_files.append(name)
+
+    return current, new_files
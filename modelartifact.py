@@ -0,0 +1,465 @@
+"""
+Compact binary artifact of the trained linear model. Next to the pickled
+estimator the trainer writes trainedmodel.npy, a single structured NumPy
+record holding only what predicting needs: coefficients, intercept, classes,
+the feature order and a hash of the dtype schema the model was trained with.
+It is loaded memory-mapped and LinearPredictor is rebuilt from it with NumPy
+alone, so scoring processes don't import sklearn nor unpickle its estimators
+to predict. LinearPredictor is also the scoring engine used for unpickled
+estimators, in place of their predict method. Bundles of segmented models
+are saved the same way, with the segment names and key, and loaded as a
+SegmentedPredictor. Loaded engines are kept in memory by ModelCache, which
+only rebuilds a folder's engine when its model files are replaced.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import io
+import os
+import json
+import time
+import pickle
+import hashlib
+import warnings
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Union
+from schema import SchemaWarning, dtype_schema
+from segmentation import SegmentedPredictor
+
+with open('config.json','r') as f:
+    config = json.load(f)
+
+scoring_chunksize = config.get('scoring_chunksize', 16384)
+scoring_dtype = config.get('scoring_dtype', 'float64')
+model_check_interval = config.get('model_check_interval_seconds', 0)
+artifact_name = 'trainedmodel.npy'
+pickle_name = 'trainedmodel.pkl'
+
+
+def schema_hash(feature_names: List[str]) -> str:
+    """
+    Hashes the features of a model with their declared dtypes, to tell
+    whether the data a model was trained on had the current schema.
+
+    Args:
+        feature_names: List[str]
+            The features of the model, in order.
+    Returns:
+        digest: str
+            A short hex digest of the features and their dtypes.
+    """
+    declared = [[col, dtype_schema.get(col)] for col in feature_names]
+    return hashlib.sha256(json.dumps(declared).encode()).hexdigest()[:16]
+
+
+class LinearPredictor:
+    """
+    Scoring engine of a fitted sklearn linear classifier. Its coefficients
+    are taken once, and samples are scored as matrix-vector products over
+    contiguous float arrays, `chunksize` rows at a time so each block stays
+    in cache. In float64 it gives the same results as the estimator's
+    predict; float32 is faster but may flip samples scored within rounding
+    error of the decision boundary.
+    """
+
+    def __init__(
+        self,
+        coef: np.ndarray,
+        intercept: np.ndarray,
+        classes: np.ndarray,
+        feature_names: Optional[np.ndarray] = None,
+        schema: str = '',
+        chunksize: int = scoring_chunksize,
+        dtype: str = scoring_dtype
+    ):
+        self.coef_ = np.ascontiguousarray(coef, dtype=dtype)
+        self.intercept_ = np.asarray(intercept, dtype=dtype)
+        self.classes_ = np.asarray(classes)
+        self.feature_names_in_ = feature_names
+        self.schema_hash = schema
+        self.chunksize = chunksize
+        self.dtype = np.dtype(dtype)
+
+    @classmethod
+    def from_estimator(cls, model, **kwargs) -> 'LinearPredictor':
+        """
+        Builds the engine of a fitted LogisticRegression or SGDClassifier.
+        """
+        names = getattr(model, 'feature_names_in_', None)
+        return cls(
+            model.coef_,
+            model.intercept_,
+            model.classes_,
+            names,
+            schema_hash([] if names is None else [str(el) for el in names]),
+            **kwargs
+        )
+
+    def _features(
+        self,
+        x: Union[pd.DataFrame, np.ndarray]
+    ) -> np.ndarray:
+        """
+        Returns the features as an array, with a dataframe's columns taken
+        in the model's feature order.
+        """
+        if isinstance(x, pd.DataFrame):
+            if self.feature_names_in_ is not None:
+                x = x[list(self.feature_names_in_)]
+            return x.to_numpy(dtype=self.dtype)
+        return np.asarray(x)
+
+    def decision_function(
+        self,
+        x: Union[pd.DataFrame, np.ndarray]
+    ) -> np.ndarray:
+        """
+        Computes the confidence scores of the samples.
+
+        Args:
+            x: pd.DataFrame or np.ndarray
+                The samples' features.
+        Returns:
+            scores: np.ndarray
+                One score per sample, or one per sample and class for
+                multiclass models.
+        Raises:
+            ValueError:
+                When some feature is missing or infinite, as sklearn does.
+        """
+        x = self._features(x)
+        scores = np.empty((x.shape[0], self.coef_.shape[0]), dtype=self.dtype)
+        for start in range(0, x.shape[0], self.chunksize):
+            block = np.asarray(
+                x[start:start + self.chunksize], dtype=self.dtype
+            )
+            if not np.isfinite(block).all():
+                raise ValueError('Input contains NaN or infinity.')
+            np.matmul(
+                block, self.coef_.T, out=scores[start:start + len(block)]
+            )
+        scores += self.intercept_
+        return scores.ravel() if scores.shape[1] == 1 else scores
+
+    def predict_proba(
+        self,
+        x: Union[pd.DataFrame, np.ndarray]
+    ) -> np.ndarray:
+        """
+        Estimates the probability of each class, with the logistic function
+        for binary models and the softmax of the scores otherwise.
+
+        Args:
+            x: pd.DataFrame or np.ndarray
+                The samples' features.
+        Returns:
+            proba: np.ndarray
+                One column per class, in the order of classes_.
+        """
+        scores = self.decision_function(x)
+        if scores.ndim == 1:
+            positive = 1 / (1 + np.exp(-scores))
+            return np.column_stack([1 - positive, positive])
+        scores = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return scores / scores.sum(axis=1, keepdims=True)
+
+    def predict(self, x: Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """
+        Predicts the class labels of the samples.
+
+        Args:
+            x: pd.DataFrame or np.ndarray
+                The samples' features.
+        Returns:
+            preds: np.ndarray
+                The predicted class of each sample.
+        """
+        scores = self.decision_function(x)
+        if scores.ndim == 1:
+            return self.classes_[(scores > 0).astype(int)]
+        return self.classes_[scores.argmax(axis=1)]
+
+
+def save_artifact(model, model_path: str) -> str:
+    """
+    Writes the compact artifact of a fitted linear classifier or segmented
+    model bundle.
+
+    Args:
+        model: LogisticRegression, SGDClassifier or SegmentedPredictor
+            A fitted linear classifier or bundle.
+        model_path: str
+            The folder the artifact is written to.
+    Returns:
+        path: str
+            The path of the written artifact.
+    """
+    names = getattr(model, 'feature_names_in_', None)
+    names = [] if names is None else [str(el) for el in names]
+    coef = np.asarray(model.coef_, dtype='float64')
+    classes = np.asarray(model.classes_)
+    feature_names = np.array(names, dtype='S')
+    fields = [
+        ('coef', 'f8', coef.shape),
+        ('intercept', 'f8', coef.shape[:1]),
+        ('classes', classes.dtype, classes.shape),
+        ('feature_names', feature_names.dtype, feature_names.shape),
+        ('schema_hash', 'S16')
+    ]
+    if isinstance(model, SegmentedPredictor):
+        segments = np.array(model.segments, dtype='S')
+        segment_spec = json.dumps({'key': model.key, **model.spec}).encode()
+        fields += [
+            ('segments', segments.dtype, segments.shape),
+            ('segment_spec', f'S{len(segment_spec)}')
+        ]
+    record = np.zeros((), dtype=fields)
+    record['coef'] = coef
+    record['intercept'] = model.intercept_
+    record['classes'] = classes
+    record['feature_names'] = feature_names
+    record['schema_hash'] = schema_hash(names)
+    if isinstance(model, SegmentedPredictor):
+        record['segments'] = segments
+        record['segment_spec'] = segment_spec
+    path = os.path.join(model_path, artifact_name)
+    np.save(path, record)
+    return path
+
+
+def load_predictor(
+    model_path: str,
+    content: Optional[bytes] = None
+) -> Union[LinearPredictor, SegmentedPredictor]:
+    """
+    Builds a LinearPredictor, or a SegmentedPredictor for bundles, from the
+    artifact in a folder. Warns with a SchemaWarning when the model was
+    trained under another dtype schema.
+
+    Args:
+        model_path: str
+            The folder holding the artifact.
+        content: bytes
+            The artifact's bytes when already read, or else it is loaded
+            memory-mapped.
+    Returns:
+        predictor: LinearPredictor or SegmentedPredictor
+            The predictor of the saved model.
+    """
+    if content is None:
+        record = np.load(
+            os.path.join(model_path, artifact_name), mmap_mode='r'
+        )
+    else:
+        record = np.load(io.BytesIO(content))
+    names = record['feature_names'].astype(str)
+    stored_hash = record['schema_hash'].item().decode()
+    if 'segments' in record.dtype.names:
+        spec = json.loads(record['segment_spec'].item())
+        predictor = SegmentedPredictor(
+            spec.pop('key'),
+            spec,
+            record['segments'].astype(str),
+            record['coef'],
+            record['intercept'],
+            record['classes'],
+            names.tolist()
+        )
+    else:
+        predictor = LinearPredictor(
+            record['coef'],
+            record['intercept'],
+            record['classes'],
+            names.astype(object) if names.size else None,
+            stored_hash
+        )
+    if stored_hash != schema_hash(names.tolist()):
+        warnings.warn(
+            f'{model_path}: model trained under a different dtype schema',
+            SchemaWarning
+        )
+    return predictor
+
+
+def _stamp(path: str) -> Optional[tuple]:
+    """
+    Identifies the current version of a file by its inode, size and mtime,
+    so a file replaced by os.replace is told apart even within the mtime
+    resolution.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+
+def model_version(
+    model: Union[LinearPredictor, SegmentedPredictor]
+) -> str:
+    """
+    Hashes the parameters of a scoring engine, so the same model has the
+    same version whether it was loaded from its artifact or its pickle.
+
+    Args:
+        model: LinearPredictor or SegmentedPredictor
+            The engine of a trained model.
+    Returns:
+        version: str
+            A short hex digest of the model's parameters.
+    """
+    digest = hashlib.sha256()
+    for values in (model.coef_, model.intercept_, model.classes_):
+        digest.update(np.ascontiguousarray(values, dtype='float64').tobytes())
+    names = model.feature_names_in_
+    digest.update(json.dumps([
+        [] if names is None else [str(el) for el in names],
+        [str(el) for el in getattr(model, 'segments', [])]
+    ]).encode())
+    return digest.hexdigest()[:16]
+
+
+class ModelCache:
+    """
+    In-memory cache of the scoring engines of the models saved in folders.
+    Every lookup stats the model files, at most once every `check_interval`
+    seconds, and a folder's engine is only rebuilt when their inode, size or
+    mtime changed. The new engine is swapped in whole once built, so requests
+    holding the previous one finish with it, and while a reload is under way
+    the other requests keep being served the previous engine.
+    """
+
+    def __init__(self, check_interval: float = model_check_interval):
+        """
+        Args:
+            check_interval: float
+                Minimum number of seconds between two checks of the model
+                files of a folder. With 0 they are checked on every lookup.
+        """
+        self.check_interval = check_interval
+        self._entries = {}
+        self._checked = {}
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def get(
+        self,
+        model_path: str
+    ) -> Union[LinearPredictor, SegmentedPredictor]:
+        """
+        Returns the engine of the model saved in a folder, reloading it when
+        its files changed.
+
+        Args:
+            model_path: str
+                A path indicating where to look for trained models.
+        Returns:
+            model: LinearPredictor or SegmentedPredictor
+                The engine scoring with the saved model.
+        """
+        key = os.path.abspath(model_path)
+        entry = self._entries.get(key)
+        now = time.monotonic()
+        if entry is not None and (
+            now - self._checked.get(key, 0) < self.check_interval
+        ):
+            return entry['model']
+        stamp = (
+            _stamp(os.path.join(key, artifact_name)),
+            _stamp(os.path.join(key, pickle_name))
+        )
+        self._checked[key] = now
+        if entry is not None and entry['stamp'] == stamp:
+            return entry['model']
+        # a single thread reloads, the others keep the engine they have
+        if not self._reload_lock.acquire(blocking=entry is None):
+            return entry['model']
+        try:
+            entry = self._entries.get(key)
+            if entry is None or entry['stamp'] != stamp:
+                entry = self._load(key, stamp)
+                with self._lock:
+                    self._entries[key] = entry
+            return entry['model']
+        finally:
+            self._reload_lock.release()
+
+    def _load(self, model_path: str, stamp: tuple) -> Dict:
+        """
+        Builds the engine of a folder's model, from its compact artifact
+        when there is one at least as recent as the pickle, or else from the
+        unpickled estimator, timing the reload.
+        """
+        start = time.perf_counter()
+        artifact = os.path.join(model_path, artifact_name)
+        pickled = os.path.join(model_path, pickle_name)
+        use_artifact = stamp[0] is not None and (
+            stamp[1] is None or stamp[0][2] >= stamp[1][2]
+        )
+        source = artifact if use_artifact else pickled
+        with open(source, 'rb') as f:
+            content = f.read()
+        if use_artifact:
+            model = load_predictor(model_path, content)
+        else:
+            model = pickle.loads(content)
+            if not isinstance(model, SegmentedPredictor):
+                model = LinearPredictor.from_estimator(model)
+        previous = self._entries.get(model_path)
+        return {
+            'stamp': stamp,
+            'model': model,
+            'version': model_version(model),
+            'source': os.path.basename(source),
+            'loaded_at': datetime.now(timezone.utc).isoformat(
+                timespec='seconds'
+            ),
+            'reload_seconds': time.perf_counter() - start,
+            'reloads': 1 if previous is None else previous['reloads'] + 1
+        }
+
+    def info(self, model_path: str) -> Optional[Dict]:
+        """
+        Describes the engine in memory for a folder, for monitoring.
+
+        Args:
+            model_path: str
+                A path indicating where to look for trained models.
+        Returns:
+            info: Dict
+                The version of the model, the file it was loaded from, when
+                it was loaded, how long loading took and how many times the
+                folder's model was loaded, or None when none was loaded yet.
+        """
+        entry = self._entries.get(os.path.abspath(model_path))
+        if entry is None:
+            return None
+        return {
+            key: value for key, value in entry.items()
+            if key not in ('stamp', 'model')
+        }
+
+
+model_cache = ModelCache()
+
+
+def load_model(
+    model_path: str
+) -> Union[LinearPredictor, SegmentedPredictor]:
+    """
+    Loads the scoring engine of the model saved in a folder through the
+    process-wide ModelCache, so the model files are only read again when
+    they change.
+
+    Args:
+        model_path: str
+            A path indicating where to look for trained models.
+    Returns:
+        model: LinearPredictor or SegmentedPredictor
+            The engine scoring with the saved model.
+    """
+    return model_cache.get(model_path)
@@ -0,0 +1,114 @@
+"""
+Parsing of the records sent in the body of /prediction requests and encoding
+of its streamed responses. Records can be sent as JSON rows, as CSV, or as a
+compact columnar binary: an .npz archive holding one NumPy array per column.
+Streamed predictions are sent either as NDJSON, one JSON array per chunk, or
+as length-prefixed binary frames: a little-endian uint32 byte count followed
+by that many bytes of predictions.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import io
+import json
+import struct
+import numpy as np
+import pandas as pd
+from schema import apply_schema, parser_dtypes, subset_schema
+
+JSON_TYPES = ('application/json',)
+CSV_TYPES = ('text/csv', 'application/csv')
+NPZ_TYPES = ('application/x-npz', 'application/octet-stream')
+
+
+def parse_records(body: bytes, content_type: str) -> pd.DataFrame:
+    """
+    Parses the records of a request body, applying the declared dtype schema
+    to the columns present.
+
+    JSON bodies are either a list of row objects, an object of column
+    lists, or a {"columns": [...], "data": [[...], ...]} object.
+
+    Args:
+        body: bytes
+            The request body.
+        content_type: str
+            Its MIME type, without parameters.
+    Returns:
+        records: pd.DataFrame
+            The parsed records.
+    Raises:
+        ValueError: when the content type isn't supported or the body
+            can't be parsed.
+    """
+    if content_type in JSON_TYPES:
+        rows = json.loads(body)
+        if isinstance(rows, dict) and 'data' in rows:
+            records = pd.DataFrame(rows['data'], columns=rows.get('columns'))
+        elif isinstance(rows, (dict, list)):
+            records = pd.DataFrame(rows)
+        else:
+            raise ValueError('JSON records must be an object or a list.')
+    elif content_type in CSV_TYPES:
+        records = pd.read_csv(io.BytesIO(body), dtype=parser_dtypes)
+    elif content_type in NPZ_TYPES:
+        with np.load(io.BytesIO(body), allow_pickle=False) as arrays:
+            records = pd.DataFrame({col: arrays[col] for col in arrays.files})
+    else:
+        raise ValueError(f'Unsupported content type: {content_type}')
+    return apply_schema(records, subset_schema(records.columns), 'request')
+
+
+def encode_npz(records: pd.DataFrame) -> bytes:
+    """
+    Encodes records in the columnar binary format accepted by
+    parse_records.
+
+    Args:
+        records: pd.DataFrame
+            The records to be sent.
+    Returns:
+        body: bytes
+            An .npz archive with one array per column.
+    """
+    arrays = {}
+    for col in records.columns:
+        values = records[col]
+        if values.dtype == object or values.dtype.name == 'category':
+            # object arrays would need pickle, so strings are sent as such
+            arrays[col] = values.astype(str).to_numpy(dtype=str)
+        else:
+            arrays[col] = values.to_numpy()
+    buffer = io.BytesIO()
+    np.savez(buffer, **arrays)
+    return buffer.getvalue()
+
+
+def encode_ndjson(preds: np.ndarray) -> bytes:
+    """
+    Encodes a chunk of predictions as one NDJSON line.
+    """
+    return (json.dumps(preds.tolist()) + '\n').encode()
+
+
+def frame_dtype(classes: np.ndarray) -> np.dtype:
+    """
+    Returns the smallest little-endian integer dtype holding every class, or
+    the classes' own dtype when they aren't integers.
+    """
+    if classes.dtype.kind not in 'iu':
+        return classes.dtype
+    for dtype in ('<i1', '<i2', '<i4', '<i8'):
+        info = np.iinfo(dtype)
+        if classes.min() >= info.min and classes.max() <= info.max:
+            return np.dtype(dtype)
+    return np.dtype('<u8')
+
+
+def encode_frame(preds: np.ndarray, dtype: np.dtype) -> bytes:
+    """
+    Encodes a chunk of predictions as a length-prefixed binary frame.
+    """
+    payload = np.ascontiguousarray(preds, dtype=dtype).tobytes()
+    return struct.pack('<I', len(payload)) + payload
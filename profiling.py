@@ -0,0 +1,249 @@
+"""
+Single-pass profile of the numeric columns of a dataset. The columns are
+gathered into one float64 matrix and every statistic the diagnostics report,
+from counts of missing values to quantiles, is computed with column-wise
+NumPy reductions over it, instead of one pandas call per column and metric.
+Profiles are kept per dataset and only computed again when its files change.
+With "profile_mode" set to "streaming" in config.json, datasets are instead
+profiled chunk by chunk from mergeable streaming statistics, for datasets
+larger than memory, with quantiles estimated within the rank error bound
+documented in streamstats. With "stored", the profile is read from the
+statistics persisted at ingestion, which takes time proportional to the
+number of columns and not of rows; they are streamed again and persisted
+when missing or stale. As the sketches are exact while a column fits in them,
+"stored" is the default, and "exact" always reads the whole dataset.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import json
+import threading
+import numpy as np
+import pandas as pd
+from typing import List, Optional
+from dataloader import dataset_fingerprint, load_data
+from streamstats import (
+    StreamingStats, load_dataset_stats, rank_error, save_dataset_stats,
+    stream_stats
+)
+
+with open('config.json','r') as f:
+    config = json.load(f)
+
+profile_quantiles = config.get('profile_quantiles', [0.25, 0.75])
+profile_mode = config.get('profile_mode', 'stored')
+profile_blocksize = 65536
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+
+def quantile_name(q: float) -> str:
+    """
+    Names the profile column of a quantile, e.g. 'q25' for 0.25.
+    """
+    return f'q{100 * q:g}'
+
+
+def column_quantiles(column: np.ndarray, levels: List[float]) -> np.ndarray:
+    """
+    Computes quantiles of a column without missing values, interpolating
+    linearly between order statistics like np.percentile. Integer columns
+    whose range isn't much wider than their length are counted with
+    np.bincount, which finds every order statistic in a single pass; other
+    columns are partitioned once around all the ranks needed, with the
+    extremes taken by min and max reductions.
+
+    Args:
+        column: np.ndarray
+            The values, with at least one.
+        levels: List[float]
+            The quantiles, between 0 and 1.
+    Returns:
+        values: np.ndarray
+            The value of each quantile.
+    """
+    positions = np.asarray(levels, dtype='float64') * (len(column) - 1)
+    lower = np.floor(positions).astype(np.intp)
+    upper = np.ceil(positions).astype(np.intp)
+    ranks = np.union1d(lower, upper)
+    low, high = column.min(), column.max()
+    if column.dtype.kind in 'iu' and int(high) - int(low) <= 4 * len(column):
+        counts = np.cumsum(np.bincount(
+            column if low >= 0 else (column - low).astype(np.intp)
+        ))
+        low = 0 if low >= 0 else low
+        stats = low + np.searchsorted(counts, ranks, side='right')
+    else:
+        inner = ranks[(ranks > 0) & (ranks < len(column) - 1)]
+        stats = np.empty(len(ranks), dtype=column.dtype)
+        if len(inner):
+            stats[np.isin(ranks, inner)] = np.partition(column, inner)[inner]
+        stats[ranks == 0] = low
+        stats[ranks == len(column) - 1] = high
+    stats = stats.astype('float64')
+    below = stats[np.searchsorted(ranks, lower)]
+    above = stats[np.searchsorted(ranks, upper)]
+    return below + (positions - lower) * (above - below)
+
+
+def profile_frame(
+    frame: pd.DataFrame,
+    quantiles: List[float] = profile_quantiles
+) -> pd.DataFrame:
+    """
+    Profiles the numeric columns of a frame.
+
+    Args:
+        frame: pd.DataFrame
+            The data to be profiled. Non-numeric columns are left out.
+        quantiles: List[float]
+            Quantiles computed besides the median, between 0 and 1.
+    Returns:
+        profile: pd.DataFrame
+            One row per numeric column with its count of values, count and
+            ratio of missing values, mean, standard deviation (ddof=1), min,
+            max, median and quantiles, interpolated linearly like pandas.
+            The number of rows profiled is kept in profile.attrs['rows'].
+    """
+    numeric = frame.select_dtypes('number')
+    x = numeric.to_numpy(dtype='float64')
+    rows = x.shape[0]
+    # only float columns can hold missing values, and the mask of missing
+    # values is only built when some are found
+    missing_count = np.zeros(x.shape[1], dtype=np.intp)
+    for j, dtype in enumerate(numeric.dtypes):
+        if dtype.kind == 'f':
+            missing_count[j] = np.count_nonzero(np.isnan(x[:, j]))
+    count = rows - missing_count
+    has_missing = missing_count > 0
+    missing = None
+    if has_missing.any():
+        missing = np.isnan(x)
+        x = np.where(missing, 0.0, x)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = x.sum(axis=0) / count
+        # squared deviations are summed by blocks of rows, so no temporary
+        # the size of the data is allocated
+        squares = np.zeros(x.shape[1])
+        for start in range(0, rows, profile_blocksize):
+            deviations = x[start:start + profile_blocksize] - mean
+            if missing is not None:
+                deviations[missing[start:start + profile_blocksize]] = 0.0
+            squares += np.einsum('ij,ij->j', deviations, deviations)
+        std = np.sqrt(squares / (count - 1))
+    std[count < 2] = np.nan
+
+    levels = [0.0, 0.5, 1.0] + list(quantiles)
+    values = np.full((len(levels), x.shape[1]), np.nan)
+    for j, col in enumerate(numeric.columns):
+        column = numeric[col].to_numpy()
+        if has_missing[j]:
+            column = column[~missing[:, j]]
+        if len(column):
+            values[:, j] = column_quantiles(column, levels)
+
+    profile = pd.DataFrame({
+        'count': count,
+        'missing': missing_count,
+        'missing_ratio': missing_count / rows if rows else np.nan,
+        'mean': mean,
+        'std': std,
+        'min': values[0],
+        'max': values[2],
+        'median': values[1],
+        **{
+            quantile_name(q): values[3 + i]
+            for i, q in enumerate(quantiles)
+        }
+    }, index=numeric.columns)
+    profile.attrs['rows'] = rows
+    return profile
+
+
+def profile_stats(
+    stats: StreamingStats,
+    quantiles: List[float] = profile_quantiles
+) -> pd.DataFrame:
+    """
+    Builds the profile of a dataset from its streaming statistics. Counts,
+    moments, min and max are exact; the median and quantiles are estimated
+    by the sketches, within the rank error kept in profile.attrs.
+
+    Args:
+        stats: StreamingStats
+            The statistics of the dataset.
+        quantiles: List[float]
+            Quantiles estimated besides the median, between 0 and 1.
+    Returns:
+        profile: pd.DataFrame
+            The profile of the dataset, laid out as in profile_frame.
+    """
+    columns = stats.columns or []
+    if not columns:
+        return profile_frame(pd.DataFrame(index=range(stats.rows)), quantiles)
+    values = stats.quantiles([0.5] + list(quantiles))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        missing_ratio = stats.missing / stats.rows
+    profile = pd.DataFrame({
+        'count': stats.count,
+        'missing': stats.missing,
+        'missing_ratio': missing_ratio,
+        'mean': np.where(stats.count > 0, stats.mean, np.nan),
+        'std': stats.std,
+        'min': stats.minimum,
+        'max': stats.maximum,
+        'median': values[0],
+        **{
+            quantile_name(q): values[1 + i]
+            for i, q in enumerate(quantiles)
+        }
+    }, index=pd.Index(columns))
+    profile.attrs['rows'] = stats.rows
+    profile.attrs['rank_error'] = rank_error(stats.k)
+    return profile
+
+
+def profile_dataset(
+    data_path: str,
+    quantiles: Optional[List[float]] = None
+) -> pd.DataFrame:
+    """
+    Profiles the deduplicated data of a dataset, reusing the last profile of
+    the dataset while its files are unchanged. In streaming mode the data is
+    read in chunks and never held in memory as a whole, and in stored mode
+    the statistics persisted at ingestion are read instead of the data.
+
+    Args:
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+        quantiles: List[float]
+            Quantiles computed besides the median, "profile_quantiles" by
+            default.
+    Returns:
+        profile: pd.DataFrame
+            The profile of the dataset, see profile_frame. It is shared with
+            other callers and must not be modified in place.
+    """
+    quantiles = profile_quantiles if quantiles is None else quantiles
+    key = (dataset_fingerprint(data_path), tuple(quantiles), profile_mode)
+    with _profiles_lock:
+        cached = _profiles.get(data_path)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+    if profile_mode == 'stored':
+        stats = load_dataset_stats(data_path)
+        if stats is None:
+            stats = stream_stats(data_path)
+            save_dataset_stats(stats, data_path)
+        profile = profile_stats(stats, quantiles)
+    elif profile_mode == 'streaming':
+        profile = profile_stats(stream_stats(data_path), quantiles)
+    else:
+        profile = profile_frame(load_data(data_path), quantiles)
+    with _profiles_lock:
+        _profiles[data_path] = (key, profile)
+    return profile
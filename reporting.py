@@ -4,12 +4,12 @@ Script for generating a confusion matrix plot over the trained model's results.
 Author: Paulo Souza
 Date: Mar 2023
 '''
-import pandas as pd
 import numpy as np
 from sklearn.metrics import confusion_matrix
 import json
 import os
 from diagnostics import model_predictions
+from dataloader import load_arrays
 
 with open('config.json','r') as f:
     config = json.load(f)
@@ -33,16 +33,7 @@ def score_model(
     '''
     preds = model_predictions(data_path, model_path)
 
-    test_data = [el for el in os.listdir(data_path) if '.csv' in el]
-    final = pd.DataFrame()
-    for data in test_data:
-        temp = pd.read_csv(os.path.join(test_data_path, data))
-        final = pd.concat([final, temp], axis=0)
-    final.drop_duplicates(inplace=True)
-    final.drop('corporation', axis=1, inplace=True)
-
-    x_test = final.drop('exited', axis=1)
-    y_test = final['exited']
+    _, y_test, _ = load_arrays(data_path)
 
     conf = confusion_matrix(y_test, preds)
     with open(
@@ -0,0 +1,119 @@
+"""
+Cache of the results of the monitoring endpoints. A result is stored under a
+digest of everything it was computed from, such as the version of the model,
+the fingerprint of the dataset and the request parameters, which also serves
+as its ETag. Entries expire after "result_cache_ttl_seconds" and the least
+recently used ones are evicted once their bodies exceed "result_cache_bytes"
+in total.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+with open('config.json','r') as f:
+    config = json.load(f)
+
+result_cache_ttl = config.get('result_cache_ttl_seconds', 300)
+result_cache_bytes = config.get('result_cache_bytes', 16 * 1024 ** 2)
+
+
+def file_stamp(path: str) -> Optional[Tuple]:
+    """
+    Identifies the current version of a file by its size and mtime, or None
+    when it doesn't exist.
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_size, stat.st_mtime_ns)
+
+
+def result_key(*inputs: Any) -> str:
+    """
+    Digests the inputs a result was computed from into its cache key and
+    ETag.
+
+    Args:
+        inputs: Any
+            JSON-serializable values identifying the inputs, such as model
+            versions, dataset fingerprints and request parameters.
+    Returns:
+        key: str
+            A hex digest of the inputs.
+    """
+    encoded = json.dumps(inputs, default=str).encode()
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of serialized results with a time to live and a
+    bound on the total size of the stored bodies.
+    """
+
+    def __init__(
+        self,
+        ttl: float = result_cache_ttl,
+        max_bytes: int = result_cache_bytes
+    ):
+        """
+        Args:
+            ttl: float
+                Seconds after which an entry is computed again, even when its
+                inputs didn't change.
+            max_bytes: int
+                Total size of the bodies kept, beyond which the least recently
+                used entries are evicted.
+        """
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Returns the body and MIME type stored under a key, or None when there
+        is no live entry for it.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._drop(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1], entry[2]
+
+    def put(self, key: str, body: bytes, mimetype: str) -> None:
+        """
+        Stores a body and its MIME type under a key, evicting the least
+        recently used entries to stay within the size bound. Bodies larger
+        than the bound aren't stored.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if len(body) > self.max_bytes:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, body, mimetype)
+            self._size += len(body)
+            while self._size > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key: str) -> None:
+        """
+        Removes an entry, with the lock held.
+        """
+        _, body, _ = self._entries.pop(key)
+        self._size -= len(body)
@@ -0,0 +1,194 @@
+"""
+Persistent index of the fingerprints of the rows already ingested, used to
+drop duplicated records across ingestion runs without rehashing the whole
+ingested dataset.
+
+The index is a sorted array of 64-bit row fingerprints saved as a .npy file,
+so it costs 8 bytes per unique ingested row on disk and is memory-mapped when
+read. Lookups are binary searches over it. Fingerprints added during a run
+are kept in a Python set until the index is saved, which costs roughly 60 to
+70 bytes per new row, and saving merges them into a new array of 8 bytes per
+row in total.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from typing import Optional
+
+
+def row_hashes(data: pd.DataFrame) -> np.ndarray:
+    """
+    Calculates a 64-bit fingerprint for each row of the given dataframe.
+    Numeric columns are hashed as float64 and the remaining ones as strings, so
+    the same record gets the same fingerprint regardless of the dtype pandas
+    inferred for the chunk it was read in.
+
+    Args:
+        data: pd.DataFrame
+            The rows to be fingerprinted.
+    Returns:
+        hashes: np.ndarray
+            An uint64 array with one fingerprint per row.
+    """
+    normalized = {}
+    for col in data.columns:
+        if pd.api.types.is_numeric_dtype(data[col]):
+            normalized[col] = data[col].astype('float64')
+        else:
+            normalized[col] = data[col].astype(str)
+    normalized = pd.DataFrame(normalized, index=data.index)
+    return pd.util.hash_pandas_object(normalized, index=False).to_numpy()
+
+
+class RowIndex:
+    """
+    Set of row fingerprints made of a sorted, possibly memory-mapped, array
+    of the fingerprints persisted by previous runs plus the ones added since.
+
+    Args:
+        hashes: np.ndarray
+            Sorted array of unique uint64 fingerprints.
+    """
+
+    def __init__(self, hashes: Optional[np.ndarray] = None):
+        self.hashes = (
+            np.empty(0, dtype='uint64') if hashes is None else hashes
+        )
+        self.added = set()
+
+    def __len__(self) -> int:
+        return self.hashes.shape[0] + len(self.added)
+
+    def filter_new(self, hashes: np.ndarray) -> np.ndarray:
+        """
+        Flags the fingerprints not yet in the index, keeping only the first
+        occurrence of the ones repeated in `hashes`, and adds them to it.
+
+        Args:
+            hashes: np.ndarray
+                Fingerprints of a chunk of rows.
+        Returns:
+            keep: np.ndarray
+                A boolean mask of the rows to be kept.
+        """
+        keep = ~pd.Series(hashes).duplicated().to_numpy()
+        if self.hashes.shape[0]:
+            pos = np.searchsorted(self.hashes, hashes)
+            pos[pos == self.hashes.shape[0]] = 0
+            keep &= self.hashes[pos] != hashes
+        if self.added:
+            keep &= np.array(
+                [h not in self.added for h in hashes.tolist()], dtype=bool
+            )
+        self.added.update(hashes[keep].tolist())
+        return keep
+
+    def merged(self) -> np.ndarray:
+        """
+        Returns the sorted array of every fingerprint in the index.
+        """
+        added = np.fromiter(self.added, dtype='uint64', count=len(self.added))
+        added.sort()
+        return np.insert(
+            np.asarray(self.hashes),
+            np.searchsorted(self.hashes, added),
+            added
+        )
+
+
+def _meta_path(index_path: str) -> str:
+    return os.path.splitext(index_path)[0] + '.json'
+
+
+def save_index(index: RowIndex, index_path: str, csv_path: str) -> None:
+    """
+    Atomically persists an index, recording the state of the dataset it
+    describes.
+
+    Args:
+        index: RowIndex
+            The index to be saved.
+        index_path: str
+            Path of the .npy index file.
+        csv_path: str
+            Path of the csv dataset the index describes.
+    """
+    hashes = index.merged()
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, hashes)
+    os.replace(tmp_path, index_path)
+
+    stat = os.stat(csv_path)
+    with open(_meta_path(index_path), 'w') as f:
+        json.dump({
+            'rows': int(hashes.shape[0]),
+            'source': {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        }, f)
+
+
+def load_index(index_path: str, csv_path: str) -> Optional[RowIndex]:
+    """
+    Memory-maps a persisted index.
+
+    Args:
+        index_path: str
+            Path of the .npy index file.
+        csv_path: str
+            Path of the csv dataset the index describes.
+    Returns:
+        index: RowIndex
+            The persisted index, or None when it is missing or was built for
+            a different version of the dataset.
+    """
+    try:
+        with open(_meta_path(index_path), 'r') as f:
+            meta = json.load(f)
+        hashes = np.load(index_path, mmap_mode='r')
+    except (OSError, ValueError):
+        return None
+
+    stat = os.stat(csv_path)
+    if (
+        meta['source']['size'] != stat.st_size
+        or meta['source']['mtime'] != stat.st_mtime_ns
+    ):
+        return None
+    return RowIndex(hashes)
+
+
+def rebuild_index(
+    index_path: str,
+    csv_path: str,
+    chunksize: int = 100000
+) -> RowIndex:
+    """
+    Rebuilds and persists the index of a csv dataset, reading it in chunks.
+
+    Args:
+        index_path: str
+            Path of the .npy index file.
+        csv_path: str
+            Path of the csv dataset to be indexed.
+        chunksize: int
+            Number of rows read from the dataset at a time.
+    Returns:
+        index: RowIndex
+            The rebuilt index.
+    """
+    hashes = [
+        row_hashes(chunk)
+        for chunk in pd.read_csv(csv_path, chunksize=chunksize)
+    ]
+    hashes = (
+        np.unique(np.concatenate(hashes)) if hashes
+        else np.empty(0, dtype='uint64')
+    )
+    index = RowIndex(hashes)
+    save_index(index, index_path, csv_path)
+    return index
@@ -0,0 +1,220 @@
+"""
+Declared dtype schema of the project's datasets. Numeric columns are downcast
+and the corporation column is dictionary-encoded as a categorical, as set in
+the "schema" entry of config.json, cutting the memory footprint of the loaded
+frames and speeding up deduplication.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import json
+import warnings
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from typing import Dict, List, Optional
+
+with open('config.json','r') as f:
+    config = json.load(f)
+
+dtype_schema = config.get('schema', {})
+parser_dtypes = {
+    col: dtype for col, dtype in dtype_schema.items() if dtype == 'category'
+}
+
+
+class SchemaWarning(UserWarning):
+    """
+    Raised when a dataset does not conform to the declared schema.
+    """
+
+
+def warn_violations(violations: List[str], source: str) -> None:
+    """
+    Reports the schema violations found in a dataset as one SchemaWarning.
+    """
+    if violations:
+        warnings.warn(
+            f'{source} does not match the declared schema: '
+            + '; '.join(violations),
+            SchemaWarning
+        )
+
+
+def apply_schema(
+    data: pd.DataFrame,
+    schema: Dict[str, str] = dtype_schema,
+    source: str = 'dataset',
+    violations: Optional[List[str]] = None
+) -> pd.DataFrame:
+    """
+    Casts the columns of a dataframe to the declared dtypes. Columns that
+    can't be safely cast, because of missing values, out-of-range or
+    non-integer values, are kept with the dtype pandas inferred and reported
+    as a SchemaWarning, as are missing and undeclared columns.
+
+    Args:
+        data: pd.DataFrame
+            The dataframe to be cast.
+        schema: Dict[str, str]
+            Mapping of column name to its declared dtype.
+        source: str
+            Name of the dataset, used in the violation reports.
+        violations: List[str]
+            When given, the violations not yet in it are appended to it
+            instead of being reported, so a dataset read in chunks can be
+            reported once.
+    Returns:
+        data: pd.DataFrame
+            The dataframe with its columns cast to the declared dtypes.
+    """
+    found = [
+        f'{col}: undeclared column'
+        for col in data.columns if schema and col not in schema
+    ]
+    casts = {}
+    for col, dtype in schema.items():
+        if col not in data.columns:
+            found.append(f'{col}: missing column')
+            continue
+        values = data[col]
+        if dtype == 'category':
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                casts[col] = 'category'
+            continue
+
+        target = np.dtype(dtype)
+        if values.dtype == target:
+            continue
+        if not pd.api.types.is_numeric_dtype(values):
+            found.append(
+                f'{col}: non-numeric values, kept as {values.dtype}'
+            )
+            continue
+        if target.kind in 'iu':
+            if values.isna().any():
+                found.append(
+                    f'{col}: missing values, kept as {values.dtype}'
+                )
+                continue
+            info = np.iinfo(target)
+            if values.size and (
+                values.min() < info.min or values.max() > info.max
+            ):
+                found.append(
+                    f'{col}: values out of {dtype} range, kept as '
+                    f'{values.dtype}'
+                )
+                continue
+            if values.dtype.kind == 'f' and (values % 1 != 0).any():
+                found.append(
+                    f'{col}: non-integer values, kept as {values.dtype}'
+                )
+                continue
+        casts[col] = target
+
+    if violations is None:
+        warn_violations(found, source)
+    else:
+        violations.extend(el for el in found if el not in violations)
+    return data.astype(casts) if casts else data
+
+
+def subset_schema(columns: List[str]) -> Dict[str, str]:
+    """
+    Returns the declared schema restricted to the given columns, for data
+    read with only some of the dataset's columns.
+    """
+    return {
+        col: dtype for col, dtype in dtype_schema.items() if col in columns
+    }
+
+
+def nullable_integers(
+    data: pd.DataFrame,
+    schema: Dict[str, str] = dtype_schema
+) -> pd.DataFrame:
+    """
+    Casts the declared integer columns that were kept as float because of
+    missing values to pandas' nullable integer dtypes, so they are written
+    as integers whatever the rows they were read with, e.g. "45" and not
+    "45.0". Columns with non-integer values are left as they are.
+
+    Args:
+        data: pd.DataFrame
+            The dataframe to be cast.
+        schema: Dict[str, str]
+            Mapping of column name to its declared dtype.
+    Returns:
+        data: pd.DataFrame
+            The dataframe with its integer columns cast.
+    """
+    casts = {}
+    for col, dtype in schema.items():
+        if dtype == 'category' or col not in data.columns:
+            continue
+        target = np.dtype(dtype)
+        values = data[col]
+        if target.kind not in 'iu' or values.dtype.kind != 'f':
+            continue
+        present = values.dropna()
+        if (present % 1 != 0).any():
+            continue
+        info = np.iinfo(target)
+        if present.size and (
+            present.min() < info.min or present.max() > info.max
+        ):
+            continue
+        casts[col] = target.name.capitalize().replace('Ui', 'UI')
+    return data.astype(casts) if casts else data
+
+
+def read_csv(path: str, **kwargs) -> pd.DataFrame:
+    """
+    Parses a csv file applying the declared schema. Categorical columns are
+    encoded by the parser itself, so their strings are never materialized as
+    Python objects; numeric columns are downcast after parsing.
+
+    Args:
+        path: str
+            Path of the csv file.
+        **kwargs:
+            Extra arguments passed to pd.read_csv.
+    Returns:
+        data: pd.DataFrame
+            The parsed dataset.
+    """
+    return apply_schema(
+        pd.read_csv(path, dtype=parser_dtypes, **kwargs),
+        source=path
+    )
+
+
+def concat(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenates dataframes keeping their categorical columns categorical,
+    which pd.concat only does when every frame shares the same categories.
+
+    Args:
+        frames: List[pd.DataFrame]
+            The dataframes to be concatenated.
+    Returns:
+        final: pd.DataFrame
+            The concatenated dataframe.
+    """
+    if not frames:
+        return pd.DataFrame()
+    for col in frames[0].columns:
+        if not isinstance(frames[0][col].dtype, pd.CategoricalDtype):
+            continue
+        parts = [frame[col] for frame in frames if col in frame.columns]
+        if not all(isinstance(el.dtype, pd.CategoricalDtype) for el in parts):
+            continue
+        categories = union_categoricals(parts).categories
+        frames = [
+            frame.assign(**{col: frame[col].cat.set_categories(categories)})
+            if col in frame.columns else frame
+            for frame in frames
+        ]
+    return pd.concat(frames, axis=0)
@@ -5,13 +5,13 @@ Author: Paulo Souza
 Date: Mar 2023
 """
 
-import pandas as pd
-import pickle
+import numpy as np
 import os
-from sklearn.metrics import f1_score
-from sklearn.linear_model import LogisticRegression
 import json
-from diagnostics import model_predictions
+from typing import Optional
+from dataloader import load_inputs
+from modelartifact import load_model
+from instrumentation import count_rows, instrumented
 
 with open('config.json','r') as f:
     config = json.load(f)
@@ -27,9 +27,33 @@ if test_data_path not in current_folders:
         """
     )
 
+def f1_score(y_true: np.ndarray, y_pred: np.ndarray) -> float:
+    """
+    Computes the F1-score of the positive class 1, like sklearn's f1_score
+    with its defaults, without importing sklearn in scoring processes.
+
+    Args:
+        y_true: np.ndarray
+            The true labels.
+        y_pred: np.ndarray
+            The predicted labels.
+    Returns:
+        f1: float
+            The F1-score, 0.0 when there are no positive labels nor
+            predictions.
+    """
+    true_pos = np.count_nonzero((y_true == 1) & (y_pred == 1))
+    errors = np.count_nonzero(y_true != y_pred)
+    if true_pos + errors == 0:
+        return 0.0
+    return float(2 * true_pos / (2 * true_pos + errors))
+
+@instrumented()
 def score_model(
     data_path: str = test_data_path,
-    model_path: str = model_path
+    model_path: str = model_path,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None
 ) -> float:
     """
     Takes a trained model, loads test data, and calculates an F1 score for the
@@ -38,26 +62,27 @@ def score_model(
     
     Args:
         data_path: str
-            A path indicating where to look for test datasets.
+            A path indicating where to look for test datasets, or the path
+            of a SQLite store of ingested records.
         model_path: str
             A path indicating where to look for trained models.
+        batch: int
+            Only score the records of this batch of a SQLite store.
+        corporation: str
+            Only score the records of this corporation of a SQLite store.
     Returns:
         f1: float
             F1-score obtained by the trained model over the test data.    
     """
-    test_data = [el for el in os.listdir(data_path) if '.csv' in el]
-    final = pd.DataFrame()
-    for data in test_data:
-        temp = pd.read_csv(os.path.join(data_path, data))
-        final = pd.concat([final, temp], axis=0)
-    final.drop_duplicates(inplace=True)
-    final.drop('corporation', axis=1, inplace=True)
-
-    x_test = final.drop('exited', axis=1)
-    y_test = final['exited']
-
-    with open(os.path.join(model_path, 'trainedmodel.pkl'), 'rb') as f:
-        lr = pickle.load(f)
+    lr = load_model(model_path)
+    x_test, y_test = load_inputs(
+        data_path,
+        batch,
+        corporation,
+        getattr(lr, 'routing_columns', ()),
+        getattr(lr, 'feature_names_in_', None)
+    )
+    count_rows(x_test.shape[0])
 
     preds = lr.predict(x_test)
     f1 = f1_score(y_test, preds)
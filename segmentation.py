@@ -0,0 +1,193 @@
+"""
+Segmented models: one linear model per segment of the data, plus a global
+model for segments too small or too uniform to fit on their own and for
+segments unseen at training time. Segments are set by "segmentation" in
+config.json, either the first letters of the corporation or bands of
+number_of_employees. SegmentedPredictor routes every row to its segment's
+coefficients in vectorized chunks of "scoring_chunksize" rows, with NumPy
+alone.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import json
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Union
+
+with open('config.json','r') as f:
+    config = json.load(f)
+
+segmentation = config.get('segmentation', {})
+segment_key = segmentation.get('key', 'employee_band')
+prefix_length = segmentation.get('prefix_length', 1)
+employee_bands = segmentation.get('employee_bands', [10, 100, 1000])
+min_segment_rows = segmentation.get('min_segment_rows', 50)
+segment_workers = segmentation.get('workers', 1)
+scoring_chunksize = config.get('scoring_chunksize', 16384)
+
+
+def band_names(edges: List[float]) -> np.ndarray:
+    """
+    Names the bands delimited by the given edges, as [low, high) intervals.
+    """
+    bounds = ['-inf'] + [f'{el:g}' for el in edges] + ['inf']
+    return np.array([
+        f'[{low}, {high})' for low, high in zip(bounds[:-1], bounds[1:])
+    ])
+
+
+def segment_labels(
+    data: Union[pd.DataFrame, np.ndarray],
+    key: str = segment_key,
+    spec: Optional[Dict] = None,
+    feature_names: Optional[List[str]] = None
+) -> np.ndarray:
+    """
+    Computes the segment of every row.
+
+    Args:
+        data: pd.DataFrame or np.ndarray
+            The rows. Arrays only hold features, so they can only be
+            segmented by employee band.
+        key: str
+            'corporation_prefix' or 'employee_band'.
+        spec: Dict
+            The prefix length or band edges, config.json's by default.
+        feature_names: List[str]
+            The columns of an array.
+    Returns:
+        labels: np.ndarray
+            The segment name of every row.
+    """
+    spec = spec or {
+        'prefix_length': prefix_length, 'employee_bands': employee_bands
+    }
+    if key == 'corporation_prefix':
+        prefixes = pd.Series(data['corporation']).astype(str).str[
+            :spec['prefix_length']
+        ]
+        return prefixes.to_numpy(dtype=str)
+    if key == 'employee_band':
+        if isinstance(data, pd.DataFrame):
+            employees = data['number_of_employees'].to_numpy()
+        else:
+            employees = data[:, feature_names.index('number_of_employees')]
+        edges = spec['employee_bands']
+        return band_names(edges)[np.searchsorted(edges, employees, 'right')]
+    raise ValueError(f'Unknown segment key: {key}')
+
+
+class SegmentedPredictor:
+    """
+    Bundle of binary linear models, one per segment plus a global fallback,
+    giving for each row the prediction of its segment's model.
+    """
+
+    def __init__(
+        self,
+        key: str,
+        spec: Dict,
+        segments: np.ndarray,
+        coef: np.ndarray,
+        intercept: np.ndarray,
+        classes: np.ndarray,
+        feature_names: List[str]
+    ):
+        """
+        Args:
+            key: str
+                The segment key, see segment_labels.
+            spec: Dict
+                The prefix length or band edges of the segments.
+            segments: np.ndarray
+                The sorted names of the segments with their own model.
+            coef: np.ndarray
+                One row of coefficients per segment, followed by the global
+                model's.
+            intercept: np.ndarray
+                The intercepts, in the same order.
+            classes: np.ndarray
+                The two classes predicted.
+            feature_names: List[str]
+                The features of the models, in order.
+        """
+        self.key = key
+        self.spec = spec
+        self.segments = segments
+        self.coef_ = coef
+        self.intercept_ = intercept
+        self.classes_ = classes
+        self.feature_names_in_ = np.array(feature_names, dtype=object)
+
+    @property
+    def routing_columns(self) -> tuple:
+        """
+        Non-feature columns the rows need to be routed.
+        """
+        return ('corporation',) if self.key == 'corporation_prefix' else ()
+
+    def segment_index(
+        self,
+        data: Union[pd.DataFrame, np.ndarray]
+    ) -> np.ndarray:
+        """
+        Finds the row of coefficients of every sample, the global model's
+        for segments without a model of their own.
+        """
+        labels = segment_labels(
+            data, self.key, self.spec, list(self.feature_names_in_)
+        )
+        if len(self.segments) == 0:
+            return np.zeros(len(labels), dtype=int)
+        index = np.searchsorted(self.segments, labels)
+        index = np.minimum(index, len(self.segments) - 1)
+        return np.where(
+            self.segments[index] == labels, index, len(self.segments)
+        )
+
+    def decision_function(
+        self,
+        data: Union[pd.DataFrame, np.ndarray]
+    ) -> np.ndarray:
+        """
+        Computes the confidence score of every sample under the model of
+        its segment.
+
+        Args:
+            data: pd.DataFrame or np.ndarray
+                The samples' features, along with the routing columns.
+        Returns:
+            scores: np.ndarray
+                One score per sample.
+        Raises:
+            ValueError:
+                When some feature is missing or infinite, as sklearn does.
+        """
+        index = self.segment_index(data)
+        if isinstance(data, pd.DataFrame):
+            data = data[list(self.feature_names_in_)].to_numpy()
+        scores = np.empty(len(index))
+        for start in range(0, len(index), scoring_chunksize):
+            stop = start + scoring_chunksize
+            block = np.asarray(data[start:stop], dtype='float64')
+            if not np.isfinite(block).all():
+                raise ValueError('Input contains NaN or infinity.')
+            scores[start:stop] = np.einsum(
+                'ij,ij->i', block, self.coef_[index[start:stop]]
+            )
+        return scores + self.intercept_[index]
+
+    def predict(self, data: Union[pd.DataFrame, np.ndarray]) -> np.ndarray:
+        """
+        Predicts the class of every sample with the model of its segment.
+
+        Args:
+            data: pd.DataFrame or np.ndarray
+                The samples' features, along with the routing columns.
+        Returns:
+            preds: np.ndarray
+                The predicted class of each sample.
+        """
+        return self.classes_[(self.decision_function(data) > 0).astype(int)]
@@ -0,0 +1,269 @@
+"""
+Optional SQLite backend for the ingested records. Every record is stored once,
+keyed by its row fingerprint, together with the ingestion batch that added it,
+so appends are cheap and readers can load a single batch or corporation
+without parsing the whole dataset. Records are read back in insertion order.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import sqlite3
+from datetime import datetime
+from typing import Iterator, List, Optional
+import pandas as pd
+from rowindex import row_hashes
+from schema import apply_schema, parser_dtypes, subset_schema
+
+SQL_TYPES = {'b': 'INTEGER', 'i': 'INTEGER', 'u': 'INTEGER', 'f': 'REAL'}
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def connect(db_path: str) -> sqlite3.Connection:
+    """
+    Opens the store, creating the batches table when missing.
+
+    Args:
+        db_path: str
+            Path of the SQLite database file.
+    Returns:
+        conn: sqlite3.Connection
+            An open connection to the store.
+    """
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS batches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            files TEXT NOT NULL
+        )
+        """
+    )
+    return conn
+
+
+def _create_records(conn: sqlite3.Connection, data: pd.DataFrame) -> None:
+    """
+    Creates the records table with the columns of `data`, plus the
+    insertion sequence primary key, the unique row fingerprint, the batch
+    column and their indexes.
+    """
+    columns = []
+    for col in data.columns:
+        dtype = data[col].dtype
+        kind = dtype.kind if hasattr(dtype, 'kind') else 'O'
+        columns.append(f'{_quote(col)} {SQL_TYPES.get(kind, "TEXT")}')
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS records (
+            seq INTEGER PRIMARY KEY,
+            fingerprint INTEGER NOT NULL UNIQUE,
+            {', '.join(columns)},
+            batch INTEGER NOT NULL REFERENCES batches(id)
+        )
+        """
+    )
+    conn.execute('CREATE INDEX IF NOT EXISTS records_batch ON records(batch)')
+    if 'corporation' in data.columns:
+        conn.execute(
+            'CREATE INDEX IF NOT EXISTS records_corporation '
+            'ON records(corporation)'
+        )
+
+
+def is_store(path: str) -> bool:
+    """
+    Tells whether a data path points to a SQLite store rather than a folder
+    of csv files.
+    """
+    return os.path.isfile(path) and path.endswith(('.db', '.sqlite'))
+
+
+def stored_columns(db_path: str) -> List[str]:
+    """
+    Returns the dataset columns of the records stored in a SQLite store.
+    """
+    conn = connect(db_path)
+    try:
+        return record_columns(conn)
+    finally:
+        conn.close()
+
+
+def record_columns(conn: sqlite3.Connection) -> List[str]:
+    """
+    Returns the dataset columns of the records table, in insertion order.
+    """
+    info = conn.execute('PRAGMA table_info(records)').fetchall()
+    return [
+        el[1] for el in info if el[1] not in ('seq', 'fingerprint', 'batch')
+    ]
+
+
+def ingest_files(
+    db_path: str,
+    paths: List[str],
+    chunksize: int = 100000
+) -> int:
+    """
+    Inserts the records of the given csv files as a new batch, in a single
+    transaction. Records whose fingerprint is already stored are skipped, so
+    duplicates are dropped across files and batches.
+
+    Args:
+        db_path: str
+            Path of the SQLite database file.
+        paths: List[str]
+            Paths of the csv files to be ingested.
+        chunksize: int
+            Number of rows read from the files and inserted at a time.
+    Returns:
+        inserted: int
+            Number of new records stored.
+    """
+    conn = connect(db_path)
+    try:
+        with conn:
+            batch = conn.execute(
+                'INSERT INTO batches (created_at, files) VALUES (?, ?)',
+                (datetime.now().isoformat(), ', '.join(
+                    os.path.basename(el) for el in paths
+                ))
+            ).lastrowid
+            before = conn.total_changes
+            columns = record_columns(conn)
+            for path in paths:
+                reader = pd.read_csv(
+                    path, dtype=parser_dtypes, chunksize=chunksize
+                )
+                for chunk in reader:
+                    chunk = apply_schema(chunk, source=path)
+                    if not columns:
+                        _create_records(conn, chunk)
+                        columns = chunk.columns.tolist()
+                    chunk = chunk.reindex(columns=columns)
+
+                    values = chunk.astype(object).where(chunk.notna(), None)
+                    values.insert(
+                        0, 'fingerprint', row_hashes(chunk).view('int64')
+                    )
+                    values['batch'] = batch
+                    names = ['fingerprint'] + columns + ['batch']
+                    conn.executemany(
+                        f"""
+                        INSERT OR IGNORE INTO records
+                        ({', '.join(_quote(el) for el in names)})
+                        VALUES ({', '.join('?' * len(names))})
+                        """,
+                        values.itertuples(index=False, name=None)
+                    )
+            inserted = conn.total_changes - before
+    finally:
+        conn.close()
+    return inserted
+
+
+def last_batch(db_path: str) -> int:
+    """
+    Returns the id of the latest ingestion batch, or 0 for an empty store.
+    """
+    conn = connect(db_path)
+    try:
+        return conn.execute('SELECT MAX(id) FROM batches').fetchone()[0] or 0
+    finally:
+        conn.close()
+
+
+def _query(
+    columns: Optional[List[str]],
+    batch: Optional[int],
+    corporation: Optional[str],
+    after_batch: Optional[int] = None
+):
+    """
+    Builds the select statement and parameters of a filtered read. Rows are
+    sorted by batch and rowid, which is the insertion sequence.
+    """
+    selected = '*' if columns is None else ', '.join(
+        _quote(el) for el in columns
+    )
+    filters, params = [], []
+    if batch is not None:
+        filters.append('batch = ?')
+        params.append(batch)
+    if corporation is not None:
+        filters.append('corporation = ?')
+        params.append(corporation)
+    if after_batch is not None:
+        filters.append('batch > ?')
+        params.append(after_batch)
+    where = f"WHERE {' AND '.join(filters)}" if filters else ''
+    return (
+        f'SELECT {selected} FROM records {where} ORDER BY batch, rowid',
+        params
+    )
+
+
+def read_records(
+    db_path: str,
+    columns: Optional[List[str]] = None,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None
+) -> pd.DataFrame:
+    """
+    Reads the stored records, optionally only those of a batch and/or
+    corporation. The lookups use the indexes on both columns.
+
+    Args:
+        db_path: str
+            Path of the SQLite database file.
+        columns: List[str]
+            Dataset columns to be read. Reads every dataset column when None.
+        batch: int
+            Ingestion batch whose records should be read.
+        corporation: str
+            Corporation whose records should be read.
+    Returns:
+        data: pd.DataFrame
+            The selected records, with the declared dtype schema applied.
+    """
+    conn = connect(db_path)
+    try:
+        if columns is None:
+            columns = record_columns(conn)
+        sql, params = _query(columns, batch, corporation)
+        data = pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+    return apply_schema(data, subset_schema(data.columns), db_path)
+
+
+def iter_records(
+    db_path: str,
+    columns: Optional[List[str]] = None,
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None,
+    chunksize: int = 100000,
+    after_batch: Optional[int] = None
+) -> Iterator[pd.DataFrame]:
+    """
+    Same as read_records, yielding the records in chunks of `chunksize` rows.
+    When `after_batch` is given, only records of later batches are read.
+    """
+    conn = connect(db_path)
+    try:
+        if columns is None:
+            columns = record_columns(conn)
+        sql, params = _query(columns, batch, corporation, after_batch)
+        for chunk in pd.read_sql_query(
+            sql, conn, params=params, chunksize=chunksize
+        ):
+            yield apply_schema(chunk, subset_schema(chunk.columns), db_path)
+    finally:
+        conn.close()
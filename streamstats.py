@@ -0,0 +1,525 @@
+"""
+Streaming statistics of the numeric columns of a dataset, for datasets
+larger than memory. The data is read in chunks and each column keeps running
+moments and a KLL quantile sketch, both mergeable: partial states built over
+different files or row ranges, possibly in parallel processes, combine into
+the state of the whole dataset.
+
+Moments are computed per chunk with vectorized reductions and folded into
+the running count, mean and sum of squared deviations with the pairwise
+update of Chan et al., the batched form of Welford's algorithm, so they are
+as accurate as a single pass over the whole column. Missing values are
+counted and left out; min and max are exact.
+
+Quantiles come from a KLL sketch (Karnin, Lang and Liberty, 2016) with
+accuracy parameter k, "sketch_k" in config.json. It keeps O(k log(n / k))
+values per column, whatever the number of rows n. A quantile q is answered
+with a stored value whose rank in the column is within about eps * n of
+q * n, where eps = 2.3 / k ** 0.97 holds with 99% probability: about 1.3%
+for the default k = 200 and 0.3% for k = 1000. The bound is on ranks, not on
+values: the median reported is a value found between the 48.7th and the
+51.3rd percentiles of the column with k = 200.
+
+Ingestion persists the statistics of the ingested dataset next to it, in
+datastats.json with the fingerprint of the files they describe, and updates
+them with the rows it appends, so reading them back doesn't depend on the
+number of rows. They match a full recompute within the same tolerances:
+counts, missing counts, min and max exactly, mean and std up to floating
+point rounding (relative error around 1e-12), quantiles within the rank
+error above, however many ingestions built them.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+from typing import Dict, Iterator, List, Optional, Tuple
+from columnar import column_rows, dataset_columns, read_columns
+from dataloader import (
+    dataset_fingerprint, iter_data, list_csv_files, loader_chunksize
+)
+from schema import apply_schema, parser_dtypes, subset_schema
+from sqlitestore import is_store
+
+with open('config.json','r') as f:
+    config = json.load(f)
+
+sketch_k = config.get('sketch_k', 200)
+profile_workers = config.get('profile_workers', 1)
+dataset_stats_name = 'datastats.json'
+
+
+def rank_error(k: int = sketch_k) -> float:
+    """
+    Returns the normalized rank error of a KLL sketch with parameter k, the
+    bound holding for any single quantile with 99% probability.
+    """
+    return 2.296 / k ** 0.9723
+
+
+class KLLSketch:
+    """
+    Mergeable quantile sketch of a stream of values. Values are kept in
+    levels, an item at level h standing for 2 ** h values of the stream.
+    When a level holds more items than its capacity, which shrinks
+    geometrically from k at the top level down, it is sorted and every other
+    item, starting at a random offset, is promoted to the next level.
+    """
+
+    def __init__(self, k: int = sketch_k, seed: Optional[int] = None):
+        """
+        Args:
+            k: int
+                Accuracy parameter: capacity of the top level.
+            seed: int
+                Seed of the random offsets of the compactions.
+        """
+        self.k = k
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    @property
+    def count(self) -> int:
+        """
+        Number of values summarized by the sketch.
+        """
+        return sum(len(items) << h for h, items in enumerate(self.levels))
+
+    def _capacity(self, level: int) -> int:
+        """
+        Number of items a level holds before it is compacted.
+        """
+        depth = len(self.levels) - 1 - level
+        return max(2, int(np.ceil(self.k * (2 / 3) ** depth)))
+
+    def _compress(self) -> None:
+        """
+        Compacts the lowest level over its capacity until none is.
+        """
+        while True:
+            full = [
+                h for h, items in enumerate(self.levels)
+                if len(items) > self._capacity(h)
+            ]
+            if not full:
+                return
+            h = full[0]
+            if h + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(self.levels[h])
+            # an odd item out stays at its level
+            paired = len(items) - len(items) % 2
+            promoted = items[self.rng.integers(2):paired:2]
+            self.levels[h] = items[paired:]
+            self.levels[h + 1] = np.concatenate(
+                [self.levels[h + 1], promoted]
+            )
+
+    def update(self, values: np.ndarray) -> 'KLLSketch':
+        """
+        Adds values to the sketch, ignoring missing ones.
+        """
+        values = np.asarray(values, dtype='float64')
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+        return self
+
+    def merge(self, other: 'KLLSketch') -> 'KLLSketch':
+        """
+        Adds the values summarized by another sketch, level by level.
+        """
+        for h, items in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self._compress()
+        return self
+
+    def quantiles(self, levels: List[float]) -> np.ndarray:
+        """
+        Estimates quantiles of the values summarized.
+
+        Args:
+            levels: List[float]
+                The quantiles, between 0 and 1.
+        Returns:
+            values: np.ndarray
+                For each quantile q, the first stored value whose weighted
+                rank reaches q times the count, NaN for an empty sketch.
+                While no level was compacted the sketch holds every value,
+                and the quantiles are exact, interpolated linearly between
+                order statistics like profiling.column_quantiles.
+        """
+        if self.count == 0:
+            return np.full(len(levels), np.nan)
+        if not any(len(items) for items in self.levels[1:]):
+            items = np.sort(self.levels[0])
+            positions = np.asarray(levels, dtype='float64') * (len(items) - 1)
+            lower = np.floor(positions).astype(np.intp)
+            upper = np.ceil(positions).astype(np.intp)
+            return items[lower] + (positions - lower) * (
+                items[upper] - items[lower]
+            )
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([
+            np.full(len(stored), 1 << h, dtype=np.int64)
+            for h, stored in enumerate(self.levels)
+        ])
+        order = np.argsort(items, kind='stable')
+        cumulative = np.cumsum(weights[order])
+        index = np.searchsorted(
+            cumulative, np.asarray(levels) * cumulative[-1], side='left'
+        )
+        return items[order][np.minimum(index, len(items) - 1)]
+
+    def to_state(self) -> Dict:
+        """
+        Describes the sketch as JSON-serializable values.
+        """
+        return {'k': self.k, 'levels': [el.tolist() for el in self.levels]}
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'KLLSketch':
+        """
+        Rebuilds a sketch from the values of to_state.
+        """
+        sketch = cls(state['k'])
+        sketch.levels = [
+            np.asarray(el, dtype='float64') for el in state['levels']
+        ]
+        return sketch
+
+
+class StreamingStats:
+    """
+    Running moments and quantile sketches of the numeric columns of a
+    dataset, updated chunk by chunk and mergeable with the statistics of
+    other parts of the same dataset.
+    """
+
+    def __init__(
+        self,
+        columns: Optional[List[str]] = None,
+        k: int = sketch_k
+    ):
+        """
+        Args:
+            columns: List[str]
+                The columns summarized, by default the numeric columns of
+                the first chunk.
+            k: int
+                Accuracy parameter of the quantile sketches.
+        """
+        self.k = k
+        self.rows = 0
+        self.columns = None
+        if columns is not None:
+            self._init(columns)
+
+    def _init(self, columns: List[str]) -> None:
+        """
+        Sets the columns summarized, with empty statistics.
+        """
+        width = len(columns)
+        self.columns = list(columns)
+        self.count = np.zeros(width, dtype=np.int64)
+        self.missing = np.zeros(width, dtype=np.int64)
+        self.mean = np.zeros(width)
+        self.m2 = np.zeros(width)
+        self.minimum = np.full(width, np.nan)
+        self.maximum = np.full(width, np.nan)
+        self.sketches = [KLLSketch(self.k) for _ in columns]
+
+    def _combine(
+        self,
+        rows: int,
+        count: np.ndarray,
+        missing: np.ndarray,
+        mean: np.ndarray,
+        m2: np.ndarray,
+        minimum: np.ndarray,
+        maximum: np.ndarray
+    ) -> None:
+        """
+        Folds the moments of another part of the dataset into the running
+        ones, with Chan et al.'s pairwise update.
+        """
+        total = self.count + count
+        with np.errstate(invalid='ignore', divide='ignore'):
+            share = np.where(total > 0, count / total, 0.0)
+        delta = np.where(count > 0, mean - self.mean, 0.0)
+        self.mean = self.mean + delta * share
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * share
+        self.count = total
+        self.missing = self.missing + missing
+        self.minimum = np.fmin(self.minimum, minimum)
+        self.maximum = np.fmax(self.maximum, maximum)
+        self.rows += rows
+
+    def update(self, chunk: pd.DataFrame) -> 'StreamingStats':
+        """
+        Adds a chunk of the dataset to the statistics.
+        """
+        if self.columns is None:
+            self._init(chunk.select_dtypes('number').columns.tolist())
+        x = chunk[self.columns].to_numpy(dtype='float64')
+        missing = np.isnan(x)
+        count = len(x) - missing.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, np.nansum(x, axis=0) / count, 0.0)
+        m2 = np.nansum((x - mean) ** 2, axis=0)
+        self._combine(
+            len(x),
+            count,
+            missing.sum(axis=0),
+            mean,
+            m2,
+            np.fmin.reduce(x, axis=0, initial=np.nan),
+            np.fmax.reduce(x, axis=0, initial=np.nan)
+        )
+        for j, sketch in enumerate(self.sketches):
+            sketch.update(x[:, j])
+        return self
+
+    def merge(self, other: 'StreamingStats') -> 'StreamingStats':
+        """
+        Adds the statistics of another part of the same dataset.
+        """
+        if other.columns is None:
+            return self
+        if self.columns is None:
+            self._init(other.columns)
+        if other.columns != self.columns:
+            raise ValueError(
+                f'Cannot merge statistics of columns {other.columns} into '
+                f'statistics of columns {self.columns}'
+            )
+        self._combine(
+            other.rows,
+            other.count,
+            other.missing,
+            other.mean,
+            other.m2,
+            other.minimum,
+            other.maximum
+        )
+        for sketch, other_sketch in zip(self.sketches, other.sketches):
+            sketch.merge(other_sketch)
+        return self
+
+    @property
+    def std(self) -> np.ndarray:
+        """
+        Sample standard deviation (ddof=1) of every column.
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(
+                self.count > 1, np.sqrt(self.m2 / (self.count - 1)), np.nan
+            )
+
+    def quantiles(self, levels: List[float]) -> np.ndarray:
+        """
+        Estimates quantiles of every column, one row per quantile, within
+        the rank error of the sketches.
+        """
+        return np.column_stack([
+            sketch.quantiles(levels) for sketch in self.sketches
+        ]).reshape(len(levels), len(self.sketches))
+
+    def to_state(self) -> Dict:
+        """
+        Describes the statistics as JSON-serializable values.
+        """
+        if self.columns is None:
+            return {'k': self.k, 'rows': self.rows, 'columns': None}
+        return {
+            'k': self.k,
+            'rows': self.rows,
+            'columns': self.columns,
+            'count': self.count.tolist(),
+            'missing': self.missing.tolist(),
+            'mean': self.mean.tolist(),
+            'm2': self.m2.tolist(),
+            'minimum': self.minimum.tolist(),
+            'maximum': self.maximum.tolist(),
+            'sketches': [el.to_state() for el in self.sketches]
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> 'StreamingStats':
+        """
+        Rebuilds statistics from the values of to_state.
+        """
+        stats = cls(k=state['k'])
+        stats.rows = state['rows']
+        if state['columns'] is None:
+            return stats
+        stats._init(state['columns'])
+        for name in ('count', 'missing'):
+            setattr(stats, name, np.asarray(state[name], dtype=np.int64))
+        for name in ('mean', 'm2', 'minimum', 'maximum'):
+            setattr(stats, name, np.asarray(state[name], dtype='float64'))
+        stats.sketches = [KLLSketch.from_state(el) for el in state['sketches']]
+        return stats
+
+
+def _shards(data_path: str, parts: int) -> List[Tuple]:
+    """
+    Splits a dataset into independently readable parts: row ranges of a
+    single csv file with a columnar copy, the files of a folder, or a SQLite
+    store as a whole.
+    """
+    if is_store(data_path):
+        return [(data_path, None, None)]
+    files = [os.path.join(data_path, el) for el in list_csv_files(data_path)]
+    if len(files) == 1:
+        rows = column_rows(files[0])
+        if rows is not None:
+            step = max(1, -(-rows // max(1, parts)))
+            return [
+                (files[0], start, min(start + step, rows))
+                for start in range(0, rows, step)
+            ]
+    return [(el, None, None) for el in files]
+
+
+def _iter_shard(shard: Tuple, chunksize: int) -> Iterator[pd.DataFrame]:
+    """
+    Reads a part of a dataset in chunks.
+    """
+    path, start, stop = shard
+    if is_store(path):
+        yield from iter_data(path, chunksize, deduplicate=False)
+        return
+    if start is None:
+        reader = pd.read_csv(path, dtype=parser_dtypes, chunksize=chunksize)
+        for chunk in reader:
+            yield apply_schema(chunk, source=path)
+        return
+    columns = [el for el in dataset_columns(path) if el != 'corporation']
+    for offset in range(start, stop, chunksize):
+        chunk = read_columns(
+            path, columns, offset, min(offset + chunksize, stop)
+        )
+        if chunk is None:
+            raise RuntimeError(f'{path} changed while reading')
+        yield apply_schema(chunk, subset_schema(columns), path)
+
+
+def _shard_stats(shard: Tuple, chunksize: int, k: int) -> StreamingStats:
+    """
+    Computes the statistics of a part of a dataset.
+    """
+    stats = StreamingStats(k=k)
+    for chunk in _iter_shard(shard, chunksize):
+        stats.update(chunk)
+    return stats
+
+
+def stream_stats(
+    data_path: str,
+    chunksize: int = loader_chunksize,
+    workers: int = profile_workers,
+    k: int = sketch_k
+) -> StreamingStats:
+    """
+    Computes the statistics of a dataset chunk by chunk, so memory use
+    depends on the chunk size and k and not on the dataset size. With more
+    than one worker, the files of a folder, or row ranges of a single csv
+    file with a columnar copy, are summarized in parallel processes and
+    their statistics merged. Rows aren't deduplicated: files are taken as
+    disjoint, as those of ingested datasets are.
+
+    Args:
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+        chunksize: int
+            Number of rows read at a time.
+        workers: int
+            Number of processes summarizing parts of the dataset.
+        k: int
+            Accuracy parameter of the quantile sketches.
+    Returns:
+        stats: StreamingStats
+            The statistics of the dataset.
+    """
+    shards = _shards(data_path, workers)
+    if workers > 1 and len(shards) > 1:
+        workers = min(workers, len(shards))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = list(pool.map(
+                _shard_stats,
+                shards,
+                [chunksize] * len(shards),
+                [k] * len(shards)
+            ))
+    else:
+        partials = [_shard_stats(shard, chunksize, k) for shard in shards]
+    return reduce(StreamingStats.merge, partials, StreamingStats(k=k))
+
+
+def dataset_stats_path(data_path: str) -> str:
+    """
+    Returns where the statistics of a dataset are persisted: in its folder,
+    or next to a SQLite store.
+    """
+    if is_store(data_path):
+        data_path = os.path.dirname(os.path.abspath(data_path))
+    return os.path.join(data_path, dataset_stats_name)
+
+
+def save_dataset_stats(stats: StreamingStats, data_path: str) -> None:
+    """
+    Persists the statistics of a dataset along with the fingerprint of its
+    current files, atomically.
+
+    Args:
+        stats: StreamingStats
+            The statistics of the whole dataset.
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+    """
+    path = dataset_stats_path(data_path)
+    state = {
+        'fingerprint': json.loads(json.dumps(dataset_fingerprint(data_path))),
+        'stats': stats.to_state()
+    }
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def load_dataset_stats(
+    data_path: str,
+    k: int = sketch_k
+) -> Optional[StreamingStats]:
+    """
+    Reads the persisted statistics of a dataset.
+
+    Args:
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+        k: int
+            Accuracy parameter the sketches must have been built with.
+    Returns:
+        stats: StreamingStats
+            The statistics of the dataset, or None when there are none, they
+            were built with another k or the dataset's files changed since
+            they were saved.
+    """
+    path = dataset_stats_path(data_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        state = json.load(f)
+    fingerprint = json.loads(json.dumps(dataset_fingerprint(data_path)))
+    if state['fingerprint'] != fingerprint or state['stats']['k'] != k:
+        return None
+    return StreamingStats.from_state(state['stats'])
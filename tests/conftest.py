@@ -0,0 +1,29 @@
+"""
+The project's modules read config.json and look for their data folders in
+the working directory when imported, so the tests run from the project
+root, with the metrics of the stages they run logged to a temporary file.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import sys
+import pytest
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(root)
+sys.path.insert(0, root)
+
+
+@pytest.fixture(autouse=True)
+def metrics_log(tmp_path, monkeypatch):
+    """
+    Logs the metrics of the instrumented stages to a temporary file, with
+    the measuring on even after importing the app, which turns it off.
+    """
+    import instrumentation
+    log_path = str(tmp_path / 'metrics.jsonl')
+    monkeypatch.setattr(instrumentation, 'metrics_log_path', log_path)
+    monkeypatch.setattr(instrumentation, '_enabled', True)
+    return log_path
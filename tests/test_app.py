@@ -0,0 +1,218 @@
+"""
+Tests of the API endpoints, against the deployed model and the data of the
+repository.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import json
+import os
+import struct
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+import app as api
+import diagnostics
+from sklearn.linear_model import LogisticRegression
+from modelartifact import load_model, model_version, save_artifact
+from payloads import encode_npz
+from resultcache import ResultCache
+
+features = ['lastmonth_activity', 'lastyear_activity', 'number_of_employees']
+
+
+@pytest.fixture
+def client():
+    return api.app.test_client()
+
+
+def test_malformed_request_batched_with_a_valid_one_is_rejected():
+    data = pd.read_csv('testdata/testdata.csv')
+    expected = load_model(api.prod_deployment_path).predict(data[features])
+    valid = data[features].to_dict(orient='records')
+    malformed = [{'lastmonth_activity': 10}]
+    results = {}
+
+    def post(name, records):
+        with api.app.test_client() as client:
+            results[name] = client.post('/prediction', json=records)
+
+    for _ in range(20):
+        threads = [
+            threading.Thread(target=post, args=('valid', valid)),
+            threading.Thread(target=post, args=('malformed', malformed))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        assert results['valid'].status_code == 200
+        assert results['valid'].get_json() == expected.tolist()
+        assert results['malformed'].status_code == 400
+        assert b'Missing columns' in results['malformed'].data
+
+
+def test_records_are_accepted_in_every_payload_format(client):
+    data = pd.read_csv('testdata/testdata.csv')
+    expected = load_model(api.prod_deployment_path).predict(data[features])
+    split = data.to_dict(orient='split')
+    bodies = [
+        (json.dumps(data.to_dict(orient='records')), 'application/json'),
+        (json.dumps(data.to_dict(orient='list')), 'application/json'),
+        (json.dumps({'columns': split['columns'], 'data': split['data']}),
+         'application/json'),
+        (data.to_csv(index=False), 'text/csv'),
+        (encode_npz(data), 'application/x-npz')
+    ]
+
+    for body, content_type in bodies:
+        response = client.post(
+            '/prediction', data=body, content_type=content_type
+        )
+        assert response.status_code == 200
+        assert response.get_json() == expected.tolist()
+
+    response = client.post(
+        '/prediction', data='<records/>', content_type='application/xml'
+    )
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('records', [
+    [{'lastmonth_activity': None, 'lastyear_activity': 1,
+      'number_of_employees': 2}],
+    [{'lastmonth_activity': 'abc', 'lastyear_activity': 1,
+      'number_of_employees': 2}]
+])
+def test_invalid_feature_values_are_rejected(client, records):
+    response = client.post('/prediction', json=records)
+
+    assert response.status_code == 400
+    assert b'Invalid records' in response.data
+
+
+def read_frames(body: bytes, dtype: str) -> np.ndarray:
+    """
+    Decodes a stream of length-prefixed binary frames.
+    """
+    chunks, offset = [], 0
+    while offset < len(body):
+        (size,) = struct.unpack_from('<I', body, offset)
+        count = size // np.dtype(dtype).itemsize
+        chunks.append(np.frombuffer(body, dtype, count, offset + 4))
+        offset += 4 + size
+    return np.concatenate(chunks)
+
+
+def test_streamed_predictions_match_the_regular_ones(client):
+    expected = client.get('/prediction?data_path=testdata').get_json()
+    ndjson = client.get('/prediction?data_path=testdata&stream=1')
+    binary = client.get(
+        '/prediction?data_path=testdata&stream=1&format=binary'
+    )
+
+    assert ndjson.status_code == 200
+    streamed = [json.loads(el) for el in ndjson.data.splitlines()]
+    assert sum(streamed, []) == expected
+    assert binary.status_code == 200
+    assert read_frames(
+        binary.data, binary.headers['X-Prediction-Dtype']
+    ).tolist() == expected
+
+
+@pytest.mark.parametrize('stream', ['0', '1'])
+@pytest.mark.parametrize('query, status', [
+    ('', 400), ('data_path=nosuchfolder', 404)
+])
+def test_missing_datasets_get_an_error_status(client, stream, query, status):
+    response = client.get(f'/prediction?{query}&stream={stream}')
+
+    assert response.status_code == status
+
+
+@pytest.mark.parametrize('stream', ['0', '1'])
+def test_dataset_lacking_features_gets_an_error_status(tmp_path, monkeypatch,
+                                                        client, stream):
+    import dataloader
+    monkeypatch.setattr(
+        dataloader, 'arrays_path', str(tmp_path / 'featurearrays')
+    )
+    data = pd.read_csv('testdata/testdata.csv')
+    data.drop(columns='lastyear_activity').to_csv(
+        tmp_path / 'testdata.csv', index=False
+    )
+    response = client.get(
+        f'/prediction?data_path={tmp_path}&stream={stream}'
+    )
+
+    assert response.status_code == 400
+    assert b'lastyear_activity' in response.data
+
+
+def test_results_are_cached_until_their_data_change(tmp_path, monkeypatch,
+                                                     client):
+    data = pd.read_csv('testdata/testdata.csv')
+    data.to_csv(tmp_path / 'finaldata.csv', index=False)
+    for module in (api, diagnostics):
+        monkeypatch.setattr(module, 'ingested_data_path', str(tmp_path))
+    monkeypatch.setattr(diagnostics, 'dataset_csv_path', str(tmp_path))
+    monkeypatch.setattr(api, 'result_cache', ResultCache())
+    computed = []
+    summary = diagnostics.dataframe_summary
+    monkeypatch.setattr(
+        api, 'dataframe_summary', lambda: computed.append(1) or summary()
+    )
+
+    first = client.get('/summarystats')
+    etag = first.headers['ETag']
+    cached = client.get('/summarystats')
+    revalidated = client.get(
+        '/summarystats', headers={'If-None-Match': etag}
+    )
+    assert first.status_code == cached.status_code == 200
+    assert cached.data == first.data
+    assert revalidated.status_code == 304
+    assert len(computed) == 1
+
+    pd.concat([data, data.head(1).assign(lastmonth_activity=10 ** 6)]).to_csv(
+        tmp_path / 'finaldata.csv', index=False
+    )
+    changed = client.get('/summarystats', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.data != first.data
+    assert len(computed) == 2
+
+
+def test_published_model_is_reloaded(tmp_path, monkeypatch, client):
+    deployed = tmp_path / 'deployed'
+    staged = tmp_path / 'staged'
+    deployed.mkdir()
+    staged.mkdir()
+    monkeypatch.setattr(api, 'prod_deployment_path', str(deployed))
+    data = pd.read_csv('testdata/testdata.csv')
+    records = data[features].to_dict(orient='records')
+    models = [
+        LogisticRegression(max_iter=10000).fit(data[features], labels)
+        for labels in (data['exited'], 1 - data['exited'])
+    ]
+
+    save_artifact(models[0], str(deployed))
+    first = client.get('/modelinfo').get_json()
+    before = client.post('/prediction', json=records).get_json()
+    # published as deployment.py does, by replacing the file
+    os.replace(
+        save_artifact(models[1], str(staged)),
+        deployed / 'trainedmodel.npy'
+    )
+    second = client.get('/modelinfo').get_json()
+    after = client.post('/prediction', json=records).get_json()
+
+    assert first['source'] == 'trainedmodel.npy'
+    assert second['reloads'] == first['reloads'] + 1
+    assert second['version'] == model_version(load_model(str(deployed)))
+    assert second['version'] != first['version']
+    assert before == models[0].predict(data[features]).tolist()
+    assert after == models[1].predict(data[features]).tolist()
@@ -0,0 +1,116 @@
+"""
+Tests of the micro-batching of concurrent prediction requests.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import threading
+import time
+import numpy as np
+import pandas as pd
+import pytest
+from batching import MicroBatcher
+
+
+class BlockingModel:
+    """
+    Sums the columns of every row, keeping the frames it was called with.
+    The first call waits until released, so the requests submitted in the
+    meantime queue up into a single batch.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, records: pd.DataFrame) -> np.ndarray:
+        self.calls.append(records)
+        self.started.set()
+        self.release.wait(5)
+        return records.sum(axis=1, skipna=False).to_numpy()
+
+
+def submit_in_thread(batcher, records, results, name):
+    def run():
+        try:
+            results[name] = batcher.submit(records, timeout=5)
+        except Exception as error:
+            results[name] = error
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_for_queue(batcher, size):
+    deadline = time.monotonic() + 5
+    while batcher._queue.qsize() < size and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+
+def test_requests_are_sliced_out_of_a_shared_batch():
+    model = BlockingModel()
+    batcher = MicroBatcher(model, window_ms=50)
+    results = {}
+    threads = [submit_in_thread(
+        batcher, pd.DataFrame({'a': [0]}), results, 'first'
+    )]
+    model.started.wait(5)
+    for i in range(3):
+        threads.append(submit_in_thread(
+            batcher, pd.DataFrame({'a': [i, 10 * i]}), results, i
+        ))
+    wait_for_queue(batcher, 3)
+    model.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(model.calls) == 2
+    assert len(model.calls[1]) == 6
+    for i in range(3):
+        np.testing.assert_array_equal(results[i], [i, 10 * i])
+
+
+def test_requests_with_other_columns_are_not_padded():
+    model = BlockingModel()
+    batcher = MicroBatcher(model, window_ms=50)
+    results = {}
+    threads = [submit_in_thread(
+        batcher, pd.DataFrame({'a': [0], 'b': [0]}), results, 'first'
+    )]
+    model.started.wait(5)
+    threads += [
+        submit_in_thread(
+            batcher, pd.DataFrame({'a': [1], 'b': [2]}), results, 'valid'
+        ),
+        submit_in_thread(
+            batcher, pd.DataFrame({'a': [5]}), results, 'malformed'
+        )
+    ]
+    wait_for_queue(batcher, 2)
+    model.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert not any(el.isna().any().any() for el in model.calls)
+    np.testing.assert_array_equal(results['valid'], [3])
+    np.testing.assert_array_equal(results['malformed'], [5])
+
+
+def test_malformed_requests_are_rejected_before_queueing():
+    model = BlockingModel()
+    model.release.set()
+
+    def validate(records):
+        if 'b' not in records.columns:
+            raise KeyError(['b'])
+        return records[['a', 'b']]
+
+    batcher = MicroBatcher(model, window_ms=50, validate=validate)
+    with pytest.raises(KeyError):
+        batcher.submit(pd.DataFrame({'a': [1]}), timeout=5)
+    preds = batcher.submit(pd.DataFrame({'b': [2], 'a': [1], 'c': [9]}), 5)
+
+    np.testing.assert_array_equal(preds, [3])
+    assert [el.columns.tolist() for el in model.calls] == [['a', 'b']]
@@ -0,0 +1,55 @@
+"""
+Tests of the columnar copy of the ingested dataset.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from columnar import columns_folder, csv_to_columns, read_columns, read_dataset
+
+csv = (
+    'corporation,lastmonth_activity,lastyear_activity,'
+    'number_of_employees,exited\n'
+    'nciw,45,0,99,1\nlsid,36,234,541,0\npwls,23,555,23,0\nbqlx,15,11,190,1\n'
+)
+
+
+def test_columnar_copy_matches_csv(tmp_path):
+    csv_path = str(tmp_path / 'finaldata.csv')
+    with open(csv_path, 'w') as f:
+        f.write(csv)
+    parsed = read_dataset(csv_path)
+    csv_to_columns(csv_path)
+    mapped = read_dataset(csv_path)
+
+    pd.testing.assert_frame_equal(mapped.copy(), parsed)
+    assert isinstance(parsed['corporation'].dtype, pd.CategoricalDtype)
+    assert parsed['lastmonth_activity'].dtype == np.dtype('int32')
+
+    columns = ['exited', 'lastyear_activity']
+    pd.testing.assert_frame_equal(
+        read_dataset(csv_path, columns).copy(),
+        parsed[columns]
+    )
+
+
+def test_read_columns_maps_the_column_files(tmp_path):
+    csv_path = str(tmp_path / 'finaldata.csv')
+    with open(csv_path, 'w') as f:
+        f.write(csv)
+    csv_to_columns(csv_path)
+
+    data = read_columns(csv_path, ['lastmonth_activity', 'lastyear_activity'])
+    # a write to the column file shows through the frame when it was mapped
+    # and not copied
+    stored = np.load(
+        os.path.join(columns_folder(csv_path), 'lastyear_activity.npy'),
+        mmap_mode='r+'
+    )
+    stored[0] = 7
+    stored.flush()
+    assert data['lastyear_activity'].tolist() == [7, 234, 555, 11]
+    assert data['lastmonth_activity'].tolist() == [45, 36, 23, 15]
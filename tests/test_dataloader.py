@@ -0,0 +1,69 @@
+"""
+Tests of the feature arrays materialized by the dataset loader.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import dataloader
+
+
+def write_dataset(folder, seed: int) -> str:
+    rng = np.random.default_rng(seed)
+    folder.mkdir()
+    pd.DataFrame({
+        'corporation': [f'c{el:03d}' for el in range(20)],
+        'lastmonth_activity': rng.integers(0, 500, 20),
+        'lastyear_activity': rng.integers(0, 5000, 20),
+        'number_of_employees': rng.integers(1, 2000, 20),
+        'exited': rng.integers(0, 2, 20)
+    }).to_csv(folder / 'finaldata.csv', index=False)
+    return str(folder)
+
+
+@pytest.fixture
+def datasets(tmp_path):
+    return [write_dataset(tmp_path / el, i) for i, el in enumerate('abc')]
+
+
+def test_least_recently_used_arrays_are_pruned(tmp_path, monkeypatch,
+                                               datasets):
+    arrays_path = tmp_path / 'featurearrays'
+    monkeypatch.setattr(dataloader, 'arrays_path', str(arrays_path))
+    monkeypatch.setattr(dataloader, 'arrays_max', 2)
+    a, b, c = datasets
+
+    roots = {}
+    for i, el in enumerate((a, b)):
+        dataloader.load_arrays(el)
+        roots[el] = os.path.dirname(dataloader.arrays_folder(el))
+        os.utime(roots[el], (1000 * (i + 1), 1000 * (i + 1)))
+    dataloader.load_arrays(a)
+    x, _, _ = dataloader.load_arrays(c)
+    roots[c] = os.path.dirname(dataloader.arrays_folder(c))
+
+    assert sorted(os.listdir(arrays_path)) == sorted(
+        os.path.basename(roots[el]) for el in (a, c)
+    )
+    assert x.shape == (20, 3)
+
+
+def test_arrays_are_built_in_memory_when_output_is_read_only(
+    tmp_path, monkeypatch, datasets
+):
+    # a file where the arrays folder should be makes it impossible to create
+    (tmp_path / 'output').write_text('')
+    monkeypatch.setattr(
+        dataloader, 'arrays_path', str(tmp_path / 'output' / 'featurearrays')
+    )
+    x, y, features = dataloader.load_arrays(datasets[0])
+    x_expected, y_expected = dataloader.load_dataset(datasets[0])
+
+    assert features == x_expected.columns.tolist()
+    np.testing.assert_array_equal(x, x_expected.to_numpy(dtype='float64'))
+    np.testing.assert_array_equal(y, y_expected.to_numpy())
+    assert not x.flags.writeable and not y.flags.writeable
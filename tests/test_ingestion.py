@@ -0,0 +1,83 @@
+"""
+Tests of the streaming ingestion against the in-memory one.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import io
+import os
+import warnings
+import pytest
+import ingestion
+from schema import SchemaWarning
+
+header = 'corporation,lastmonth_activity,lastyear_activity,' \
+    'number_of_employees,exited\n'
+datasets = {
+    'dataset1.csv': [
+        'nciw,45,0,99,1', 'lsid,36,234,541,0', 'pwls,23,555,23,0',
+        'nciw,45,0,99,1', 'bqlx,15,11,190,1', 'zmei,0,0,4,1',
+        'lsid,36,234,541,0'
+    ],
+    'dataset2.csv': [
+        'wosl,,28,1,1', 'bqlx,15,11,190,1', 'xcvb,41,,8,0',
+        'wosl,,28,1,1', 'dfgh,2,3,4,0', 'pwls,23,555,23,0', 'qwer,5,6,7,1'
+    ]
+}
+
+
+@pytest.fixture
+def folders(tmp_path, monkeypatch):
+    """
+    Writes the source datasets to a temporary input folder and points the
+    ingestion to it and to a temporary output folder.
+    """
+    source = tmp_path / 'source'
+    output = tmp_path / 'output'
+    source.mkdir()
+    output.mkdir()
+    for name, rows in datasets.items():
+        (source / name).write_text(header + '\n'.join(rows) + '\n')
+    monkeypatch.setattr(ingestion, 'input_folder_path', str(source))
+    monkeypatch.setattr(ingestion, 'output_folder_path', str(output))
+    monkeypatch.setattr(
+        ingestion, 'index_path', str(output / 'rowindex.npy')
+    )
+    monkeypatch.setattr(ingestion, 'ingestion_mode', 'full')
+    return source, output
+
+
+def test_stream_ingestion_matches_full_ingestion(folders):
+    _, output = folders
+    final_path = output / 'finaldata.csv'
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', SchemaWarning)
+        full_rows = ingestion.merge_multiple_dataframes()
+        full = final_path.read_text()
+        stream_rows = ingestion.stream_multiple_dataframes(chunksize=3)
+        stream = final_path.read_text()
+
+    assert stream_rows == full_rows == 9
+    assert stream == full
+    assert 'wosl,,28,1,1\n' in stream
+    assert '45.0' not in stream
+
+
+def test_schema_violations_reported_once_per_file(folders):
+    source, _ = folders
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always')
+        ingestion.append_unique_rows(
+            str(source / 'dataset2.csv'),
+            io.StringIO(),
+            ingestion.RowIndex(),
+            chunksize=2
+        )
+
+    reports = [el for el in caught if issubclass(el.category, SchemaWarning)]
+    assert len(reports) == 1
+    message = str(reports[0].message)
+    assert 'lastmonth_activity: missing values' in message
+    assert 'lastyear_activity: missing values' in message
+    assert os.path.basename(source / 'dataset2.csv') in message
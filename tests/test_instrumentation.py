@@ -0,0 +1,46 @@
+"""
+Tests of the metrics log.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import instrumentation
+from instrumentation import instrumented, read_metrics
+
+
+def test_log_is_rotated_and_read_from_its_tail(metrics_log, monkeypatch):
+    monkeypatch.setattr(instrumentation, 'metrics_log_bytes', 4096)
+
+    @instrumented(rows=len)
+    def stage(rows):
+        return rows
+
+    for el in range(100):
+        stage([0] * el)
+
+    assert os.path.getsize(metrics_log + '.1') >= 4096
+    if os.path.exists(metrics_log):
+        assert os.path.getsize(metrics_log) < 4096
+    records = read_metrics(tail_bytes=1000)
+    assert 0 < len(records) < 10
+    assert records[-1]['rows'] == 99
+    assert [el['rows'] for el in records] == list(
+        range(100 - len(records), 100)
+    )
+    assert read_metrics(latest=True)[0]['rows'] == 99
+
+
+def test_disabled_stages_are_not_logged(metrics_log, monkeypatch):
+    monkeypatch.setattr(instrumentation, '_enabled', True)
+    instrumentation.set_enabled(False)
+
+    @instrumented()
+    def stage():
+        return 1
+
+    with instrumentation.measure('block') as record:
+        record['rows'] = 1
+    assert stage() == 1
+    assert not os.path.exists(metrics_log)
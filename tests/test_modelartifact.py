@@ -0,0 +1,94 @@
+"""
+Tests of the compact model artifact.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LogisticRegression
+from modelartifact import LinearPredictor, load_predictor, save_artifact
+from segmentation import SegmentedPredictor, band_names
+
+features = ['lastmonth_activity', 'lastyear_activity', 'number_of_employees']
+
+
+def sample(rows: int = 200, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'lastmonth_activity': rng.integers(0, 500, rows),
+        'lastyear_activity': rng.integers(0, 5000, rows),
+        'number_of_employees': rng.integers(1, 2000, rows)
+    })
+
+
+def test_linear_artifact_round_trip(tmp_path):
+    x = sample()
+    y = (x['lastmonth_activity'] > 250).astype('int8')
+    model = LogisticRegression(max_iter=1000).fit(x, y)
+    path = save_artifact(model, str(tmp_path))
+
+    for predictor in (
+        load_predictor(str(tmp_path)),
+        load_predictor(str(tmp_path), open(path, 'rb').read())
+    ):
+        assert isinstance(predictor, LinearPredictor)
+        assert list(predictor.feature_names_in_) == features
+        np.testing.assert_allclose(
+            predictor.decision_function(x), model.decision_function(x)
+        )
+        np.testing.assert_array_equal(predictor.predict(x), model.predict(x))
+        np.testing.assert_array_equal(
+            predictor.predict(x[features[::-1]]), model.predict(x)
+        )
+
+
+def test_segmented_artifact_round_trip(tmp_path):
+    rng = np.random.default_rng(1)
+    spec = {'prefix_length': 1, 'employee_bands': [10, 100, 1000]}
+    segments = np.sort(band_names(spec['employee_bands'])[1:3])
+    bundle = SegmentedPredictor(
+        'employee_band',
+        spec,
+        segments,
+        rng.normal(size=(len(segments) + 1, len(features))),
+        rng.normal(size=len(segments) + 1),
+        np.array([0, 1]),
+        features
+    )
+    save_artifact(bundle, str(tmp_path))
+    loaded = load_predictor(str(tmp_path))
+
+    assert isinstance(loaded, SegmentedPredictor)
+    assert loaded.key == bundle.key and loaded.spec == bundle.spec
+    assert loaded.segments.tolist() == segments.tolist()
+    x = sample()
+    np.testing.assert_array_equal(loaded.predict(x), bundle.predict(x))
+
+
+def test_non_finite_features_are_rejected_like_sklearn(tmp_path):
+    x = sample()
+    y = (x['lastmonth_activity'] > 250).astype('int8')
+    model = LogisticRegression(max_iter=1000).fit(x, y)
+    save_artifact(model, str(tmp_path))
+    predictor = load_predictor(str(tmp_path))
+    bundle = SegmentedPredictor(
+        'employee_band',
+        {'prefix_length': 1, 'employee_bands': [10, 100, 1000]},
+        np.array([], dtype=str),
+        model.coef_,
+        model.intercept_,
+        model.classes_,
+        features
+    )
+
+    for value in (np.nan, np.inf):
+        bad = x.astype('float64')
+        bad.loc[7, 'lastyear_activity'] = value
+        for scorer in (model, predictor, bundle):
+            with pytest.raises(ValueError):
+                scorer.predict(bad)
+    np.testing.assert_array_equal(predictor.predict(x), model.predict(x))
+    np.testing.assert_array_equal(bundle.predict(x), model.predict(x))
@@ -0,0 +1,69 @@
+"""
+Tests of the cache of the monitoring endpoints' results.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import resultcache
+from resultcache import ResultCache, file_stamp, result_key
+
+
+class Clock:
+    """
+    Stands for time.monotonic, moved forward by hand.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_entries_expire_after_their_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(resultcache.time, 'monotonic', clock)
+    cache = ResultCache(ttl=10, max_bytes=100)
+    cache.put('a', b'body', 'text/plain')
+
+    clock.now += 9
+    assert cache.get('a') == (b'body', 'text/plain')
+    clock.now += 1
+    assert cache.get('a') is None
+    assert cache._size == 0
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    cache = ResultCache(ttl=60, max_bytes=10)
+    cache.put('a', b'aaaa', 'text/plain')
+    cache.put('b', b'bbbb', 'text/plain')
+    cache.get('a')
+    cache.put('c', b'cccc', 'text/plain')
+
+    assert cache.get('b') is None
+    assert cache.get('a') == (b'aaaa', 'text/plain')
+    assert cache.get('c') == (b'cccc', 'text/plain')
+    assert cache._size == 8
+
+
+def test_bodies_larger_than_the_bound_are_not_stored():
+    cache = ResultCache(ttl=60, max_bytes=10)
+    cache.put('a', b'aaaa', 'text/plain')
+    cache.put('a', b'x' * 11, 'text/plain')
+
+    assert cache.get('a') is None
+    assert cache._size == 0
+
+
+def test_keys_depend_on_every_input(tmp_path):
+    path = tmp_path / 'metrics.jsonl'
+    assert file_stamp(str(path)) is None
+    path.write_text('{}\n')
+    stamp = file_stamp(str(path))
+
+    key = result_key('/scoring', [('a', '1')], (stamp,))
+    assert key == result_key('/scoring', [('a', '1')], (stamp,))
+    assert key != result_key('/scoring', [('a', '2')], (stamp,))
+    assert key != result_key('/diagnostics', [('a', '1')], (stamp,))
+    assert key != result_key('/scoring', [('a', '1')], (None,))
@@ -0,0 +1,70 @@
+"""
+Tests of the scoring of datasets whose columns are not in the order the
+model was trained with.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import pickle
+import pandas as pd
+import pytest
+import dataloader
+from sklearn.linear_model import LogisticRegression
+from diagnostics import model_predictions
+from modelartifact import save_artifact
+from scoring import score_model
+
+features = ['lastmonth_activity', 'lastyear_activity', 'number_of_employees']
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """
+    Trains a model on the test data, with the columns in their usual order,
+    and keeps the feature arrays of the tests in a temporary folder.
+    """
+    monkeypatch.setattr(
+        dataloader, 'arrays_path', str(tmp_path / 'featurearrays')
+    )
+    data = pd.read_csv('testdata/testdata.csv')
+    model_path = tmp_path / 'model'
+    model_path.mkdir()
+    model = LogisticRegression(C=1e4, max_iter=10000).fit(
+        data[features], data['exited']
+    )
+    with open(model_path / 'trainedmodel.pkl', 'wb') as f:
+        pickle.dump(model, f)
+    save_artifact(model, str(model_path))
+    return tmp_path, data, model
+
+
+def write_dataset(folder, data: pd.DataFrame) -> str:
+    folder.mkdir()
+    data.to_csv(folder / 'testdata.csv', index=False)
+    return str(folder)
+
+
+def test_reordered_columns_are_scored_in_model_order(workspace):
+    tmp_path, data, model = workspace
+    model_path = str(tmp_path / 'model')
+    expected = model.predict(data[features]).tolist()
+    columns = ['exited', 'number_of_employees', 'corporation',
+               'lastyear_activity', 'lastmonth_activity']
+    reordered = write_dataset(tmp_path / 'reordered', data[columns])
+    ordered = write_dataset(tmp_path / 'ordered', data)
+
+    assert model_predictions(ordered, model_path) == expected
+    assert model_predictions(reordered, model_path) == expected
+    assert score_model(reordered, model_path) == score_model(
+        ordered, model_path
+    )
+
+
+def test_missing_feature_is_rejected(workspace):
+    tmp_path, data, _ = workspace
+    partial = write_dataset(
+        tmp_path / 'partial', data.drop('lastyear_activity', axis=1)
+    )
+    with pytest.raises(ValueError, match='lastyear_activity'):
+        model_predictions(partial, str(tmp_path / 'model'))
@@ -0,0 +1,35 @@
+"""
+Tests of the SQLite backend for the ingested records.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import pandas as pd
+from sqlitestore import ingest_files, iter_records, read_records
+
+header = 'corporation,lastmonth_activity,lastyear_activity,' \
+    'number_of_employees,exited\n'
+
+
+def test_records_are_read_in_insertion_order(tmp_path):
+    first = tmp_path / 'dataset1.csv'
+    second = tmp_path / 'dataset2.csv'
+    first.write_text(header + ''.join(
+        f'c{i:03d},{i},{2 * i},{3 * i},{i % 2}\n' for i in range(50)
+    ))
+    second.write_text(header + ''.join(
+        f'c{i:03d},{i},{2 * i},{3 * i},{i % 2}\n' for i in range(40, 90)
+    ))
+    db_path = str(tmp_path / 'ingested.db')
+    assert ingest_files(db_path, [str(first)], chunksize=7) == 50
+    assert ingest_files(db_path, [str(second)], chunksize=7) == 40
+
+    data = read_records(db_path)
+    assert data['lastmonth_activity'].tolist() == list(range(90))
+    chunks = pd.concat(iter_records(db_path, chunksize=13))
+    assert chunks['corporation'].astype(str).tolist() == [
+        f'c{i:03d}' for i in range(90)
+    ]
+    assert read_records(db_path, batch=2)['lastmonth_activity'].tolist() \
+        == list(range(50, 90))
@@ -0,0 +1,73 @@
+"""
+Tests of the streaming statistics against the exact profile.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import shutil
+import numpy as np
+import pandas as pd
+import profiling
+from dataloader import load_data
+from profiling import profile_frame, profile_stats
+from streamstats import KLLSketch, StreamingStats, rank_error
+
+levels = [0.0, 0.25, 0.5, 0.75, 1.0]
+
+
+def test_uncompacted_sketch_quantiles_are_exact():
+    rng = np.random.default_rng(0)
+    values = rng.integers(0, 1000, 150).astype('float64')
+    sketch = KLLSketch(200, seed=0).update(values[:70])
+    sketch.merge(KLLSketch(200, seed=1).update(values[70:]))
+
+    assert sketch.count == 150
+    np.testing.assert_allclose(
+        sketch.quantiles(levels), np.quantile(values, levels)
+    )
+
+
+def test_sketch_quantiles_within_rank_error():
+    rng = np.random.default_rng(1)
+    values = rng.lognormal(3, 1, 200000)
+    sketch = KLLSketch(200, seed=0)
+    for chunk in np.array_split(values, 37):
+        sketch.update(chunk)
+    restored = KLLSketch.from_state(sketch.to_state())
+
+    ordered = np.sort(values)
+    for estimate in (sketch.quantiles(levels), restored.quantiles(levels)):
+        ranks = np.searchsorted(ordered, estimate) / len(values)
+        assert np.all(np.abs(ranks - levels) <= rank_error(200))
+
+
+def test_streaming_profile_matches_exact_profile():
+    rng = np.random.default_rng(2)
+    frame = pd.DataFrame({
+        'lastmonth_activity': rng.integers(0, 5000, 120),
+        'lastyear_activity': rng.integers(0, 50000, 120).astype('float64'),
+        'exited': rng.integers(0, 2, 120).astype('int8')
+    })
+    frame.loc[::7, 'lastyear_activity'] = np.nan
+    stats = StreamingStats(k=200)
+    for start in range(0, len(frame), 25):
+        stats.update(frame.iloc[start:start + 25])
+
+    exact = profile_frame(frame)
+    streamed = profile_stats(stats)
+    pd.testing.assert_frame_equal(
+        streamed[exact.columns], exact, check_dtype=False
+    )
+
+
+def test_stored_profile_of_small_data_is_exact(tmp_path):
+    shutil.copy('ingesteddata/finaldata.csv', tmp_path / 'finaldata.csv')
+    assert profiling.profile_mode == 'stored'
+
+    stored = profiling.profile_dataset(str(tmp_path))
+    exact = profile_frame(load_data(str(tmp_path)))
+    assert (tmp_path / 'datastats.json').exists()
+    pd.testing.assert_frame_equal(
+        stored[exact.columns], exact, check_dtype=False
+    )
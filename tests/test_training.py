@@ -0,0 +1,192 @@
+"""
+Tests of the training modes and of the incremental retraining.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import dataloader
+import training
+from modelartifact import load_predictor
+
+header = 'corporation,lastmonth_activity,lastyear_activity,' \
+    'number_of_employees,exited\n'
+
+
+def records(rows: int, seed: int) -> pd.DataFrame:
+    """
+    Generates records whose label mostly follows their last month activity.
+    """
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'corporation': [f'c{el:05d}' for el in rng.integers(0, 99999, rows)],
+        'lastmonth_activity': rng.integers(0, 500, rows),
+        'lastyear_activity': rng.integers(0, 5000, rows),
+        'number_of_employees': rng.integers(1, 2000, rows)
+    })
+    noise = rng.normal(0, 50, rows)
+    data['exited'] = (data['lastmonth_activity'] + noise > 250).astype(int)
+    return data
+
+
+def append_rows(folder: str, data: pd.DataFrame, generation: str) -> None:
+    """
+    Appends records to an ingested dataset and records its new state, as
+    incremental ingestion does.
+    """
+    final_path = os.path.join(folder, 'finaldata.csv')
+    exists = os.path.exists(final_path)
+    data.to_csv(final_path, mode='a', header=not exists, index=False)
+    rows = len(pd.read_csv(final_path))
+    with open(os.path.join(folder, 'ingestedstate.json'), 'w') as f:
+        json.dump({
+            'generation': generation,
+            'rows': rows,
+            'bytes': os.path.getsize(final_path)
+        }, f)
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """
+    Points the training to a temporary ingested dataset, model folder and
+    deployment folder.
+    """
+    folders = {
+        el: tmp_path / el for el in ('ingested', 'models', 'deployed')
+    }
+    for folder in folders.values():
+        folder.mkdir()
+    append_rows(str(folders['ingested']), records(400, 0), 'g1')
+    monkeypatch.setattr(
+        training, 'ingested_data_path', str(folders['ingested'])
+    )
+    monkeypatch.setattr(training, 'model_path', str(folders['models']))
+    monkeypatch.setattr(
+        training, 'prod_deployment_path', str(folders['deployed'])
+    )
+    monkeypatch.setattr(
+        training, 'best_params_path',
+        str(folders['models'] / 'bestparams.json')
+    )
+    monkeypatch.setattr(
+        dataloader, 'arrays_path', str(tmp_path / 'featurearrays')
+    )
+    return folders
+
+
+def test_out_of_core_training_rejects_missing_values(workspace):
+    data = records(50, 1).astype({'lastyear_activity': 'float64'})
+    data.loc[3, 'lastyear_activity'] = np.nan
+    append_rows(str(workspace['ingested']), data, 'g1')
+
+    with pytest.raises(ValueError, match='lastyear_activity'):
+        training.train_model(mode='out_of_core', incremental=False)
+
+
+def test_out_of_core_training_counts_rows_and_fits(workspace):
+    training.train_model(mode='out_of_core', incremental=False)
+    with open(workspace['models'] / 'trainingstate.json', 'r') as f:
+        state = json.load(f)
+    model = pd.read_pickle(workspace['models'] / 'trainedmodel.pkl')
+
+    assert state['rows'] == 400
+    data = records(200, 2)
+    x = data.drop(['corporation', 'exited'], axis=1)
+    accuracy = (model.predict(x) == data['exited']).mean()
+    assert accuracy > 0.9
+
+
+def deploy(workspace) -> None:
+    """
+    Deploys the model last trained, as deployment.py does.
+    """
+    for el in ('trainedmodel.pkl', 'trainingstate.json'):
+        with open(workspace['models'] / el, 'rb') as f:
+            (workspace['deployed'] / el).write_bytes(f.read())
+
+
+def training_state(workspace) -> dict:
+    with open(workspace['models'] / 'trainingstate.json', 'r') as f:
+        return json.load(f)
+
+
+def test_retraining_without_new_rows_is_a_no_op(workspace):
+    training.train_model(mode='memory', incremental=False)
+    deploy(workspace)
+    deployed = training_state(workspace)
+
+    for _ in range(3):
+        training.train_model(mode='memory', incremental=True)
+        deploy(workspace)
+
+    assert training_state(workspace) == deployed
+    model = pd.read_pickle(workspace['models'] / 'trainedmodel.pkl')
+    assert type(model).__name__ == 'LogisticRegression'
+
+
+def test_retraining_updates_the_model_with_new_rows(workspace):
+    training.train_model(mode='memory', incremental=False)
+    deploy(workspace)
+    append_rows(str(workspace['ingested']), records(100, 3), 'g1')
+
+    training.train_model(mode='memory', incremental=True)
+    state = training_state(workspace)
+    model = pd.read_pickle(workspace['models'] / 'trainedmodel.pkl')
+
+    assert state['incremental_updates'] == 1
+    assert state['rows'] == 500
+    assert state['position']['rows'] == 500
+    assert type(model).__name__ == 'SGDClassifier'
+    assert list(model.feature_names_in_) == [
+        'lastmonth_activity', 'lastyear_activity', 'number_of_employees'
+    ]
+    data = records(200, 4)
+    x = data.drop(['corporation', 'exited'], axis=1)
+    assert (model.predict(x) == data['exited']).mean() > 0.9
+
+
+def test_rebuilt_dataset_is_retrained_in_full(workspace):
+    training.train_model(mode='memory', incremental=False)
+    deploy(workspace)
+    append_rows(str(workspace['ingested']), records(100, 3), 'g2')
+
+    training.train_model(mode='memory', incremental=True)
+
+    assert training_state(workspace)['incremental_updates'] == 0
+    assert training_state(workspace)['rows'] == 500
+
+
+def test_segmented_training_routes_rows_to_their_segment(workspace):
+    training.train_model(mode='segmented', incremental=False)
+    bundle = pd.read_pickle(workspace['models'] / 'trainedmodel.pkl')
+    predictor = load_predictor(str(workspace['models']))
+
+    # the two lowest employee bands have too few rows for a model of their own
+    assert bundle.segments.tolist() == ['[100, 1000)', '[1000, inf)']
+    assert training_state(workspace)['mode'] == 'segmented'
+    data = records(200, 5)
+    np.testing.assert_allclose(
+        predictor.decision_function(data), bundle.decision_function(data)
+    )
+    small = data['number_of_employees'].to_numpy() < 100
+    x = data.drop(['corporation', 'exited'], axis=1).to_numpy('float64')
+    np.testing.assert_allclose(
+        bundle.decision_function(data)[small],
+        x[small] @ bundle.coef_[-1] + bundle.intercept_[-1]
+    )
+    assert (predictor.predict(data) == data['exited']).mean() > 0.8
+
+
+def test_segments_fitted_in_parallel_match_serial_ones(workspace):
+    serial, _ = training.train_model_segmented(workers=1)
+    parallel, _ = training.train_model_segmented(workers=2)
+
+    assert parallel.segments.tolist() == serial.segments.tolist()
+    np.testing.assert_allclose(parallel.coef_, serial.coef_)
+    np.testing.assert_allclose(parallel.intercept_, serial.intercept_)
@@ -0,0 +1,97 @@
+"""
+Tests of the hyperparameter search and of its results cache.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import tuning
+
+grid = {'C': [0.1, 1.0], 'penalty': ['l1', 'l2'], 'solver': ['lbfgs']}
+
+
+def write_dataset(folder, rows: int, seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    data = pd.DataFrame({
+        'corporation': [f'c{el:04d}' for el in range(rows)],
+        'lastmonth_activity': rng.integers(0, 500, rows),
+        'lastyear_activity': rng.integers(0, 5000, rows),
+        'number_of_employees': rng.integers(1, 2000, rows)
+    })
+    data['exited'] = (data['lastmonth_activity'] > 250).astype(int)
+    data.to_csv(folder / 'finaldata.csv', index=False)
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """
+    Points the search to a temporary dataset and models folder, counting
+    the candidates evaluated.
+    """
+    ingested = tmp_path / 'ingested'
+    ingested.mkdir()
+    write_dataset(ingested, 120, 0)
+    tuning_path = tmp_path / 'tuning'
+    monkeypatch.setattr(tuning, 'ingested_data_path', str(ingested))
+    monkeypatch.setattr(tuning, 'tuning_path', str(tuning_path))
+    monkeypatch.setattr(
+        tuning, 'results_path', str(tuning_path / 'results.jsonl')
+    )
+    monkeypatch.setattr(
+        tuning, 'best_params_path', str(tmp_path / 'bestparams.json')
+    )
+    evaluated = []
+    evaluate = tuning.evaluate
+
+    def counted(key, params):
+        evaluated.append(params)
+        return evaluate(key, params)
+
+    monkeypatch.setattr(tuning, 'evaluate', counted)
+    return tmp_path, ingested, evaluated
+
+
+def test_candidates_skip_unsupported_penalties():
+    assert tuning.candidates(grid) == [
+        {'C': 0.1, 'penalty': 'l2', 'solver': 'lbfgs'},
+        {'C': 1.0, 'penalty': 'l2', 'solver': 'lbfgs'}
+    ]
+    sampled = tuning.candidates(tuning.tuning_grid, 'random', 3)
+    assert len(sampled) == 3
+    assert sampled == tuning.candidates(tuning.tuning_grid, 'random', 3)
+
+
+def test_search_reuses_cached_results(workspace):
+    tmp_path, _, evaluated = workspace
+    best = tuning.tune_model('grid', grid, folds=3)
+
+    assert len(evaluated) == 2
+    with open(tmp_path / 'bestparams.json', 'r') as f:
+        assert json.load(f) == best
+    assert best['f1_mean'] == max(
+        el['f1_mean'] for el in tuning.load_results(best['data'])
+    )
+
+    assert tuning.tune_model('grid', grid, folds=3) == best
+    assert len(evaluated) == 2
+
+
+def test_new_data_prunes_previous_arrays_and_results(workspace):
+    tmp_path, ingested, evaluated = workspace
+    old_key = tuning.tune_model('grid', grid, folds=3)['data']
+    write_dataset(ingested, 150, 1)
+    new_key = tuning.tune_model('grid', grid, folds=3)['data']
+
+    assert new_key != old_key
+    assert len(evaluated) == 4
+    assert sorted(os.listdir(tmp_path / 'tuning')) == [
+        new_key, 'results.jsonl'
+    ]
+    with open(tmp_path / 'tuning' / 'results.jsonl', 'r') as f:
+        keys = {json.loads(el)['data'] for el in f}
+    assert keys == {new_key}
@@ -0,0 +1,89 @@
+"""
+Tests of the folder watcher.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import threading
+import time
+import pytest
+import watcher
+
+
+class Stop(Exception):
+    """
+    Raised by the callbacks to end the watch loop.
+    """
+
+
+def drop_file(path: str, delay: float) -> threading.Thread:
+    """
+    Writes a csv file after `delay` seconds, from another thread.
+    """
+    def write():
+        time.sleep(delay)
+        with open(path, 'w') as f:
+            f.write('a,b\n1,2\n')
+    thread = threading.Thread(target=write)
+    thread.start()
+    return thread
+
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_callback_runs_once_new_files_settle(tmp_path, use_inotify):
+    calls = []
+
+    def callback():
+        calls.append(sorted(os.listdir(tmp_path)))
+        raise Stop()
+
+    thread = drop_file(str(tmp_path / 'new.csv'), 0.1)
+    with pytest.raises(Stop):
+        watcher.watch(
+            str(tmp_path),
+            callback,
+            debounce=0.1,
+            poll_interval=0.05,
+            use_inotify=use_inotify
+        )
+    thread.join()
+    assert calls == [['new.csv']]
+
+
+def test_snapshot_skips_files_removed_while_listing(tmp_path, monkeypatch):
+    (tmp_path / 'kept.csv').write_text('a\n1\n')
+    (tmp_path / 'gone.csv').write_text('a\n1\n')
+    stat = os.stat
+
+    def racing_stat(path, *args, **kwargs):
+        if path.endswith('gone.csv'):
+            raise FileNotFoundError(path)
+        return stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(watcher.os, 'stat', racing_stat)
+    assert list(watcher._snapshot(str(tmp_path))) == ['kept.csv']
+
+
+def test_failed_pipeline_run_keeps_watching(monkeypatch, capsys):
+    import fullprocess
+    runs = []
+
+    def pipeline():
+        runs.append(len(runs))
+        if len(runs) == 1:
+            raise RuntimeError('malformed file')
+        return 'No new data was found. Ending pipeline.'
+
+    def watch(folder, callback, **kwargs):
+        callback()
+
+    monkeypatch.setattr(fullprocess, 'pipeline', pipeline)
+    monkeypatch.setattr(fullprocess, 'watch', watch)
+    fullprocess.watch_pipeline()
+
+    assert runs == [0, 1]
+    output = capsys.readouterr()
+    assert 'still watching' in output.out
+    assert 'RuntimeError: malformed file' in output.err
@@ -1,15 +1,34 @@
 '''
-Trains a Logistic Regression with the processed data available.
+Trains a Logistic Regression with the processed data available, either in
+memory or, for datasets larger than RAM, out of core with an incrementally
+trained logistic-loss SGD classifier, or as a bundle of one model per
+segment of the data fitted in parallel. When enabled, retraining warm-starts
+from the deployed model and only goes over the rows ingested since it was
+trained.
 
 Author: Paulo Souza
 Date: Mar 2023
 '''
 
+import numpy as np
 import pandas as pd
 import pickle
 import os
-from sklearn.linear_model import LogisticRegression
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.preprocessing import StandardScaler
 import json
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Tuple
+from modelartifact import save_artifact
+from segmentation import (
+    SegmentedPredictor, employee_bands, min_segment_rows, prefix_length,
+    segment_key, segment_labels, segment_workers
+)
+from instrumentation import count_rows, instrumented
+from dataloader import (
+    data_position, ingested_data_path, iter_dataset, iter_dataset_since,
+    load_arrays, load_data
+)
 
 with open('config.json','r') as f:
     config = json.load(f)
@@ -20,39 +39,379 @@ model_path = os.path.join(config['output_model_path'])
 if model_path not in current_folders:
     os.mkdir(model_path)
 
-def train_model() -> None:
+training_mode = config.get('training_mode', 'memory')
+training_chunksize = config.get('training_chunksize', 100000)
+sgd_epochs = config.get('sgd_epochs', 5)
+incremental_retraining = config.get('incremental_retraining', False)
+full_retrain_every = config.get('full_retrain_every', 10)
+incremental_eta0 = config.get('incremental_eta0', 0.01)
+prod_deployment_path = os.path.join(config['prod_deployment_path'])
+best_params_path = os.path.join(model_path, 'bestparams.json')
+
+base_params = dict(
+    C=0.1,
+    class_weight=None,
+    dual=False,
+    fit_intercept=True,
+    intercept_scaling=1,
+    #l1_ratio=0.75,
+    max_iter=200,
+    multi_class='auto',
+    n_jobs=1,
+    penalty='l2',
+    random_state=42,
+    solver='liblinear',
+    tol=0.0001,
+    verbose=0,
+    warm_start=False
+)
+
+def model_params() -> Dict:
     '''
-    Trains the model and persists a serialized version of it.
+    Returns the Logistic Regression hyperparameters, the base ones updated
+    with the winner of the last tuning.py search when there is one.
+
+    Returns:
+        params: Dict
+            Keyword arguments of LogisticRegression.
     '''
+    if not os.path.exists(best_params_path):
+        return dict(base_params)
+    with open(best_params_path, 'r') as f:
+        return dict(base_params, **json.load(f)['params'])
 
-    lr = LogisticRegression(
-        C=0.1,
-        class_weight=None,
-        dual=False,
-        fit_intercept=True,
-        intercept_scaling=1,
-        #l1_ratio=0.75,
-        max_iter=200,
-        multi_class='auto',
-        n_jobs=1,
-        penalty='l2',
-        random_state=42,
-        solver='liblinear',
-        tol=0.0001,
-        verbose=0,
-        warm_start=False
-    )
+@instrumented()
+def train_model(
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None,
+    mode: str = training_mode,
+    incremental: bool = incremental_retraining
+) -> None:
+    '''
+    Trains the model and persists a serialized version of it, its compact
+    trainedmodel.npy artifact and a trainingstate.json recording the data it
+    was trained on.
 
-    train_data = pd.read_csv(os.path.join(dataset_csv_path, 'finaldata.csv'))
-    train_data.drop('corporation', axis=1, inplace=True)
+    Args:
+        batch: int
+            Only train on the records of this ingestion batch. Requires the
+            SQLite ingestion backend.
+        corporation: str
+            Only train on the records of this corporation. Requires the
+            SQLite ingestion backend.
+        mode: str
+            'memory' to fit a LogisticRegression on the whole dataset,
+            'out_of_core' to stream it through train_model_out_of_core, or
+            'segmented' to fit a bundle of models with train_model_segmented.
+        incremental: bool
+            Whether to first try updating the deployed model with the newly
+            ingested rows through retrain_incremental. Falls back to a full
+            training when that isn't possible. Segmented bundles are always
+            trained in full.
+    '''
+    filtered = batch is not None or corporation is not None
+    retrained = None
+    if incremental and not filtered and mode != 'segmented':
+        retrained = retrain_incremental()
 
-    x_train = train_data.drop('exited', axis=1)
-    y_train = train_data['exited']
-    
-    lr.fit(x_train, y_train)
+    if retrained is not None:
+        lr, state = retrained
+    else:
+        position = None if filtered else data_position(ingested_data_path)
+        if mode == 'out_of_core':
+            lr, scaler = train_model_out_of_core(batch, corporation)
+        elif mode == 'segmented':
+            lr, scaler = train_model_segmented(batch, corporation)
+        else:
+            lr = LogisticRegression(**model_params())
+
+            x_train, y_train, features = load_arrays(
+                ingested_data_path, batch, corporation
+            )
+
+            lr.fit(x_train, y_train)
+            lr.feature_names_in_ = np.array(features, dtype=object)
+            scaler = StandardScaler().fit(x_train)
+
+        state = {
+            'mode': mode,
+            'position': position,
+            'rows': int(scaler.n_samples_seen_),
+            'scaler_mean': scaler.mean_.tolist(),
+            'scaler_scale': scaler.scale_.tolist(),
+            'incremental_updates': 0
+        }
+        count_rows(state['rows'])
     
     with open(os.path.join(model_path, 'trainedmodel.pkl'), 'wb') as f:
         pickle.dump(lr, f)
+    save_artifact(lr, model_path)
+    with open(os.path.join(model_path, 'trainingstate.json'), 'w') as f:
+        json.dump(state, f, indent=2)
+
+def retrain_incremental(
+    chunksize: int = training_chunksize,
+    epochs: int = sgd_epochs
+) -> Optional[Tuple[SGDClassifier, Dict]]:
+    '''
+    Updates the deployed model with the rows ingested since it was trained,
+    so the cost scales with the new data and not with the whole history. The
+    deployed coefficients are moved to the standardized feature space of the
+    training state, used as the starting point of a logistic-loss
+    SGDClassifier updated with partial_fit over the new rows at a constant
+    learning rate of "incremental_eta0", and folded back to raw features.
+
+    Returns None, so a full training happens instead, when there is no
+    deployed training state, the deployed model isn't a single linear model,
+    the ingested dataset was rebuilt since, or the model was already updated
+    "full_retrain_every" times in a row.
+
+    Args:
+        chunksize: int
+            Number of rows read at a time.
+        epochs: int
+            Number of passes over the new rows.
+    Returns:
+        sgd: SGDClassifier
+            The updated classifier.
+        state: Dict
+            The training state describing it.
+    '''
+    state_path = os.path.join(prod_deployment_path, 'trainingstate.json')
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, 'r') as f:
+        state = json.load(f)
+    if state['incremental_updates'] >= full_retrain_every:
+        return None
+    deployed_model = os.path.join(prod_deployment_path, 'trainedmodel.pkl')
+    with open(deployed_model, 'rb') as f:
+        deployed = pickle.load(f)
+    if isinstance(deployed, SegmentedPredictor) or \
+            getattr(deployed, 'coef_', np.empty((0, 0))).shape[0] != 1:
+        return None
+
+    position = data_position(ingested_data_path)
+    if iter_dataset_since(ingested_data_path, state['position']) is None:
+        return None
+
+    mean = np.array(state['scaler_mean'])
+    scale = np.array(state['scaler_scale'])
+    sgd = SGDClassifier(
+        loss='log_loss',
+        penalty='l2',
+        alpha=1 / (model_params()['C'] * state['rows']),
+        fit_intercept=True,
+        learning_rate='constant',
+        eta0=incremental_eta0,
+        random_state=42
+    )
+    # partial_fit keeps coef_ and intercept_ when they are already set, which
+    # is how the deployed coefficients are used as the starting point
+    sgd.coef_ = deployed.coef_ * scale
+    sgd.intercept_ = deployed.intercept_ + deployed.coef_ @ mean
+
+    rng = np.random.default_rng(42)
+    new_rows = 0
+    for epoch in range(epochs):
+        chunks = iter_dataset_since(
+            ingested_data_path, state['position'], chunksize
+        )
+        for x, y in chunks:
+            if epoch == 0:
+                check_missing(x)
+                new_rows += x.shape[0]
+                feature_names = x.columns.to_numpy(dtype=object)
+            order = rng.permutation(x.shape[0])
+            sgd.partial_fit(
+                ((x.to_numpy(dtype='float64') - mean) / scale)[order],
+                y.to_numpy()[order],
+                classes=np.array([0, 1])
+            )
+        if new_rows == 0:
+            break
+
+    count_rows(new_rows)
+    # a run without new rows leaves the model as it is, so it doesn't count
+    # towards the updates allowed before a full retraining
+    if new_rows == 0:
+        return deployed, dict(state, position=position)
+    state = dict(
+        state,
+        position=position,
+        rows=state['rows'] + new_rows,
+        incremental_updates=state['incremental_updates'] + 1
+    )
+
+    coef = sgd.coef_ / scale
+    sgd.intercept_ = sgd.intercept_ - coef @ mean
+    sgd.coef_ = coef
+    sgd.feature_names_in_ = getattr(
+        deployed, 'feature_names_in_', feature_names
+    )
+    return sgd, state
+
+def check_missing(x: pd.DataFrame) -> None:
+    '''
+    Raises a ValueError naming the features of a chunk of training data that
+    have missing values, which the linear models can't be fitted on.
+    '''
+    missing = x.columns[x.isna().any()].tolist()
+    if missing:
+        raise ValueError(
+            f'The training data has missing values in {missing}.'
+        )
+
+def train_model_out_of_core(
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None,
+    chunksize: int = training_chunksize,
+    epochs: int = sgd_epochs
+) -> Tuple[SGDClassifier, StandardScaler]:
+    '''
+    Fits a logistic-loss SGDClassifier streaming the ingested data in chunks,
+    so memory use depends on the chunk size and not on the dataset size. A
+    first pass gathers the feature means and variances, and each of the
+    following `epochs` passes updates the classifier with partial_fit on the
+    standardized, shuffled chunks. The standardization is then folded into
+    the classifier's coefficients, so the returned model takes raw features
+    like the in-memory one. Its L2 penalty matches LogisticRegression's C
+    from model_params as alpha = 1 / (C * n_samples).
+
+    Args:
+        batch: int
+            Only train on the records of this ingestion batch.
+        corporation: str
+            Only train on the records of this corporation.
+        chunksize: int
+            Number of rows read at a time.
+        epochs: int
+            Number of passes over the dataset.
+    Returns:
+        sgd: SGDClassifier
+            The trained classifier.
+        scaler: StandardScaler
+            The feature scaler fitted in the first pass.
+    Raises:
+        ValueError:
+            When the data has missing values.
+    '''
+    def chunks():
+        return iter_dataset(ingested_data_path, chunksize, batch, corporation)
+
+    scaler = StandardScaler()
+    rows = 0
+    for x, _ in chunks():
+        check_missing(x)
+        scaler.partial_fit(x.to_numpy(dtype='float64'))
+        rows += x.shape[0]
+        feature_names = x.columns.to_numpy(dtype=object)
+
+    sgd = SGDClassifier(
+        loss='log_loss',
+        penalty='l2',
+        alpha=1 / (model_params()['C'] * rows),
+        fit_intercept=True,
+        random_state=42
+    )
+    rng = np.random.default_rng(42)
+    for _ in range(epochs):
+        for x, y in chunks():
+            order = rng.permutation(x.shape[0])
+            sgd.partial_fit(
+                scaler.transform(x.to_numpy(dtype='float64'))[order],
+                y.to_numpy()[order],
+                classes=np.array([0, 1])
+            )
+
+    coef = sgd.coef_ / scaler.scale_
+    sgd.intercept_ = sgd.intercept_ - coef @ scaler.mean_
+    sgd.coef_ = coef
+    sgd.feature_names_in_ = feature_names
+    return sgd, scaler
+
+def _fit_segment(
+    x: np.ndarray,
+    y: np.ndarray
+) -> Optional[Tuple[np.ndarray, float]]:
+    '''
+    Fits a LogisticRegression on the rows of a segment, returning its
+    coefficients and intercept, or None when the segment has a single class.
+    '''
+    if np.unique(y).size < 2:
+        return None
+    lr = LogisticRegression(**model_params()).fit(x, y)
+    return lr.coef_[0], lr.intercept_[0]
+
+def train_model_segmented(
+    batch: Optional[int] = None,
+    corporation: Optional[str] = None,
+    key: str = segment_key,
+    workers: int = segment_workers
+) -> Tuple[SegmentedPredictor, StandardScaler]:
+    '''
+    Fits one LogisticRegression per segment of the ingested data, and a
+    global one used for the segments with less than "min_segment_rows" rows
+    or a single class, and for segments unseen in training. The segments
+    are fitted in parallel in a process pool when more than one worker is
+    set, each worker receiving only its segment's rows.
+
+    Args:
+        batch: int
+            Only train on the records of this ingestion batch.
+        corporation: str
+            Only train on the records of this corporation.
+        key: str
+            'corporation_prefix' or 'employee_band', see segment_labels.
+        workers: int
+            Number of processes fitting segments.
+    Returns:
+        bundle: SegmentedPredictor
+            The models of every segment.
+        scaler: StandardScaler
+            The feature scaler of the whole training data.
+    '''
+    data = load_data(
+        ingested_data_path, batch, corporation, with_corporation=True
+    )
+    labels = segment_labels(data, key)
+    features = data.drop(['corporation', 'exited'], axis=1)
+    x = np.ascontiguousarray(features.to_numpy(dtype='float64'))
+    y = data['exited'].to_numpy()
+
+    segments, inverse, counts = np.unique(
+        labels, return_inverse=True, return_counts=True
+    )
+    groups = np.split(
+        np.argsort(inverse, kind='stable'), np.cumsum(counts)[:-1]
+    )
+    fitted = [
+        el for el in range(len(segments)) if counts[el] >= min_segment_rows
+    ]
+    jobs = [(x[groups[el]], y[groups[el]]) for el in fitted] + [(x, y)]
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            fits = list(pool.map(_fit_segment, *zip(*jobs)))
+    else:
+        fits = [_fit_segment(*el) for el in jobs]
+
+    *segment_fits, global_fit = fits
+    if global_fit is None:
+        raise ValueError('The training data has a single class.')
+    kept = [
+        (segments[el], fit)
+        for el, fit in zip(fitted, segment_fits) if fit is not None
+    ]
+    bundle = SegmentedPredictor(
+        key,
+        {'prefix_length': prefix_length, 'employee_bands': employee_bands},
+        np.array([el for el, _ in kept], dtype=str),
+        np.vstack([fit[0] for _, fit in kept] + [global_fit[0]]),
+        np.array([fit[1] for _, fit in kept] + [global_fit[1]]),
+        np.unique(y),
+        features.columns.tolist()
+    )
+    return bundle, StandardScaler().fit(x)
 
 if __name__ == '__main__':
     train_model()
\ No newline at end of file
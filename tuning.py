@@ -0,0 +1,294 @@
+'''
+Hyperparameter search for the Logistic Regression trained by training.py.
+Evaluates a grid, or a random sample of it, over C, penalty and solver with
+stratified cross-validation, on a process pool. The features, labels and fold
+assignments are converted to NumPy once per dataset and shared with the
+workers as memory-mapped .npy files, and every finished candidate is appended
+to a results cache, so a rerun on the same data only evaluates the missing
+ones. The winning configuration is written to bestparams.json next to the
+model, where train_model picks it up.
+
+Author: Paulo Souza
+Date: Mar 2023
+'''
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import itertools
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import f1_score
+from sklearn.model_selection import StratifiedKFold
+from dataloader import dataset_fingerprint, ingested_data_path, load_dataset
+from training import base_params, best_params_path, model_path
+
+with open('config.json','r') as f:
+    config = json.load(f)
+
+tuning = config.get('tuning', {})
+tuning_search = tuning.get('search', 'grid')
+tuning_grid = tuning.get('grid', {
+    'C': [0.01, 0.1, 1.0, 10.0],
+    'penalty': ['l1', 'l2'],
+    'solver': ['liblinear', 'saga', 'lbfgs']
+})
+tuning_iterations = tuning.get('iterations', 10)
+tuning_folds = tuning.get('folds', 5)
+tuning_workers = tuning.get('workers', 1)
+tuning_path = os.path.join(model_path, 'tuning')
+results_path = os.path.join(tuning_path, 'results.jsonl')
+
+# penalties each solver supports, combinations outside it are skipped
+solver_penalties = {
+    'liblinear': ('l1', 'l2'),
+    'saga': ('l1', 'l2'),
+    'lbfgs': ('l2',),
+    'newton-cg': ('l2',),
+    'sag': ('l2',)
+}
+
+_arrays = {}
+
+def candidates(
+    grid: Dict[str, List],
+    search: str = 'grid',
+    iterations: int = 10,
+    seed: int = 42
+) -> List[Dict]:
+    '''
+    Lists the hyperparameter combinations to evaluate, leaving out penalties
+    their solver doesn't support.
+
+    Args:
+        grid: Dict[str, List]
+            The values to try for each parameter.
+        search: str
+            'grid' for every combination, or 'random' for a sample of
+            `iterations` of them.
+        iterations: int
+            Number of combinations sampled by the random search.
+        seed: int
+            Seed of the random search.
+    Returns:
+        candidates: List[Dict]
+            The parameters of each candidate.
+    '''
+    names = sorted(grid)
+    combos = [
+        dict(zip(names, values))
+        for values in itertools.product(*(grid[el] for el in names))
+    ]
+    combos = [
+        el for el in combos
+        if el.get('penalty', 'l2') in solver_penalties.get(
+            el.get('solver', 'liblinear'), ('l2',)
+        )
+    ]
+    if search == 'random' and iterations < len(combos):
+        rng = np.random.default_rng(seed)
+        picked = rng.choice(len(combos), size=iterations, replace=False)
+        combos = [combos[el] for el in sorted(picked)]
+    return combos
+
+def prepare_folds(
+    data_path: str = ingested_data_path,
+    folds: int = tuning_folds
+) -> str:
+    '''
+    Writes the features, labels and stratified fold ids of a dataset as .npy
+    files under models/tuning, once per dataset content and fold count. The
+    arrays prepared for previous versions of the data are removed.
+
+    Args:
+        data_path: str
+            A folder of csv files or the path of a SQLite store.
+        folds: int
+            Number of cross-validation folds.
+    Returns:
+        key: str
+            Identifies the prepared arrays and the results obtained on them.
+    '''
+    key = hashlib.sha256(
+        repr((dataset_fingerprint(data_path), folds)).encode()
+    ).hexdigest()[:16]
+    folder = os.path.join(tuning_path, key)
+    if os.path.exists(os.path.join(folder, 'folds.npy')):
+        return key
+
+    os.makedirs(folder, exist_ok=True)
+    x, y = load_dataset(data_path)
+    x = np.ascontiguousarray(x.to_numpy(dtype='float64'))
+    y = y.to_numpy(dtype='int8')
+    fold_ids = np.empty(y.shape[0], dtype='int8')
+    splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=42)
+    for fold, (_, test) in enumerate(splitter.split(x, y)):
+        fold_ids[test] = fold
+    np.save(os.path.join(folder, 'x.npy'), x)
+    np.save(os.path.join(folder, 'y.npy'), y)
+    # folds.npy goes last, its presence marks the folder as complete
+    np.save(os.path.join(folder, 'folds.npy'), fold_ids)
+    prune_folds(key)
+    return key
+
+def prune_folds(key: str) -> None:
+    '''
+    Removes the arrays prepared by prepare_folds other than the given ones,
+    which are the only ones matching the current data, along with the
+    results cached for them. The results cache is rewritten to a temporary
+    file and renamed over the old one.
+    '''
+    for el in os.listdir(tuning_path):
+        folder = os.path.join(tuning_path, el)
+        if el != key and os.path.isdir(folder):
+            _arrays.pop(el, None)
+            shutil.rmtree(folder, ignore_errors=True)
+
+    if not os.path.exists(results_path):
+        return
+    with open(results_path, 'r') as f:
+        lines = [el for el in f if el.strip()]
+    kept = [el for el in lines if json.loads(el)['data'] == key]
+    if len(kept) == len(lines):
+        return
+    tmp_path = f'{results_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.writelines(kept)
+    os.replace(tmp_path, results_path)
+
+def _load_arrays(key: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Memory-maps the arrays prepared by prepare_folds, once per process.
+    '''
+    if key not in _arrays:
+        folder = os.path.join(tuning_path, key)
+        _arrays[key] = tuple(
+            np.load(os.path.join(folder, el), mmap_mode='r')
+            for el in ('x.npy', 'y.npy', 'folds.npy')
+        )
+    return _arrays[key]
+
+def evaluate(key: str, params: Dict) -> Dict:
+    '''
+    Cross-validates a Logistic Regression with the given hyperparameters on
+    prepared arrays.
+
+    Args:
+        key: str
+            The arrays returned by prepare_folds.
+        params: Dict
+            The hyperparameters overriding training's base parameters.
+    Returns:
+        result: Dict
+            The parameters with the mean and standard deviation of the F1
+            score over the folds, and the time spent.
+    '''
+    x, y, fold_ids = _load_arrays(key)
+    start = time.perf_counter()
+    scores = []
+    for fold in range(int(fold_ids.max()) + 1):
+        test = fold_ids == fold
+        lr = LogisticRegression(**dict(base_params, **params))
+        lr.fit(x[~test], y[~test])
+        scores.append(f1_score(y[test], lr.predict(x[test])))
+    return {
+        'data': key,
+        'params': params,
+        'f1_mean': float(np.mean(scores)),
+        'f1_std': float(np.std(scores)),
+        'seconds': time.perf_counter() - start
+    }
+
+def load_results(key: str) -> List[Dict]:
+    '''
+    Reads the cached results obtained on the given prepared arrays.
+    '''
+    if not os.path.exists(results_path):
+        return []
+    with open(results_path, 'r') as f:
+        results = [json.loads(el) for el in f if el.strip()]
+    return [el for el in results if el['data'] == key]
+
+def tune_model(
+    search: str = tuning_search,
+    grid: Optional[Dict[str, List]] = None,
+    iterations: int = tuning_iterations,
+    folds: int = tuning_folds,
+    workers: int = tuning_workers
+) -> Dict:
+    '''
+    Runs the hyperparameter search on the ingested data and writes the best
+    candidate to bestparams.json, which train_model uses from then on.
+    Candidates already in the results cache for the same data and folds are
+    not evaluated again.
+
+    Args:
+        search: str
+            'grid' or 'random'.
+        grid: Dict[str, List]
+            The values to try for each parameter, the "tuning" grid of
+            config.json by default.
+        iterations: int
+            Number of candidates of the random search.
+        folds: int
+            Number of cross-validation folds.
+        workers: int
+            Number of processes evaluating candidates.
+    Returns:
+        best: Dict
+            The result of the winning candidate.
+    '''
+    key = prepare_folds(ingested_data_path, folds)
+    todo = candidates(grid or tuning_grid, search, iterations)
+    results = {
+        json.dumps(el['params'], sort_keys=True): el
+        for el in load_results(key)
+    }
+    missing = [
+        el for el in todo if json.dumps(el, sort_keys=True) not in results
+    ]
+
+    with open(results_path, 'a') as f:
+        def record(result: Dict) -> None:
+            results[json.dumps(result['params'], sort_keys=True)] = result
+            f.write(json.dumps(result) + '\n')
+            f.flush()
+
+        if workers > 1 and len(missing) > 1:
+            with ProcessPoolExecutor(
+                max_workers=min(workers, len(missing))
+            ) as pool:
+                futures = [pool.submit(evaluate, key, el) for el in missing]
+                for future in as_completed(futures):
+                    record(future.result())
+        else:
+            for el in missing:
+                record(evaluate(key, el))
+
+    best = max(
+        (results[json.dumps(el, sort_keys=True)] for el in todo),
+        key=lambda el: el['f1_mean']
+    )
+    with open(best_params_path, 'w') as f:
+        json.dump(best, f, indent=2)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--search', choices=['grid', 'random'],
+                        default=tuning_search)
+    parser.add_argument('--iterations', type=int, default=tuning_iterations)
+    parser.add_argument('--folds', type=int, default=tuning_folds)
+    parser.add_argument('--workers', type=int, default=tuning_workers)
+    args = parser.parse_args()
+    best = tune_model(
+        args.search, None, args.iterations, args.folds, args.workers
+    )
+    print(f"Best parameters: {best['params']} "
+          f"(F1 {best['f1_mean']:.4f} +/- {best['f1_std']:.4f})")
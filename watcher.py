@@ -0,0 +1,142 @@
+"""
+Watches a folder for new csv files and calls back once a burst of arrivals is
+over. Uses Linux inotify when available, so an idle watcher blocks without
+using CPU, and falls back to comparing cheap os.stat snapshots of the folder
+otherwise.
+
+Author: Paulo Souza
+Date: Mar 2023
+"""
+
+import os
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+from typing import Callable, Dict, Optional, Set, Tuple
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = os.O_NONBLOCK
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _inotify_watch(folder: str) -> Optional[int]:
+    """
+    Opens an inotify file descriptor watching for files closed after being
+    written, or moved into `folder`. Returns None when inotify isn't
+    available.
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    wd = libc.inotify_add_watch(
+        fd, os.fsencode(folder), IN_CLOSE_WRITE | IN_MOVED_TO
+    )
+    if wd < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _read_events(fd: int) -> Set[str]:
+    """
+    Drains the pending inotify events, returning the names of the files they
+    refer to.
+    """
+    names = set()
+    while True:
+        try:
+            buffer = os.read(fd, 64 * 1024)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return names
+            raise
+        offset = 0
+        while offset < len(buffer):
+            _, _, _, length = EVENT_HEADER.unpack_from(buffer, offset)
+            offset += EVENT_HEADER.size
+            name = buffer[offset:offset + length].rstrip(b'\0')
+            names.add(os.fsdecode(name))
+            offset += length
+
+
+def _snapshot(folder: str) -> Dict[str, Tuple[int, int]]:
+    """
+    Returns the size and mtime of each csv file in `folder`. Files removed
+    or renamed while the folder is listed are left out.
+    """
+    snapshot = {}
+    for el in os.listdir(folder):
+        if el.endswith('.csv'):
+            try:
+                stat = os.stat(os.path.join(folder, el))
+            except FileNotFoundError:
+                continue
+            snapshot[el] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+def watch(
+    folder: str,
+    callback: Callable[[], None],
+    debounce: float = 5.0,
+    poll_interval: float = 10.0,
+    use_inotify: bool = True
+) -> None:
+    """
+    Calls `callback` every time new or changed csv files show up in `folder`
+    and no further change happened for `debounce` seconds. With inotify only
+    files that were closed after writing, or moved in, are taken into account,
+    so incomplete files don't trigger the callback; when polling, a file is
+    taken as complete once its size and mtime stop changing. Runs forever.
+
+    Args:
+        folder: str
+            Folder to be watched.
+        callback: Callable[[], None]
+            Function called after each burst of new files.
+        debounce: float
+            Seconds without changes that end a burst of new files.
+        poll_interval: float
+            Seconds between two snapshots of the folder when inotify isn't
+            available.
+        use_inotify: bool
+            Whether to use inotify when it is available.
+    """
+    fd = _inotify_watch(folder) if use_inotify else None
+    snapshot = _snapshot(folder)
+    try:
+        while True:
+            if fd is not None:
+                select.select([fd], [], [])
+                if not any(el.endswith('.csv') for el in _read_events(fd)):
+                    continue
+            else:
+                time.sleep(poll_interval)
+                if _snapshot(folder) == snapshot:
+                    continue
+
+            while True:
+                previous = _snapshot(folder)
+                if fd is not None:
+                    ready, _, _ = select.select([fd], [], [], debounce)
+                    if ready:
+                        _read_events(fd)
+                        continue
+                else:
+                    time.sleep(debounce)
+                snapshot = _snapshot(folder)
+                if snapshot == previous:
+                    break
+
+            callback()
+    finally:
+        if fd is not None:
+            os.close(fd)